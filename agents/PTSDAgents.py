@@ -2,19 +2,23 @@
 
 import os
 import json
+import asyncio
 from typing import Dict, List, Tuple
-from openai import OpenAI
 import requests
 from dotenv import load_dotenv
 from utils.prompt_loader import load_prompt
+from agents.llm_governor import LLMOverloaded, estimate_tokens, governors_from_env, usage_tokens
 load_dotenv()
 
-# Initialize OpenAI client
-openai_client = OpenAI(
-    api_key=os.getenv("OPENAI_API_KEY"),
-    base_url="https://api.openai.com/v1"
-)
+OUTPUT_DIR = "generated_stories"
 
+def _output_path(name):
+    """Path of a debug output file, creating OUTPUT_DIR on first write rather than at import."""
+    os.makedirs(OUTPUT_DIR, exist_ok=True)
+    return os.path.join(OUTPUT_DIR, name)
+
+# OPENAI_BASE_URL points at an OpenAI-compatible server instead (a proxy, or benchmarks/fake_llm.py)
+OPENAI_BASE_URL = os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1")
 OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
 OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "llama3")
 
@@ -22,9 +26,26 @@ class UnifiedLLMClient:
     """Unified client that handles OpenAI and Ollama (free local LLM) with automatic fallback."""
     
     def __init__(self):
-        self.openai_client = openai_client
+        self._openai_client = None
         self.use_openai_first = True  # Try OpenAI first, fallback to Ollama
         self.use_ollama_first = False
+        # Async clients for the ASGI serving mode, created on first use inside the event loop
+        self._async_openai = None
+        self._async_http = None
+        # Per-provider admission control (see agents/llm_governor.py)
+        self.governors = governors_from_env()
+
+    @property
+    def openai_client(self):
+        # Created (and the openai package imported) on first use, not when the app is imported
+        if self._openai_client is None:
+            from openai import OpenAI
+            self._openai_client = OpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=OPENAI_BASE_URL)
+        return self._openai_client
+
+    def warm_up(self):
+        """Build the OpenAI client ahead of the first request."""
+        return self.openai_client
     
     def set_primary_provider(self, provider: str):
         """Set which provider to try first ('openai' or 'ollama')."""
@@ -44,35 +65,80 @@ class UnifiedLLMClient:
             return 'ollama'
         return 'openai'
     
+    def _provider_order(self):
+        # Provider order: primary, then fallback
+        if self.use_ollama_first:
+            return ['ollama', 'openai']
+        return ['openai', 'ollama']
+
+    def _all_failed(self, errors):
+        # Only capacity (never a real provider error) means the call can succeed later: a 503 with when to retry
+        if errors and all(isinstance(e, LLMOverloaded) for e in errors):
+            soonest = min(errors, key=lambda e: e.retry_after)
+            return LLMOverloaded(soonest.provider, soonest.retry_after, 'no provider available')
+        failures = [e for e in errors if not isinstance(e, LLMOverloaded)]
+        return RuntimeError(f"All providers failed. Last error: {failures[-1] if failures else None}")
+
     def chat_completion(self, messages, **kwargs):
         max_tokens = kwargs.pop('max_tokens', 2000)
         temperature = kwargs.pop('temperature', 0.7)
         model = kwargs.pop('model', 'gpt-4o')
+        priority = kwargs.pop('priority', None)  # default: the llm_priority() of the caller, else 'normal'
+        tokens = estimate_tokens(messages, max_tokens)
         
-        # Provider order: primary, then fallback
-        provider_order = []
-        if self.use_openai_first:
-            provider_order = ['openai', 'ollama']
-        elif self.use_ollama_first:
-            provider_order = ['ollama', 'openai']
-        else:
-            provider_order = ['openai', 'ollama']
-        
-        last_exception = None
-        for provider in provider_order:
+        errors = []
+        for provider in self._provider_order():
             try:
-                if provider == 'openai':
-                    return self._openai_completion(messages, model, max_tokens, temperature, **kwargs)
-                elif provider == 'ollama':
-                    return self._ollama_completion(messages, max_tokens, temperature)
+                with self.governors[provider].slot(tokens, priority) as permit:
+                    if provider == 'openai':
+                        result = self._openai_completion(messages, model, max_tokens, temperature, **kwargs)
+                    elif provider == 'ollama':
+                        result = self._ollama_completion(messages, max_tokens, temperature)
+                    permit.tokens_used = usage_tokens(result)
+                return result
+            except LLMOverloaded as e:
+                # At capacity (queue full or waited `timeout`): no fallback, so the caller does not wait
+                # in a second queue and a backlog on one provider does not spill onto the other
+                errors.append(e)
+                break
             except Exception as e:
                 print(f"{provider.capitalize()} request failed: {e}")
-                last_exception = e
+                errors.append(e)
                 continue
-        raise RuntimeError(f"All providers failed. Last error: {last_exception}")
+        raise self._all_failed(errors)
 
-    def _openai_completion(self, messages, model, max_tokens, temperature, **kwargs):
-        completion = self.openai_client.chat.completions.create(
+    async def achat_completion(self, messages, **kwargs):
+        """Async chat_completion: same providers and fallback, without holding a thread while the LLM works."""
+        max_tokens = kwargs.pop('max_tokens', 2000)
+        temperature = kwargs.pop('temperature', 0.7)
+        model = kwargs.pop('model', 'gpt-4o')
+        priority = kwargs.pop('priority', None)
+        tokens = estimate_tokens(messages, max_tokens)
+
+        errors = []
+        for provider in self._provider_order():
+            try:
+                async with self.governors[provider].aslot(tokens, priority) as permit:
+                    if provider == 'openai':
+                        result = await self._openai_completion_async(messages, model, max_tokens, temperature, **kwargs)
+                    elif provider == 'ollama':
+                        result = await self._ollama_completion_async(messages, max_tokens, temperature)
+                    permit.tokens_used = usage_tokens(result)
+                return result
+            except LLMOverloaded as e:
+                errors.append(e)
+                break
+            except Exception as e:
+                print(f"{provider.capitalize()} request failed: {e}")
+                errors.append(e)
+                continue
+        raise self._all_failed(errors)
+
+    def governor_stats(self):
+        return {name: governor.stats() for name, governor in self.governors.items()}
+
+    def _openai_request(self, messages, model, max_tokens, temperature, **kwargs):
+        return dict(
             model=model,
             messages=messages,
             max_tokens=max_tokens,
@@ -83,6 +149,8 @@ class UnifiedLLMClient:
             stop=kwargs.get('stop'),
             stream=False
         )
+
+    def _openai_result(self, completion, model):
         return {
             'content': completion.choices[0].message.content,
             'provider': 'openai',
@@ -90,27 +158,54 @@ class UnifiedLLMClient:
             'raw_response': json.loads(completion.to_json())
         }
 
-    def _ollama_completion(self, messages, max_tokens, temperature):
-        """Call Ollama local LLM via HTTP API."""
-        prompt = self._ollama_prompt_from_messages(messages)
-        payload = {
+    def _openai_completion(self, messages, model, max_tokens, temperature, **kwargs):
+        completion = self.openai_client.chat.completions.create(
+            **self._openai_request(messages, model, max_tokens, temperature, **kwargs)
+        )
+        return self._openai_result(completion, model)
+
+    async def _openai_completion_async(self, messages, model, max_tokens, temperature, **kwargs):
+        if self._async_openai is None:
+            from openai import AsyncOpenAI
+            self._async_openai = AsyncOpenAI(api_key=os.getenv("OPENAI_API_KEY"), base_url=OPENAI_BASE_URL)
+        completion = await self._async_openai.chat.completions.create(
+            **self._openai_request(messages, model, max_tokens, temperature, **kwargs)
+        )
+        return self._openai_result(completion, model)
+
+    def _ollama_payload(self, messages, max_tokens, temperature):
+        return {
             "model": OLLAMA_MODEL,
-            "prompt": prompt,
+            "prompt": self._ollama_prompt_from_messages(messages),
             "stream": False,
             "options": {
                 "num_predict": max_tokens,
                 "temperature": temperature
             }
         }
-        response = requests.post(f"{OLLAMA_BASE_URL}/api/generate", json=payload, timeout=120)
-        response.raise_for_status()
-        data = response.json()
+
+    def _ollama_result(self, data):
         return {
             'content': data.get('response', ''),
             'provider': 'ollama',
             'model': OLLAMA_MODEL,
             'raw_response': data
         }
+
+    def _ollama_completion(self, messages, max_tokens, temperature):
+        """Call Ollama local LLM via HTTP API."""
+        payload = self._ollama_payload(messages, max_tokens, temperature)
+        response = requests.post(f"{OLLAMA_BASE_URL}/api/generate", json=payload, timeout=120)
+        response.raise_for_status()
+        return self._ollama_result(response.json())
+
+    async def _ollama_completion_async(self, messages, max_tokens, temperature):
+        import httpx  # installed with openai
+        if self._async_http is None:
+            self._async_http = httpx.AsyncClient(base_url=OLLAMA_BASE_URL, timeout=120)
+        response = await self._async_http.post("/api/generate", json=self._ollama_payload(messages, max_tokens, temperature))
+        response.raise_for_status()
+        return self._ollama_result(response.json())
     
     def _ollama_prompt_from_messages(self, messages):
         prompt = ""
@@ -143,15 +238,11 @@ class OrchestratorAgent:
         self.patient_data = None
         self.current_sud = None
         self.max_plan_trials = max_plan_trials
-        self.output_dir = "generated_stories"
+        self.output_dir = OUTPUT_DIR
         
         # Set preferred provider
         client.set_primary_provider(preferred_provider)
         
-        # Create output directory if it doesn't exist
-        if not os.path.exists(self.output_dir):
-            os.makedirs(self.output_dir)
-        
     def set_preferred_provider(self, provider: str):
         """Set the preferred LLM provider ('openai' or 'ollama')."""
         client.set_primary_provider(provider)
@@ -176,6 +267,7 @@ class OrchestratorAgent:
         """
         if not self.patient_data:
             raise ValueError("Patient data must be set before generating scenarios")
+        os.makedirs(self.output_dir, exist_ok=True)
             
         # Get initial SUD level
         self.current_sud = feedback_callback("Please rate your current SUD level (0-100):")
@@ -262,8 +354,12 @@ class OrchestratorAgent:
 class PlanGenAgent:
     """Generates exposure scenario plans."""
     
-    def __init__(self):
-        self._prompt = load_prompt('plan_gen_prompt.txt')
+    PROMPT_FILE = 'plan_gen_prompt.txt'
+
+    @property
+    def _prompt(self):
+        # Read on first use (load_prompt caches it)
+        return load_prompt(self.PROMPT_FILE)
             
     def generate_plan(self, part: int, patient_data: str, previous_plan: str = None, 
                      target_sud_range: tuple = None, previous_sud: int = None, 
@@ -281,11 +377,34 @@ class PlanGenAgent:
         Returns:
             A structured plan for the scenario part
         """
+        messages = self._messages(part, patient_data, previous_plan, target_sud_range, previous_sud,
+                                  adjustment, previous_explanation, rules)
+        # Generate completion using Azure OpenAI
+        completion = client.chat_completion(
+            messages,
+            max_tokens=2000,
+            temperature=0.7,
+            model="gpt-4o"  # Use the deployment name from environment variable
+        )
+        return self._save(messages, completion)
+
+    async def agenerate_plan(self, part: int, patient_data: str, previous_plan: str = None,
+                             target_sud_range: tuple = None, previous_sud: int = None,
+                             adjustment: str = None, previous_explanation: str = None, rules: str = None) -> str:
+        """Async generate_plan (ASGI serving mode)."""
+        messages = self._messages(part, patient_data, previous_plan, target_sud_range, previous_sud,
+                                  adjustment, previous_explanation, rules)
+        completion = await client.achat_completion(messages, max_tokens=2000, temperature=0.7, model="gpt-4o")
+        # The debug file write is blocking I/O: keep it off the event loop
+        return await asyncio.to_thread(self._save, messages, completion)
+
+    def _messages(self, part, patient_data, previous_plan, target_sud_range, previous_sud,
+                  adjustment, previous_explanation, rules):
         print(f"\nPlanGenAgent: Generating plan for part {part}")
         print(f"Adjustment needed: {adjustment if adjustment else 'None'}")
         
         # Create chat prompt with system role and context
-        messages = [
+        return [
             {
                 "role": "system",
                 "content": [
@@ -311,19 +430,12 @@ class PlanGenAgent:
                 ]
             }
         ]
-        
-        # Generate completion using Azure OpenAI
-        completion = client.chat_completion(
-            messages,
-            max_tokens=2000,
-            temperature=0.7,
-            model="gpt-4o"  # Use the deployment name from environment variable
-        )
-        
+
+    def _save(self, messages, completion):
         # Extract and return the generated plan
         generated_plan = completion['content']
 
-        with open("generated_stories/plan_gen_response.txt", "w", encoding="utf-8") as f:
+        with open(_output_path("plan_gen_response.txt"), "w", encoding="utf-8") as f:
             f.write("Plan:\n" + str(messages) + "\n\n")
             f.write(generated_plan)
 
@@ -332,8 +444,12 @@ class PlanGenAgent:
 class ImpactEvalAgent:
     """Evaluates expected SUD levels for scenario plans."""
     
-    def __init__(self):
-        self._prompt = load_prompt('impact_eval_prompt.txt')
+    PROMPT_FILE = 'impact_eval_prompt.txt'
+
+    @property
+    def _prompt(self):
+        # Read on first use (load_prompt caches it)
+        return load_prompt(self.PROMPT_FILE)
             
     def evaluate_sud(self, plan: str, patient_data: str, last_patient_sud: int = None, rules: str = None) -> tuple[int, str]:
         """Evaluate expected SUD level for a scenario plan.
@@ -347,11 +463,23 @@ class ImpactEvalAgent:
         Returns:
             Expected SUD level (0-100)
         """
+        messages = self._messages(plan, patient_data, last_patient_sud, rules)
+        # Generate completion using OpenAI or Ollama
+        completion = client.chat_completion(messages, max_tokens=1000, temperature=0.3)
+        return self._parse(messages, completion)
+
+    async def aevaluate_sud(self, plan: str, patient_data: str, last_patient_sud: int = None, rules: str = None) -> tuple[int, str]:
+        """Async evaluate_sud (ASGI serving mode)."""
+        messages = self._messages(plan, patient_data, last_patient_sud, rules)
+        completion = await client.achat_completion(messages, max_tokens=1000, temperature=0.3)
+        return await asyncio.to_thread(self._parse, messages, completion)
+
+    def _messages(self, plan, patient_data, last_patient_sud, rules):
         print("\nImpactEvalAgent: Evaluating expected SUD level")
         print(f"Previous SUD level: {last_patient_sud if last_patient_sud is not None else 'Initial assessment'}")
         
         # Create chat prompt with system role and context
-        messages = [
+        return [
             {
                 "role": "system",
                 "content": [
@@ -371,13 +499,12 @@ class ImpactEvalAgent:
                 ]
             }
         ]
-        
-        # Generate completion using OpenAI or Ollama
-        completion = client.chat_completion(messages, max_tokens=1000, temperature=0.3)
+
+    def _parse(self, messages, completion):
         provider = completion.get('provider', 'openai')
         content = completion['content']
         # Save the complete response
-        with open("generated_stories/impact_eval_response.txt", "w", encoding="utf-8") as f:
+        with open(_output_path("impact_eval_response.txt"), "w", encoding="utf-8") as f:
             f.write("Prompt:\n" + str(messages))
             f.write(f"\n\nProvider: {provider}\n")
             f.write("\n\nCompletion:\n" + content)
@@ -399,8 +526,12 @@ class ImpactEvalAgent:
 class StoryGenAgent:
     """Generates detailed scenario descriptions from plans."""
     
-    def __init__(self):
-        self._prompt = load_prompt('story_gen_prompt.txt')
+    PROMPT_FILE = 'story_gen_prompt.txt'
+
+    @property
+    def _prompt(self):
+        # Read on first use (load_prompt caches it)
+        return load_prompt(self.PROMPT_FILE)
             
     def generate_story(self, part: int, plan: str, previous_parts: List[str] = None, rules: str = None) -> str:
         """Generate a detailed story from a scenario plan.
@@ -413,11 +544,30 @@ class StoryGenAgent:
         Returns:
             A detailed scenario description in Hebrew
         """
+        messages = self._messages(part, plan, previous_parts, rules)
+        # Generate completion using OpenAI
+        completion = client.chat_completion(
+            messages,
+            max_tokens=3000,
+            temperature=0.7,
+            model=os.getenv("DEPLOYMENT_NAME", "gpt-4o")  # Use the deployment name from environment variable
+        )
+        return self._save(messages, completion)
+
+    async def agenerate_story(self, part: int, plan: str, previous_parts: List[str] = None, rules: str = None) -> str:
+        """Async generate_story (ASGI serving mode)."""
+        messages = self._messages(part, plan, previous_parts, rules)
+        completion = await client.achat_completion(
+            messages, max_tokens=3000, temperature=0.7, model=os.getenv("DEPLOYMENT_NAME", "gpt-4o")
+        )
+        return await asyncio.to_thread(self._save, messages, completion)
+
+    def _messages(self, part, plan, previous_parts, rules):
         print(f"\nStoryGenAgent: Generating story for part {part}")
         print(f"Generating approximately 1000 words...")
         
         # Create chat prompt with system role and context
-        messages = [
+        return [
             {
                 "role": "system",
                 "content": [
@@ -441,17 +591,10 @@ class StoryGenAgent:
                 ]
             }
         ]
-        
-        # Generate completion using OpenAI
-        completion = client.chat_completion(
-            messages,
-            max_tokens=3000,
-            temperature=0.7,
-            model=os.getenv("DEPLOYMENT_NAME", "gpt-4o")  # Use the deployment name from environment variable
-        )
-        
+
+    def _save(self, messages, completion):
         # Extract and return the generated story
-        with open("generated_stories/story_gen_response.txt", "w", encoding="utf-8") as f:
+        with open(_output_path("story_gen_response.txt"), "w", encoding="utf-8") as f:
             f.write("Prompt:\n" + str(messages))
             f.write("\n\nCompletion:\n" + completion['content'])
 
@@ -466,6 +609,7 @@ def summarize_story_llm(text: str) -> str:
         {"role": "system", "content": "אתה מסכם סיפורים טיפוליים עבור קלינאים בעברית."},
         {"role": "user", "content": prompt}
     ]
-    completion = client.chat_completion(messages, max_tokens=200, temperature=0.4, model="gpt-4o")
+    # Summaries are bulk work: they must not take LLM capacity from live sessions
+    completion = client.chat_completion(messages, max_tokens=200, temperature=0.4, model="gpt-4o", priority='batch')
     return completion['content'].strip()
 
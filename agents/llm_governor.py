@@ -0,0 +1,347 @@
+"""Admission control for LLM calls: per-provider rate limits, in-flight slots and a priority wait queue."""
+
+import os
+import math
+import time
+import asyncio
+import itertools
+import threading
+import collections
+import contextvars
+from contextlib import contextmanager, asynccontextmanager
+
+
+class LLMOverloaded(Exception):
+    """No capacity for an LLM call: the wait queue is full or the wait timed out. retry_after is in seconds."""
+
+    def __init__(self, provider, retry_after, reason):
+        super().__init__(f"LLM provider {provider} is overloaded ({reason}); retry after {retry_after}s")
+        self.provider = provider
+        self.retry_after = retry_after
+        self.reason = reason
+
+
+class TokenBucket:
+    """
+    Allows `per_minute` units per minute, in bursts of up to `burst` (default: one minute's worth).
+    per_minute=0 means no limit. Not thread-safe; ProviderGovernor calls it under its lock.
+    """
+
+    def __init__(self, per_minute, burst=None):
+        self.rate = per_minute / 60.0
+        self.capacity = burst or per_minute
+        self.level = self.capacity
+        self.updated = time.monotonic()
+
+    def wait_time(self, amount, now):
+        """Seconds until `amount` units are available (0 if they are now)."""
+        if not self.rate:
+            return 0.0
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.rate)
+        self.updated = now
+        amount = min(amount, self.capacity)  # a request larger than the bucket waits for a full bucket
+        return 0.0 if self.level >= amount else (amount - self.level) / self.rate
+
+    def take(self, amount):
+        if self.rate:
+            self.level -= min(amount, self.capacity)
+
+    def refund(self, amount):
+        if self.rate:
+            self.level = min(self.capacity, self.level + amount)
+
+
+# Priority classes, highest first. Live patient sessions are 'interactive'; bulk jobs run as 'batch'.
+PRIORITIES = ('interactive', 'normal', 'batch')
+
+_priority = contextvars.ContextVar('llm_priority', default='normal')
+
+
+@contextmanager
+def llm_priority(priority):
+    """Run the LLM calls made inside the block (in this thread or asyncio task) with the given priority class."""
+    if priority not in PRIORITIES:
+        raise ValueError(f"Priority must be one of {', '.join(PRIORITIES)}")
+    token = _priority.set(priority)
+    try:
+        yield
+    finally:
+        _priority.reset(token)
+
+
+def current_priority():
+    return _priority.get()
+
+
+class Permit:
+    """Handed out by ProviderGovernor.slot(); set tokens_used once the response reports its usage."""
+
+    def __init__(self, tokens, priority='normal'):
+        self.tokens = tokens
+        self.priority = priority
+        self.tokens_used = None
+        self.started = time.monotonic()
+
+
+class _Waiter:
+    def __init__(self, priority, seq):
+        self.priority = priority
+        self.rank = PRIORITIES.index(priority)
+        self.seq = seq
+        self.enqueued = time.monotonic()
+
+    def key(self, now, aging):
+        # Every `aging` seconds waited moves a caller up one class, so batch work is delayed, never starved
+        return (self.rank - (now - self.enqueued) / aging if aging else self.rank, self.seq)
+
+
+class _ClassStats:
+    """Counters and recent wait times for one priority class."""
+
+    def __init__(self, window=200):
+        self.admitted = 0
+        self.rejected = 0
+        self.timed_out = 0
+        self.waits = collections.deque(maxlen=window)
+
+    def snapshot(self, waiting):
+        waits = sorted(self.waits)
+        return {
+            'waiting': waiting,
+            'admitted': self.admitted,
+            'rejected': self.rejected,
+            'timed_out': self.timed_out,
+            'wait_avg_s': round(sum(waits) / len(waits), 3) if waits else 0.0,
+            'wait_p95_s': round(waits[min(len(waits) - 1, int(len(waits) * 0.95))], 3) if waits else 0.0,
+            'wait_max_s': round(waits[-1], 3) if waits else 0.0,
+        }
+
+
+class ProviderGovernor:
+    """
+    Priority-aware admission control for one LLM provider.
+    A call needs a free in-flight slot, one request from the requests-per-minute bucket and its
+    estimated tokens from the tokens-per-minute bucket. Callers that cannot be admitted wait in
+    a queue (at most `max_waiting` per priority class) for up to `timeout` seconds; beyond that
+    LLMOverloaded is raised with a Retry-After estimate, so load is shed instead of piling up as
+    provider 429s. Unused reserved tokens are refunded when the call reports its actual usage.
+
+    Waiters are admitted by priority class (see PRIORITIES), oldest first within a class, and
+    `reserved_interactive` slots are kept for the interactive class only, so a patient's next
+    chapter never queues behind a batch run. Waiting `aging` seconds raises a caller one class
+    in the queue order (not into the reserved slots).
+    """
+
+    def __init__(self, name, max_in_flight=4, requests_per_minute=0, tokens_per_minute=0, max_waiting=100, timeout=30.0,
+                 reserved_interactive=None, aging=15.0):
+        self.name = name
+        self.max_in_flight = max_in_flight
+        if reserved_interactive is None:
+            reserved_interactive = max(1, max_in_flight // 4) if max_in_flight > 1 else 0
+        self.reserved_interactive = min(reserved_interactive, max_in_flight - 1)
+        self.max_waiting = max_waiting
+        self.timeout = timeout
+        self.aging = aging
+        self.requests = TokenBucket(requests_per_minute)
+        self.tokens = TokenBucket(tokens_per_minute)
+        self._cond = threading.Condition()
+        self._waiters = []
+        self._seq = itertools.count()
+        self._classes = {priority: _ClassStats() for priority in PRIORITIES}
+        self.in_flight = 0
+        self._latency = 20.0  # moving average of call duration (s), for Retry-After
+
+    @classmethod
+    def from_env(cls, name, **defaults):
+        """
+        Settings from LLM_<NAME>_MAX_IN_FLIGHT, _RPM, _TPM, _MAX_WAITING, _TIMEOUT, _RESERVED_INTERACTIVE
+        and _AGING, falling back to defaults.
+        """
+        prefix = f"LLM_{name.upper()}_"
+        settings = {
+            'max_in_flight': ('MAX_IN_FLIGHT', int),
+            'requests_per_minute': ('RPM', int),
+            'tokens_per_minute': ('TPM', int),
+            'max_waiting': ('MAX_WAITING', int),
+            'timeout': ('TIMEOUT', float),
+            'reserved_interactive': ('RESERVED_INTERACTIVE', int),
+            'aging': ('AGING', float),
+        }
+        kwargs = dict(defaults)
+        for key, (suffix, cast) in settings.items():
+            value = os.environ.get(prefix + suffix)
+            if value:
+                kwargs[key] = cast(value)
+        return cls(name, **kwargs)
+
+    def _slot_limit(self, waiter):
+        return self.max_in_flight if waiter.rank == 0 else self.max_in_flight - self.reserved_interactive
+
+    def _admit(self, waiter, tokens):
+        """
+        Under the lock: admit the waiter if a slot its class may use is free and no waiter ahead
+        of it in the queue order could take that slot. Returns 0 if admitted, else seconds to wait
+        (None: until a slot frees).
+        """
+        if self.in_flight >= self._slot_limit(waiter):
+            return None
+        now = time.monotonic()
+        key = waiter.key(now, self.aging)
+        for other in self._waiters:
+            if other is not waiter and self.in_flight < self._slot_limit(other) and other.key(now, self.aging) < key:
+                return None
+        wait = max(self.requests.wait_time(1, now), self.tokens.wait_time(tokens, now))
+        if wait > 0:
+            return wait
+        self.requests.take(1)
+        self.tokens.take(tokens)
+        self.in_flight += 1
+        self._waiters.remove(waiter)
+        stats = self._classes[waiter.priority]
+        stats.admitted += 1
+        stats.waits.append(now - waiter.enqueued)
+        self._cond.notify_all()  # the next waiter in line may fit in a remaining slot
+        return 0
+
+    def retry_after(self, rate_wait=None):
+        """Seconds until the current queue has roughly drained (or the rate limits allow another call)."""
+        waiting = len(self._waiters)
+        return max(1, math.ceil(max(self._latency * (waiting + 1) / self.max_in_flight, rate_wait or 0)))
+
+    def _join_queue(self, priority):
+        if sum(1 for w in self._waiters if w.priority == priority) >= self.max_waiting:
+            self._classes[priority].rejected += 1
+            raise LLMOverloaded(self.name, self.retry_after(), f'{priority} wait queue full')
+        waiter = _Waiter(priority, next(self._seq))
+        self._waiters.append(waiter)
+        return waiter
+
+    def _leave_queue(self, waiter, rate_wait):
+        self._waiters.remove(waiter)
+        self._classes[waiter.priority].timed_out += 1
+        self._cond.notify_all()
+        return LLMOverloaded(self.name, self.retry_after(rate_wait), f'no capacity within {self.timeout:g}s')
+
+    def _abandon(self, waiter):
+        """Under the lock: drop a waiter whose caller went away (cancelled, interrupted), so it does not block the queue."""
+        if waiter in self._waiters:
+            self._waiters.remove(waiter)
+            self._cond.notify_all()
+
+    def acquire(self, tokens, priority=None):
+        priority = priority or current_priority()
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            waiter = self._join_queue(priority)
+            try:
+                while True:
+                    wait = self._admit(waiter, tokens)
+                    if wait == 0:
+                        return Permit(tokens, priority)
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._leave_queue(waiter, wait)
+                    # Re-check at least every second: aging reorders the queue without a notify
+                    self._cond.wait(min(wait or 1.0, 1.0, remaining))
+            except BaseException:
+                self._abandon(waiter)
+                raise
+
+    async def aacquire(self, tokens, priority=None, poll_interval=0.05):
+        """acquire() for coroutines: waits with asyncio.sleep instead of blocking the event loop."""
+        priority = priority or current_priority()
+        deadline = time.monotonic() + self.timeout
+        with self._cond:
+            waiter = self._join_queue(priority)
+        try:
+            while True:
+                with self._cond:
+                    wait = self._admit(waiter, tokens)
+                    if wait == 0:
+                        return Permit(tokens, priority)
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        raise self._leave_queue(waiter, wait)
+                await asyncio.sleep(min(wait or poll_interval, poll_interval, remaining))
+        except BaseException:
+            # Cancelled while sleeping (client disconnect, ASGI timeout): a stale waiter would hold back everyone behind it
+            with self._cond:
+                self._abandon(waiter)
+            raise
+
+    def release(self, permit, failed=False):
+        with self._cond:
+            self.in_flight -= 1
+            if permit.tokens_used is not None and permit.tokens_used < permit.tokens:
+                self.tokens.refund(permit.tokens - permit.tokens_used)
+            if not failed:
+                self._latency = 0.8 * self._latency + 0.2 * (time.monotonic() - permit.started)
+            self._cond.notify_all()
+
+    @contextmanager
+    def slot(self, tokens, priority=None):
+        permit = self.acquire(tokens, priority)
+        failed = True
+        try:
+            yield permit
+            failed = False
+        finally:
+            self.release(permit, failed)
+
+    @asynccontextmanager
+    async def aslot(self, tokens, priority=None):
+        permit = await self.aacquire(tokens, priority)
+        failed = True
+        try:
+            yield permit
+            failed = False
+        finally:
+            self.release(permit, failed)
+
+    def stats(self):
+        with self._cond:
+            return {
+                'in_flight': self.in_flight,
+                'max_in_flight': self.max_in_flight,
+                'reserved_interactive': self.reserved_interactive,
+                'waiting': len(self._waiters),
+                'avg_latency_s': round(self._latency, 2),
+                'classes': {
+                    priority: stats.snapshot(sum(1 for w in self._waiters if w.priority == priority))
+                    for priority, stats in self._classes.items()
+                },
+            }
+
+
+def estimate_tokens(messages, max_tokens):
+    """Upper estimate of a call's token usage: ~4 characters per prompt token, plus the completion budget."""
+    chars = 0
+    for message in messages:
+        content = message.get('content')
+        if isinstance(content, str):
+            chars += len(content)
+        elif isinstance(content, list):
+            chars += sum(len(part.get('text', '')) for part in content if isinstance(part, dict))
+    return chars // 4 + max_tokens
+
+
+def usage_tokens(result):
+    """Tokens actually used according to the provider's response, or None if it does not say."""
+    raw = result.get('raw_response') or {}
+    if result.get('provider') == 'openai':
+        return (raw.get('usage') or {}).get('total_tokens')
+    if 'eval_count' in raw:
+        return raw.get('prompt_eval_count', 0) + raw['eval_count']
+    return None
+
+
+def governors_from_env():
+    """
+    One governor per provider, configured with LLM_<PROVIDER>_* environment variables.
+    Limits are per process: with N workers, set each to the provider's limit divided by N.
+    The OpenAI defaults suit a usage-tier-2 key; a local Ollama serves a couple of generations at once.
+    """
+    return {
+        'openai': ProviderGovernor.from_env('openai', max_in_flight=16, requests_per_minute=500, tokens_per_minute=450000),
+        'ollama': ProviderGovernor.from_env('ollama', max_in_flight=2),
+    }
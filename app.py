@@ -2,51 +2,237 @@
 Flask application with MongoDB integration and text-to-speech capabilities for PTSD story generation.
 """
 
-from flask import Flask, render_template, request, jsonify, send_file, session, redirect, flash, url_for
+from flask import Flask, Blueprint, current_app, render_template, request, jsonify, send_file, session, redirect, flash, url_for, Response, stream_with_context
+from werkzeug.wsgi import wrap_file
 from flask_pymongo import PyMongo
-from datetime import datetime, timedelta
+from datetime import datetime
 import os
-from agents.PTSDAgents import OrchestratorAgent, summarize_story_llm
+import threading
+import pymongo
+from agents.PTSDAgents import OrchestratorAgent, summarize_story_llm, client as llm_client
+from agents.llm_governor import LLMOverloaded, llm_priority
 from agents.PTSDEvalTools import PatientDataParser
-from services.exposure import ExposureProgressionService
+from services.exposure import ExposureProgressionService, ChapterInProgressError
 from services.exposure_plan_service import ExposurePlanService
+from services.exposure_plan_store import InMemoryPlanStore, MongoPlanStore
+from services.progress_store import InMemoryProgressStore, MongoProgressStore
+from services.audit_service import AuditService
+from services.patient_lookup_service import PatientLookupService
+from services.story_store import StoryStore
+from services.audio_store import LocalAudioStore, GridFSAudioStore
+from services.timeseries_store import TimeSeriesStore, GRANULARITIES, KINDS
+from services.cohort_reports import CohortReportJob, list_reports
+from services.patient_overview import load_overview_data, overview_entry
+from services.sync_service import SyncService
+from services.session_bundle import SessionBundleService
+from migrations import MigrationRunner
+from utils.pagination import paginate_args, _covers
+from utils.ndjson_export import EXPORTS, build_export_query, iter_ndjson, gzip_chunks
+from utils.ttl_cache import TTLCache
+from utils.lazy import LazyService
+from utils.event_bus import InMemoryEventBus, MongoEventBus, sse_stream
+from utils.json_provider import MongoJSONProvider
+from utils.http_cache import VersionStamps, conditional, compress_response
+from utils.timestamps import parse_utc
+from utils.idempotency import idempotent, InMemoryIdempotencyStore, MongoIdempotencyStore
+from utils.server_session import ServerSideSessionInterface, InMemorySessionBackend, FileSessionBackend, MongoSessionBackend
 from bson import ObjectId
 import uuid
 from flask_cors import CORS
 import socket
+import time
+import click
 
-app = Flask(__name__)
-CORS(app, supports_credentials=True, resources={r"/*": {"origins": "*"}})
-app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'dev_secret_key')
+# Routes and CLI commands are registered on this blueprint; create_app() builds the application
+bp = Blueprint('main', __name__, cli_group=None)
+mongo = PyMongo()
 
-# MongoDB configuration
-app.config["MONGO_URI"] = "mongodb://localhost:27017/ptsd_stories"
-mongo = PyMongo(app)
+# Services are built on first use (or by warm_up()), not at import: most need Mongo, and the
+# agents read prompt files and create LLM clients. Each _lazy() proxy behaves like the service.
+_services = []
+
+def _lazy(factory):
+    service = LazyService(factory)
+    _services.append(service)
+    return service
 
 # Initialize the orchestrator
-orchestrator = OrchestratorAgent(max_plan_trials=5, preferred_provider="openai")
+orchestrator = _lazy(lambda: OrchestratorAgent(max_plan_trials=5, preferred_provider="openai"))
 
-# Ensure audio directory exists
+# Story audio: AUDIO_STORAGE=gridfs shares it between nodes; the local directory only works on a single node
 AUDIO_DIR = os.path.join('static', 'audio')
-os.makedirs(AUDIO_DIR, exist_ok=True)
+audio_store = _lazy(lambda: GridFSAudioStore(mongo.db) if os.environ.get('AUDIO_STORAGE') == 'gridfs' else LocalAudioStore(AUDIO_DIR))
+
+# Plans, SUD feedback and progress live in Mongo so every worker sees the same data; 'memory' is for local dev
+def _use_memory_store():
+    return os.environ.get('EXPOSURE_STORE') == 'memory'
+
+exposure_plan_service = _lazy(lambda: ExposurePlanService(
+    store=InMemoryPlanStore() if _use_memory_store() else MongoPlanStore(mongo.db)
+))
+exposure_service = _lazy(lambda: ExposureProgressionService(
+    store=InMemoryProgressStore() if _use_memory_store() else MongoProgressStore(mongo.db.exposure_progress),
+    audio_store=audio_store.resolve()
+))
+audit_service = _lazy(lambda: AuditService(
+    mongo.db.audit,
+    delivery=os.environ.get('AUDIT_DELIVERY', 'buffered'),
+    flush_interval=float(os.environ.get('AUDIT_FLUSH_INTERVAL', 2.0))
+))
+patient_lookup_service = _lazy(lambda: PatientLookupService(mongo.db.patients))
+# STORY_STORAGE=compressed keeps story text/plan/feedback compressed in story_content
+story_store = _lazy(lambda: StoryStore(mongo.db, compress=os.environ.get('STORY_STORAGE') == 'compressed'))
+# SUD readings and app usage with hourly/daily/weekly rollups for trends and overview totals
+timeseries_store = _lazy(lambda: TimeSeriesStore(mongo.db))
+# Per-tag version counters behind the ETag/Last-Modified of the JSON list APIs
+version_stamps = _lazy(lambda: VersionStamps(mongo.db.version_stamps))
+# Dashboard aggregates, per process; see cached() for how writes on other workers reach them
+dashboard_cache = TTLCache(ttl=float(os.environ.get('DASHBOARD_CACHE_TTL', 30)))
+
+# Change notifications for dashboards (SSE); EVENT_BUS=memory only reaches clients of this process
+event_bus = _lazy(lambda: InMemoryEventBus() if os.environ.get('EVENT_BUS') == 'memory' else MongoEventBus(mongo.db.events))
+
+# Delta sync for the mobile app (stories, audio, plans, SUD feedback changed since a token)
+sync_service = _lazy(lambda: SyncService(mongo.db, story_store))
+# Offline bundles of approved chapters (story, segmented audio, plan, SUD prompts), kept in the audio store
+session_bundles = _lazy(lambda: SessionBundleService(mongo.db, story_store, audio_store))
 
-exposure_plan_service = ExposurePlanService()
-exposure_service = ExposureProgressionService()
+# Stored responses of POSTs sent with an Idempotency-Key (scenario generation), replayed to client retries
+idempotency_store = _lazy(lambda: InMemoryIdempotencyStore() if os.environ.get('IDEMPOTENCY_STORE') == 'memory' else MongoIdempotencyStore(mongo.db.idempotency_keys))
+
+def create_app(config=None, warm=None):
+    """
+    Application factory. Nothing here touches the network: Mongo connects on the first query
+    and the services above are built on first use.
+    - config: overrides for app.config (e.g. MONGO_URI)
+    - warm: run warm_up() in a background thread (default: the WARM_UP environment variable);
+      /readyz answers 503 until it has finished
+    """
+    app = Flask(__name__)
+    # jsonify/tojson encode ObjectId and datetime directly (orjson when installed)
+    app.json = MongoJSONProvider(app)
+    # gzip/brotli for JSON and HTML responses the client accepts
+    app.after_request(compress_response)
+    CORS(app, supports_credentials=True, resources={r"/*": {"origins": "*"}})
+    app.secret_key = os.environ.get('FLASK_SECRET_KEY', 'dev_secret_key')
+
+    # MongoDB configuration
+    app.config["MONGO_URI"] = "mongodb://localhost:27017/ptsd_stories"
+    app.config.update(config or {})
+    mongo.init_app(app)
+    for service in _services:
+        service.reset()
+
+    # Session data (scenario state, parsed patient data) is kept server-side; the cookie only holds the id
+    session_backend = os.environ.get('SESSION_BACKEND', 'mongo')
+    if session_backend == 'memory':
+        app.session_interface = ServerSideSessionInterface(InMemorySessionBackend())
+    elif session_backend == 'file':
+        app.session_interface = ServerSideSessionInterface(FileSessionBackend(os.environ.get('SESSION_FILE_DIR', os.path.join('instance', 'sessions'))))
+    else:
+        app.session_interface = ServerSideSessionInterface(MongoSessionBackend(mongo.db.sessions))
+
+    app.register_blueprint(bp)
+    if warm is None:
+        warm = os.environ.get('WARM_UP', '').lower() in ('1', 'true', 'yes')
+    app.extensions['warm_up'] = {'state': 'pending' if warm else 'skipped', 'error': None}
+    if warm:
+        threading.Thread(target=warm_up, args=(app,), name='warm-up', daemon=True).start()
+    return app
+
+def warm_up(app):
+    """
+    Do the first-request work ahead of traffic: build every service, create the LLM client,
+    read the prompts, import gTTS, check Mongo and create the indexes.
+    """
+    status = app.extensions.setdefault('warm_up', {'state': 'skipped', 'error': None})
+    status['state'] = 'running'
+    started = time.perf_counter()
+    try:
+        with app.app_context():
+            for service in _services:
+                service.resolve()
+            llm_client.warm_up()
+            exposure_service.story_service.warm_up()
+            mongo.cx.admin.command('ping')
+            for service in (audit_service, patient_lookup_service, event_bus, idempotency_store, sync_service, app.session_interface.backend):
+                if hasattr(service, 'ensure_indexes'):
+                    service.ensure_indexes()
+            timeseries_store.ensure_collections()
+        status['state'] = 'done'
+        print(f"[WarmUp] Done in {time.perf_counter() - started:.1f}s")
+    except Exception as e:
+        # Not fatal: whatever did not warm up is built on first use
+        status.update(state='failed', error=str(e))
+        print(f"[WarmUp] Failed: {e}")
+
+@bp.route('/healthz')
+def liveness():
+    """Liveness probe: the process is up and serving. No dependencies are checked."""
+    return jsonify({'status': 'alive'})
+
+@bp.route('/readyz')
+def readiness():
+    """Readiness probe: Mongo answers a ping and warm-up (when enabled) is no longer running."""
+    checks = {'warm_up': current_app.extensions['warm_up']['state']}
+    try:
+        with pymongo.timeout(float(os.environ.get('READINESS_TIMEOUT', 2))):
+            mongo.cx.admin.command('ping')
+        checks['mongo'] = 'ok'
+    except Exception as e:
+        checks['mongo'] = f'error: {e}'
+    ready = checks['mongo'] == 'ok' and checks['warm_up'] not in ('pending', 'running')
+    return jsonify({'status': 'ready' if ready else 'not_ready', 'checks': checks}), 200 if ready else 503
+
+@bp.app_errorhandler(LLMOverloaded)
+def llm_overloaded(e):
+    """Backpressure from the LLM governor: 503 with Retry-After, so clients back off instead of timing out."""
+    response = jsonify({'status': 'error', 'message': 'Story generation is busy, please retry shortly.', 'retry_after': e.retry_after})
+    response.headers['Retry-After'] = str(e.retry_after)
+    return response, 503
+
+@bp.route('/api/llm/stats')
+def llm_stats():
+    """LLM scheduler state for this process: in-flight calls and, per priority class, queue depth and wait times."""
+    return jsonify({'status': 'success', 'providers': llm_client.governor_stats()})
+
+def publish_event(event_type, **data):
+    try:
+        event_bus.publish(event_type, data)
+    except Exception as e:
+        # Notifications are best effort; never fail the write that triggered them
+        print(f"[EventBus] Could not publish {event_type}: {e}")
+
+def mark_changed(*tags):
+    """Call after writing data behind the given tags: drops cached aggregates and bumps the version stamps used for ETags."""
+    dashboard_cache.invalidate(*tags)
+    version_stamps.bump(*tags)
+
+def cached(key, compute, tags, ttl=None):
+    """
+    dashboard_cache.get_or_set, keyed by the version stamps of `tags` as well: mark_changed() on any
+    worker bumps them, so every worker recomputes on its next read. Data written outside the app's
+    write paths (compliance checks, audit entries, which are not stamped) is only as fresh as the TTL.
+    """
+    token, _ = version_stamps.get(*tags)
+    return dashboard_cache.get_or_set(f'{key}#{token}', compute, ttl=ttl, tags=tags)
 
 # --- Audit logging helper ---
-def log_audit(action_type, patient_name, details=None):
-    mongo.db.audit.insert_one({
-        'type': action_type,
+def log_audit(action_type, patient_name, details=None, patient_id=None):
+    # Buffered: written in batches by the audit writer thread, not in the request
+    audit_service.log_action({
+        'action': action_type,
+        'patient_id': patient_id,
         'patient_name': patient_name,
-        'timestamp': datetime.utcnow(),
         'details': details or ''
     })
+    dashboard_cache.invalidate('audit')
 
-@app.route('/')
+@bp.route('/')
 def root():
     return redirect('/welcome')
 
-@app.route('/api/parse-patient-data', methods=['POST'])
+@bp.route('/api/parse-patient-data', methods=['POST'])
 def parse_patient_data():
     """Parse patient data and return structured information."""
     data = request.json
@@ -73,16 +259,38 @@ def parse_patient_data():
             'message': str(e)
         }), 400
 
-@app.route('/api/start-scenario', methods=['POST'])
-def start_scenario():
-    data = request.json
-    initial_sud = data.get('initial_sud')
-    if initial_sud is None:
-        return jsonify({'status': 'error', 'message': 'Missing initial SUD value.'}), 400
+def _scenario_sud(data, key, missing_message):
+    """Validate the SUD value of a scenario request. Returns (sud, error message)."""
+    value = (data or {}).get(key)
+    if value is None:
+        return None, missing_message
     try:
-        initial_sud = int(initial_sud)
+        return int(value), None
     except Exception:
-        return jsonify({'status': 'error', 'message': 'Invalid SUD value.'}), 400
+        return None, 'Invalid SUD value.'
+
+def _scenario_started(patient_id, patient_profile, initial_sud):
+    timeseries_store.record_sud(patient_id, initial_sud, 'scenario', stage=1)
+    mark_changed('stories', 'timeseries')
+    publish_event('story.created', patient_id=patient_id, stage=1)
+    publish_event('sud.submitted', patient_id=patient_id, sud=initial_sud, source='scenario')
+    log_audit('update_story', patient_profile.get('name', patient_id), f"Started scenario, SUD: {initial_sud}", patient_id=patient_id)
+
+def _scenario_sud_recorded(patient_id, current_sud, stage):
+    timeseries_store.record_sud(patient_id, current_sud, 'scenario', stage=stage)
+    mark_changed('timeseries')
+    publish_event('sud.submitted', patient_id=patient_id, sud=current_sud, source='scenario')
+
+def _scenario_story_created(patient_id, stage):
+    mark_changed('stories')
+    publish_event('story.created', patient_id=patient_id, stage=stage)
+
+@bp.route('/api/start-scenario', methods=['POST'])
+@idempotent(idempotency_store, lambda: session.get('patient_id'))
+def start_scenario():
+    initial_sud, error = _scenario_sud(request.json, 'initial_sud', 'Missing initial SUD value.')
+    if error:
+        return jsonify({'status': 'error', 'message': error}), 400
 
     patient_id = session.get('patient_id')
     if not patient_id:
@@ -92,103 +300,122 @@ def start_scenario():
     if not patient_profile:
         return jsonify({'status': 'error', 'message': 'Patient profile not found.'}), 400
 
-    # Generate first part
-    result = exposure_service.story_service.generate_story(
-        patient_profile=patient_profile,
-        exposure_stage=1,
-        last_sud=initial_sud,
-        previous_parts=None
-    )
+    # Generate first part (a patient is waiting on it: interactive LLM priority)
+    with llm_priority('interactive'):
+        result = exposure_service.story_service.generate_story(
+            patient_profile=patient_profile,
+            exposure_stage=1,
+            last_sud=initial_sud,
+            previous_parts=None
+        )
     # Save to MongoDB
-    mongo.db.stories.insert_one({
+    story_store.insert({
         'patient_id': patient_id,
         'stage': 1,
         'result': result,
         'sud': initial_sud,
         'timestamp': datetime.utcnow()
     })
-    log_audit('update_story', patient_profile.get('name', patient_id), f"Started scenario, SUD: {initial_sud}")
-    session['scenario_state'] = {
-        'stage': 1,
-        'sud_history': [initial_sud]
-    }
+    exposure_service.start_scenario(patient_id, initial_sud)
+    _scenario_started(patient_id, patient_profile, initial_sud)
     return jsonify({
         'status': 'success',
         'stage': 1,
         'result': result
     })
 
-@app.route('/api/next-scenario', methods=['POST'])
+@bp.route('/api/next-scenario', methods=['POST'])
+@idempotent(idempotency_store, lambda: session.get('patient_id'))
 def next_scenario():
-    data = request.json
-    current_sud = data.get('current_sud')
-    if current_sud is None:
-        return jsonify({'status': 'error', 'message': 'Missing SUD value.'}), 400
-    try:
-        current_sud = int(current_sud)
-    except Exception:
-        return jsonify({'status': 'error', 'message': 'Invalid SUD value.'}), 400
+    current_sud, error = _scenario_sud(request.json, 'current_sud', 'Missing SUD value.')
+    if error:
+        return jsonify({'status': 'error', 'message': error}), 400
 
     patient_id = session.get('patient_id')
-    scenario_state = session.get('scenario_state')
-    if not patient_id or not scenario_state:
+    if not patient_id:
         return jsonify({'status': 'error', 'message': 'No scenario in progress.'}), 400
 
-    stage = scenario_state['stage'] + 1
-    scenario_state['stage'] = stage
-    scenario_state['sud_history'].append(current_sud)
+    # Claimed atomically in the progress store: a concurrent request cannot take the same chapter
+    try:
+        stage = exposure_service.claim_next_chapter(patient_id, current_sud)
+    except ChapterInProgressError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 409, {'Retry-After': '5'}
+    if stage is None:
+        return jsonify({'status': 'error', 'message': 'No scenario in progress.'}), 400
+    _scenario_sud_recorded(patient_id, current_sud, stage)
 
     # If finished all 3 chapters, do NOT generate a new story, just return 'done'
     if stage > 3:
-        session['scenario_state'] = scenario_state
         return jsonify({'status': 'done'})
 
-    patient_profile = mongo.db.patients.find_one({'patient_id': patient_id}, {'_id': 0})
-    previous_stories = list(mongo.db.stories.find({'patient_id': patient_id}).sort('stage', 1))
-    previous_parts = [doc['result']['story'] for doc in previous_stories]
-
-    result = exposure_service.story_service.generate_story(
-        patient_profile=patient_profile,
-        exposure_stage=stage,
-        last_sud=current_sud,
-        previous_parts=previous_parts
-    )
-    mongo.db.stories.insert_one({
-        'patient_id': patient_id,
-        'stage': stage,
-        'result': result,
-        'sud': current_sud,
-        'timestamp': datetime.utcnow()
-    })
-    session['scenario_state'] = scenario_state
+    try:
+        patient_profile = mongo.db.patients.find_one({'patient_id': patient_id}, {'_id': 0})
+        previous_stories = story_store.hydrate(list(mongo.db.stories.find({'patient_id': patient_id}).sort('stage', 1)))
+        previous_parts = [doc['result']['story'] for doc in previous_stories]
+
+        with llm_priority('interactive'):
+            result = exposure_service.story_service.generate_story(
+                patient_profile=patient_profile,
+                exposure_stage=stage,
+                last_sud=current_sud,
+                previous_parts=previous_parts
+            )
+        story_store.insert({
+            'patient_id': patient_id,
+            'stage': stage,
+            'result': result,
+            'sud': current_sud,
+            'timestamp': datetime.utcnow()
+        })
+    except BaseException:
+        exposure_service.release_chapter(patient_id, stage)
+        raise
+    exposure_service.complete_chapter(patient_id, stage)
+    _scenario_story_created(patient_id, stage)
     return jsonify({
         'status': 'success',
         'stage': stage,
         'result': result
     })
 
-@app.route('/api/stories', methods=['GET'])
-def get_stories():
-    """Get all generated stories."""
-    try:
-        stories = list(mongo.db.stories.find({}, {'_id': 0}))
-        for s in stories:
-            s['story_id'] = str(s['_id'])
-            s['short_id'] = s['story_id'][-6:]
-            # Recursively convert ObjectIds in all nested fields
-            for key in s:
-                s[key] = convert_objectids(s[key])
-            # Ensure summary exists
-            story_text = s.get('result', {}).get('story', '')
-            if 'summary' not in s or not s.get('summary'):
-                s['summary'] = ' '.join(story_text.split()[:30]) + ('...' if len(story_text.split()) > 30 else '')
-            # Ensure feedback fields exist
+def _story_page_args(args=None):
+    """request.args (or args), with result.content_ref added when fields= asks for (possibly compressed) result data."""
+    args = dict(request.args.to_dict() if args is None else args)
+    fields = args.get('fields')
+    requested = [f.strip() for f in (fields or '').split(',') if f.strip()]
+    ref = 'result.content_ref'
+    # fields=result already returns the ref; adding it again would be an overlapping path
+    if any(_covers('result', f) for f in requested) and not any(_covers(f, ref) for f in requested):
+        args['fields'] = fields + ',' + ref
+    return args
+
+def present_stories(stories, fields_requested):
+    """Shape hydrated story documents for GET /api/stories (shared with the ASGI handler)."""
+    for s in stories:
+        s['story_id'] = str(s.pop('_id'))
+        s['short_id'] = s['story_id'][-6:]
+        # Ensure summary exists (only when the story text was requested)
+        if 'result' in s and not s.get('summary'):
+            story_text = s['result'].get('story', '')
+            s['summary'] = ' '.join(story_text.split()[:30]) + ('...' if len(story_text.split()) > 30 else '')
+        # Ensure feedback fields exist
+        if not fields_requested:
             for fb_key in ['habituation_feedback', 'narrative_feedback', 'dialogue_feedback', 'rule_feedback', 'hebrew_feedback']:
                 if fb_key not in s:
                     s[fb_key] = ''
+    return stories
+
+@bp.route('/api/stories', methods=['GET'])
+@conditional(version_stamps, 'stories')
+def get_stories():
+    """Get generated stories, one page at a time (see paginate_args for the query parameters)."""
+    try:
+        stories, next_cursor = paginate_args(mongo.db.stories, _story_page_args(), keep_id=True)
+        present_stories(story_store.hydrate(stories), 'fields' in request.args)
         return jsonify({
             'status': 'success',
-            'stories': stories
+            'stories': stories,
+            'next_cursor': next_cursor
         })
     except Exception as e:
         return jsonify({
@@ -196,16 +423,21 @@ def get_stories():
             'message': str(e)
         }), 400
 
-@app.route('/dashboard/patients')
+@bp.route('/dashboard/patients')
 def dashboard_patients():
-    patients = list(mongo.db.patients.find({}, {'_id': 0}))
-    return render_template('dashboard/patient_list.html', patients=patients)
+    # Only the columns the list template renders
+    list_fields = {f: 1 for f in ['patient_id', 'name', 'age', 'ptsd_symptoms', 'general_symptoms', 'main_avoidances']}
+    try:
+        patients, next_cursor = paginate_args(mongo.db.patients, request.args, default_fields=list_fields)
+    except ValueError:
+        return redirect(url_for('main.dashboard_patients'))
+    return render_template('dashboard/patient_list.html', patients=patients, next_cursor=next_cursor)
 
-@app.route('/dashboard/plans')
+@bp.route('/dashboard/plans')
 def dashboard_plans():
     return render_template('dashboard/plan_review.html')
 
-@app.route('/dashboard/patients/create', methods=['GET', 'POST'])
+@bp.route('/dashboard/patients/create', methods=['GET', 'POST'])
 def create_patient():
     if request.method == 'POST':
         data = {
@@ -274,27 +506,29 @@ def create_patient():
         # Add a 'name' field for display
         data['name'] = f"{data.get('first_name', '')} {data.get('last_name', '')}".strip()
         parser = PatientDataParser()
-        parsed_data = parser.parse(data)
+        parsed_data = patient_lookup_service.with_name_key(parser.parse(data))
         mongo.db.patients.insert_one(parsed_data)
-        log_audit('add_patient', data['name'])
+        patient_lookup_service.update_patient(data['patient_id'], data['name'])
+        mark_changed('patients')
+        log_audit('add_patient', data['name'], patient_id=data['patient_id'])
         flash('נוצר מטופל חדש בהצלחה!', 'success')
-        return redirect(url_for('dashboard_patients'))
+        return redirect(url_for('main.dashboard_patients'))
     return render_template('dashboard/patient_create.html')
 
-@app.route('/dashboard/patients/<patient_id>')
+@bp.route('/dashboard/patients/<patient_id>')
 def patient_profile(patient_id):
     patient = mongo.db.patients.find_one({'patient_id': patient_id}, {'_id': 0})
     if not patient:
         flash('מטופל לא נמצא', 'danger')
-        return redirect(url_for('dashboard_patients'))
+        return redirect(url_for('main.dashboard_patients'))
     return render_template('dashboard/patient_profile.html', patient=patient)
 
-@app.route('/dashboard/patients/<patient_id>/edit', methods=['GET', 'POST'])
+@bp.route('/dashboard/patients/<patient_id>/edit', methods=['GET', 'POST'])
 def edit_patient(patient_id):
     patient = mongo.db.patients.find_one({'patient_id': patient_id}, {'_id': 0})
     if not patient:
         flash('מטופל לא נמצא', 'danger')
-        return redirect(url_for('dashboard_patients'))
+        return redirect(url_for('main.dashboard_patients'))
     if request.method == 'POST':
         update = {
             'first_name': request.form.get('first_name'),
@@ -355,30 +589,20 @@ def edit_patient(patient_id):
         # Depression (PHQ-9, 9 items, 0-3)
         phq9 = [int(request.form.get(f'phq9_{i}', 0)) for i in range(1, 10)]
         update['phq9'] = phq9
-        mongo.db.patients.update_one({'patient_id': patient_id}, {'$set': update})
+        mongo.db.patients.update_one({'patient_id': patient_id}, {'$set': patient_lookup_service.with_name_key(update)})
+        patient_lookup_service.update_patient(patient_id, update['name'])
+        mark_changed('patients')
         flash('פרטי המטופל עודכנו בהצלחה!', 'success')
-        return redirect(url_for('dashboard_patients'))
+        return redirect(url_for('main.dashboard_patients'))
     return render_template('dashboard/patient_create.html', patient=patient, edit_mode=True)
 
-def convert_objectids(obj):
-    if isinstance(obj, list):
-        return [convert_objectids(item) for item in obj]
-    elif isinstance(obj, dict):
-        return {k: convert_objectids(v) for k, v in obj.items()}
-    elif isinstance(obj, ObjectId):
-        return str(obj)
-    else:
-        return obj
-
-@app.route('/dashboard/stories')
+@bp.route('/dashboard/stories')
 def dashboard_stories():
-    stories = list(mongo.db.stories.find({}, {'_id': 1, 'timestamp': 1, 'patient_id': 1, 'stage': 1, 'result': 1}))
+    stories = story_store.hydrate(list(mongo.db.stories.find({}, {'_id': 1, 'timestamp': 1, 'patient_id': 1, 'stage': 1, 'result': 1})))
     for s in stories:
         s['story_id'] = str(s['_id'])
         s['short_id'] = s['story_id'][-6:]
-        # Recursively convert ObjectIds in all nested fields
-        for key in s:
-            s[key] = convert_objectids(s[key])
+        s.pop('_id')
         # Ensure summary exists
         story_text = s.get('result', {}).get('story', '')
         if 'summary' not in s or not s.get('summary'):
@@ -409,68 +633,97 @@ def dashboard_stories():
             s['compliance'] = compliance
     return render_template('dashboard/story_review.html', stories=stories, patients=patients, next_actionable=next_actionable)
 
-@app.route('/dashboard/audit')
+@bp.route('/dashboard/audit')
 def dashboard_audit():
-    audit_logs = list(mongo.db.audit.find({}, {'_id': 0}).sort('timestamp', -1).limit(20))
+    audit_logs = audit_service.get_audit_log(limit=20)
     return render_template('dashboard/audit_log.html', audit_logs=audit_logs)
 
-@app.route('/dashboard/compliance')
+@bp.route('/dashboard/compliance')
 def dashboard_compliance():
     compliance_reports = list(mongo.db.compliance.find({}, {'_id': 0}).sort('timestamp', -1).limit(20))
     return render_template('dashboard/rule_compliance_report.html', compliance_reports=compliance_reports)
 
-@app.route('/dashboard')
-def dashboard_summary():
-    total_patients = mongo.db.patients.count_documents({})
-    total_stories = mongo.db.stories.count_documents({})
-    sud_feedback = list(mongo.db.session_feedback.find({}, {'_id': 0}).sort('timestamp', -1).limit(10))
+def _totals():
+    # Plain totals are display-only, so the collection metadata estimate is good enough
+    return {
+        'total_patients': mongo.db.patients.estimated_document_count(),
+        'total_stories': mongo.db.stories.estimated_document_count()
+    }
+
+def _status_counts():
+    return {
+        'active_plans': mongo.db.plans.count_documents({'status': 'active'}),
+        'pending_stories': mongo.db.stories.count_documents({'status': 'pending'}),
+        'compliance_alerts': mongo.db.compliance.count_documents({'summary': {'$ne': 'All rules passed.'}})
+    }
+
+def _recent_feedback():
     session_feedback = list(mongo.db.session_feedback.find({}, {'_id': 0}).sort('timestamp', -1).limit(10))
-    patient_map = {p['patient_id']: p.get('name', p['patient_id']) for p in mongo.db.patients.find({}, {'patient_id': 1, 'name': 1, '_id': 0}) if 'patient_id' in p}
+    # Names only for the patients that appear in the feedback, not the whole collection
+    patient_ids = list({fb['patient_id'] for fb in session_feedback if fb.get('patient_id')})
+    patient_map = {p['patient_id']: p.get('name', p['patient_id']) for p in mongo.db.patients.find({'patient_id': {'$in': patient_ids}}, {'patient_id': 1, 'name': 1, '_id': 0})}
     for fb in session_feedback:
         fb['patient_name'] = patient_map.get(fb.get('patient_id'), fb.get('patient_id', ''))
-    recent_activity = list(mongo.db.audit.find({}, {'_id': 0}).sort('timestamp', -1).limit(5))
+    return session_feedback
+
+def _dashboard_data(*parts):
+    """Cached dashboard aggregates, keyed by part name."""
+    builders = {
+        'totals': (_totals, ('patients', 'stories')),
+        'status_counts': (_status_counts, ('plans', 'stories', 'compliance')),
+        'recent_feedback': (_recent_feedback, ('feedback', 'patients')),
+        'recent_activity': (lambda: audit_service.get_audit_log(limit=5), ('audit',)),
+    }
+    data = {}
+    for part in parts:
+        build, tags = builders[part]
+        data[part] = cached(f'dashboard:{part}', build, tags)
+    return data
+
+@bp.route('/dashboard')
+def dashboard_summary():
+    data = _dashboard_data('totals', 'recent_feedback', 'recent_activity')
     return render_template(
         'dashboard/summary.html',
-        total_patients=total_patients,
-        total_stories=total_stories,
-        sud_feedback=sud_feedback,
-        session_feedback=session_feedback,
-        recent_activity=recent_activity
+        total_patients=data['totals']['total_patients'],
+        total_stories=data['totals']['total_stories'],
+        sud_feedback=data['recent_feedback'],
+        session_feedback=data['recent_feedback'],
+        recent_activity=data['recent_activity']
     )
 
-@app.route('/api/dashboard', methods=['GET'])
+@bp.route('/api/dashboard', methods=['GET'])
 def api_dashboard():
-    # Aggregate stats (placeholder logic)
-    total_patients = mongo.db.patients.count_documents({})
-    active_plans = mongo.db.plans.count_documents({'status': 'active'})
-    pending_stories = mongo.db.stories.count_documents({'status': 'pending'})
-    compliance_alerts = mongo.db.compliance.count_documents({'summary': {'$ne': 'All rules passed.'}})
-    recent_activity = list(mongo.db.audit.find({}, {'_id': 0}).sort('timestamp', -1).limit(5))
+    data = _dashboard_data('totals', 'status_counts', 'recent_feedback', 'recent_activity')
     return jsonify({
         'status': 'success',
         'summary': {
-            'total_patients': total_patients,
-            'active_plans': active_plans,
-            'pending_stories': pending_stories,
-            'compliance_alerts': compliance_alerts,
-            'recent_activity': recent_activity
+            **data['totals'],
+            **data['status_counts'],
+            'session_feedback': data['recent_feedback'],
+            'sud_feedback': data['recent_feedback'],
+            'recent_activity': data['recent_activity']
         }
     })
 
 # --- API Endpoints for Therapist Dashboard ---
 
-@app.route('/api/plans', methods=['GET', 'POST'])
+@bp.route('/api/plans', methods=['GET', 'POST'])
+@conditional(version_stamps, 'plans')
 def api_plans():
     if request.method == 'GET':
-        # Placeholder: return all plans
-        plans = list(mongo.db.plans.find({}, {'_id': 0}))
-        return jsonify({'status': 'success', 'plans': plans})
+        try:
+            plans, next_cursor = paginate_args(mongo.db.plans, request.args)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        return jsonify({'status': 'success', 'plans': plans, 'next_cursor': next_cursor})
     elif request.method == 'POST':
         plan_data = request.json
         mongo.db.plans.insert_one(plan_data)
+        mark_changed('plans')
         return jsonify({'status': 'success'})
 
-@app.route('/api/plans/<plan_id>', methods=['GET', 'PUT'])
+@bp.route('/api/plans/<plan_id>', methods=['GET', 'PUT'])
 def api_plan_detail(plan_id):
     if request.method == 'GET':
         plan = mongo.db.plans.find_one({'plan_id': plan_id}, {'_id': 0})
@@ -480,36 +733,145 @@ def api_plan_detail(plan_id):
     elif request.method == 'PUT':
         update_data = request.json
         mongo.db.plans.update_one({'plan_id': plan_id}, {'$set': update_data})
+        mark_changed('plans')
         return jsonify({'status': 'success'})
 
-@app.route('/api/stories', methods=['GET', 'POST'])
+@bp.route('/api/stories', methods=['GET', 'POST'])
+@conditional(version_stamps, 'stories')
 def api_stories():
     if request.method == 'GET':
-        stories = list(mongo.db.stories.find({}, {'_id': 0}))
-        return jsonify({'status': 'success', 'stories': stories})
+        try:
+            stories, next_cursor = paginate_args(mongo.db.stories, _story_page_args(), keep_id=True)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        for s in story_store.hydrate(stories):
+            s.pop('_id', None)
+        return jsonify({'status': 'success', 'stories': stories, 'next_cursor': next_cursor})
     elif request.method == 'POST':
         story_data = request.json
-        mongo.db.stories.insert_one(story_data)
+        story_store.insert(story_data)
+        mark_changed('stories')
+        publish_event('story.created', patient_id=story_data.get('patient_id'), stage=story_data.get('stage'))
         return jsonify({'status': 'success'})
 
-@app.route('/api/stories/<story_id>', methods=['GET', 'PUT'])
+@bp.route('/api/stories/<story_id>', methods=['GET', 'PUT'])
 def api_story_detail(story_id):
     if request.method == 'GET':
-        story = mongo.db.stories.find_one({'story_id': story_id}, {'_id': 0})
+        story = story_store.hydrate_one(mongo.db.stories.find_one({'story_id': story_id}))
         if not story:
             return jsonify({'status': 'error', 'message': 'Story not found'}), 404
+        story.pop('_id', None)
         return jsonify({'status': 'success', 'story': story})
     elif request.method == 'PUT':
         update_data = request.json
-        mongo.db.stories.update_one({'story_id': story_id}, {'$set': update_data})
+        story = mongo.db.stories.find_one_and_update(
+            {'story_id': story_id}, {'$set': {**update_data, 'updated_at': datetime.utcnow()}}, {'patient_id': 1}
+        )
+        if story and 'status' in update_data:
+            _story_status_synced(story, update_data['status'])
+        mark_changed('stories')
         return jsonify({'status': 'success'})
 
-@app.route('/api/audit', methods=['GET'])
+@bp.route('/api/audit', methods=['GET'])
 def api_audit():
-    logs = list(mongo.db.audit.find({}, {'_id': 0}))
-    return jsonify({'status': 'success', 'audit': logs})
+    """Paginated audit log, newest first; filter with patient_id and an ISO start/end time range."""
+    try:
+        query = build_export_query(request.args, 'patient_id')
+        audit_service.drain()
+        logs, next_cursor = paginate_args(mongo.db.audit, request.args, query=query, sort=[('timestamp', -1), ('_id', -1)])
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return jsonify({'status': 'success', 'audit': logs, 'next_cursor': next_cursor})
+
+@bp.route('/api/export/<kind>', methods=['GET'])
+def api_export(kind):
+    """Stream stories, session feedback or audit logs as NDJSON (optionally gzip-compressed)."""
+    if kind not in EXPORTS:
+        return jsonify({'status': 'error', 'message': f'Unknown export: {kind}'}), 404
+    collection_name, patient_field = EXPORTS[kind]
+    try:
+        query = build_export_query(request.args, patient_field)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    chunks = iter_ndjson(mongo.db[collection_name], query, hydrate=story_store.hydrate if kind == 'stories' else None)
+    filename = f"{kind}-{datetime.utcnow().strftime('%Y%m%dT%H%M%S')}.ndjson"
+    if request.args.get('compress') == 'gzip':
+        chunks = gzip_chunks(chunks)
+        filename += '.gz'
+        mimetype = 'application/gzip'
+    else:
+        mimetype = 'application/x-ndjson'
+    return Response(
+        stream_with_context(chunks),
+        mimetype=mimetype,
+        headers={'Content-Disposition': f'attachment; filename={filename}'}
+    )
 
-@app.route('/api/compliance/<story_id>', methods=['GET'])
+@bp.route('/api/audio/<name>', methods=['GET'])
+def api_audio(name):
+    """
+    Stream story audio from the audio store.
+    Supports Range requests (seek/resume) and ETag/Last-Modified conditional GETs (304).
+    """
+    audio = audio_store.open(name)
+    if audio is None:
+        return jsonify({'status': 'error', 'message': 'Audio not found'}), 404
+    response = Response(
+        wrap_file(request.environ, audio.fileobj),
+        mimetype='audio/mpeg',
+        direct_passthrough=True
+    )
+    response.content_length = audio.size
+    response.set_etag(audio.etag)
+    response.last_modified = audio.last_modified
+    # File names are unique per generated story, so the content never changes
+    response.cache_control.private = True
+    response.cache_control.max_age = 86400
+    return response.make_conditional(request, accept_ranges=True, complete_length=audio.size)
+
+@bp.route('/api/stories/<story_id>/bundle', methods=['GET'])
+def api_story_bundle(story_id):
+    """
+    Offline session bundle (zip) of an approved chapter: manifest.json, story.txt and audio/NN.mp3
+    segments (see services/session_bundle.py). The ETag is the bundle's SHA-256, so the app can
+    keep its cached copy with a conditional GET; Range requests resume interrupted downloads.
+    """
+    story = session_bundles.find_story(story_id)
+    if not story:
+        return jsonify({'status': 'error', 'message': 'Story not found'}), 404
+    if story.get('status') != 'approved':
+        return jsonify({'status': 'error', 'message': 'Only approved chapters can be downloaded for offline use.'}), 409
+    record = session_bundles.get(story)
+    bundle = audio_store.open(record['name'])
+    if bundle is None:
+        return jsonify({'status': 'error', 'message': 'Bundle not found'}), 404
+    response = Response(
+        wrap_file(request.environ, bundle.fileobj),
+        mimetype='application/zip',
+        direct_passthrough=True,
+        headers={'Content-Disposition': f"attachment; filename=chapter_{story_id}.zip", 'X-Bundle-SHA256': record['sha256']}
+    )
+    response.content_length = bundle.size
+    response.set_etag(record['sha256'])
+    response.cache_control.private = True
+    response.cache_control.no_cache = True  # the chapter can be edited: revalidate (a 304 is cheap)
+    return response.make_conditional(request, accept_ranges=True, complete_length=bundle.size)
+
+@bp.route('/api/events/stream', methods=['GET'])
+def api_events_stream():
+    """
+    Server-Sent Events for dashboards: story.created, story.updated, sud.submitted, feedback.submitted.
+    ?types= limits the event types; reconnecting clients resume from their Last-Event-ID.
+    """
+    types = [t for t in request.args.get('types', '').split(',') if t] or None
+    subscription = event_bus.subscribe(types=types, last_event_id=request.headers.get('Last-Event-ID'))
+    return Response(
+        sse_stream(subscription),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+@bp.route('/api/compliance/<story_id>', methods=['GET'])
 def api_compliance(story_id):
     # Placeholder: return compliance report for a story
     compliance = mongo.db.compliance.find_one({'story_id': story_id}, {'_id': 0})
@@ -523,17 +885,28 @@ def api_compliance(story_id):
         }
     return jsonify({'status': 'success', 'compliance': compliance})
 
-@app.route('/api/patients', methods=['GET', 'POST'])
+@bp.route('/api/patients', methods=['GET', 'POST'])
+@conditional(version_stamps, 'patients')
 def api_patients():
     if request.method == 'GET':
-        patients = list(mongo.db.patients.find({}, {'_id': 0}))
-        return jsonify({'status': 'success', 'patients': patients})
+        query = None
+        if request.args.get('q'):
+            # Name search goes through the lookup index instead of a regex scan
+            query = {'patient_id': {'$in': patient_lookup_service.search(request.args['q'])}}
+        try:
+            patients, next_cursor = paginate_args(mongo.db.patients, request.args, query=query)
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        return jsonify({'status': 'success', 'patients': patients, 'next_cursor': next_cursor})
     elif request.method == 'POST':
-        patient_data = request.json
+        patient_data = patient_lookup_service.with_name_key(request.json)
         mongo.db.patients.insert_one(patient_data)
+        if patient_data.get('patient_id'):
+            patient_lookup_service.update_patient(patient_data['patient_id'], patient_data.get('name'))
+        mark_changed('patients')
         return jsonify({'status': 'success'})
 
-@app.route('/api/patients/<patient_id>', methods=['GET', 'PUT'])
+@bp.route('/api/patients/<patient_id>', methods=['GET', 'PUT'])
 def api_patient_detail(patient_id):
     if request.method == 'GET':
         patient = mongo.db.patients.find_one({'patient_id': patient_id}, {'_id': 0})
@@ -541,11 +914,14 @@ def api_patient_detail(patient_id):
             return jsonify({'status': 'error', 'message': 'Patient not found'}), 404
         return jsonify({'status': 'success', 'patient': patient})
     elif request.method == 'PUT':
-        update_data = request.json
+        update_data = patient_lookup_service.with_name_key(request.json)
         mongo.db.patients.update_one({'patient_id': patient_id}, {'$set': update_data})
+        if 'name' in update_data:
+            patient_lookup_service.update_patient(patient_id, update_data['name'])
+        mark_changed('patients')
         return jsonify({'status': 'success'})
 
-@app.route('/welcome', methods=['GET', 'POST'])
+@bp.route('/welcome', methods=['GET', 'POST'])
 def welcome():
     error_message = None
     if request.method == 'POST':
@@ -553,32 +929,24 @@ def welcome():
         if not name:
             error_message = 'יש להזין שם.'
         else:
-            patient = mongo.db.patients.find_one({'name': name}, {'_id': 0})
-            if not patient:
-                # Try case-insensitive and partial match
-                patient = mongo.db.patients.find_one(
-                    {'name': {'$regex': f'^{name}$', '$options': 'i'}}, {'_id': 0}
-                )
-            if not patient:
-                patient = mongo.db.patients.find_one(
-                    {'name': {'$regex': name, '$options': 'i'}}, {'_id': 0}
-                )
+            # Normalized exact match, then prefix/partial match
+            patient = patient_lookup_service.find_patient(name, {'_id': 0, 'patient_id': 1})
             if patient:
                 session['patient_id'] = patient['patient_id']
-                return redirect(url_for('pre_session'))
+                return redirect(url_for('main.pre_session'))
             else:
                 error_message = 'מטופל לא נמצא'
     return render_template('welcome.html', error_message=error_message)
 
-@app.route('/profile')
+@bp.route('/profile')
 def profile():
     return render_template('profile.html')
 
-@app.route('/pre-session')
+@bp.route('/pre-session')
 def pre_session():
     return render_template('pre_session.html')
 
-@app.route('/api/profile', methods=['POST'])
+@bp.route('/api/profile', methods=['POST'])
 def api_profile():
     data = request.json
     if not data or not data.get('name') or not data.get('age'):
@@ -586,41 +954,177 @@ def api_profile():
     # Save to MongoDB (patients collection)
     patient_id = data.get('name') + '_' + str(data.get('age'))
     data['patient_id'] = patient_id
-    mongo.db.patients.update_one({'patient_id': patient_id}, {'$set': data}, upsert=True)
+    mongo.db.patients.update_one({'patient_id': patient_id}, {'$set': patient_lookup_service.with_name_key(data)}, upsert=True)
+    patient_lookup_service.update_patient(patient_id, data['name'])
+    mark_changed('patients')
     return jsonify({'status': 'success', 'patient_id': patient_id})
 
-@app.route('/api/submit-sud-feedback', methods=['POST'])
+@bp.route('/api/submit-sud-feedback', methods=['POST'])
 def submit_sud_feedback():
     data = request.json
-    plan_id = data.get('plan_id')
-    patient_id = data.get('patient_id')
-    part_index = data.get('part_index')
-    sud_value = data.get('sud_value')
-    therapist_note = data.get('therapist_note')
-    if not all([plan_id, patient_id, part_index, sud_value is not None]):
-        return jsonify({'status': 'error', 'message': 'Missing required fields.'}), 400
+    if isinstance(data.get('feedback'), list):
+        return _submit_sud_feedback_bulk(data['feedback'])
+    item, error = _sud_feedback_item(data)
+    if error:
+        return jsonify({'status': 'error', 'message': error + '.'}), 400
+    plan_id, patient_id, part_index, sud_value = item['plan_id'], item['patient_id'], item['part_index'], item['sud_value']
     try:
-        part_index = int(part_index)
-        sud_value = int(sud_value)
-    except Exception:
-        return jsonify({'status': 'error', 'message': 'Invalid part_index or SUD value.'}), 400
-    feedback_id = exposure_plan_service.submit_feedback(
-        plan_id=plan_id,
-        patient_id=patient_id,
-        part_index=part_index,
-        sud_value=sud_value,
-        therapist_note=therapist_note
-    )
+        feedback_id = exposure_plan_service.submit_feedback(
+            plan_id=plan_id,
+            patient_id=patient_id,
+            part_index=part_index,
+            sud_value=sud_value,
+            therapist_note=item.get('therapist_note')
+        )
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    timeseries_store.record_sud(patient_id, sud_value, 'exposure_plan', plan_id=plan_id, part_index=part_index)
+    mark_changed('timeseries')
+    publish_event('sud.submitted', patient_id=patient_id, sud=sud_value, source='exposure_plan', plan_id=plan_id)
     return jsonify({'status': 'success', 'feedback_id': feedback_id})
 
-@app.route('/api/get-sud-feedback', methods=['GET'])
+def _sud_feedback_item(item):
+    """
+    Field checks shared by the single and bulk SUD feedback submits (the plan itself is checked by
+    the service). Returns (entry with int part_index/sud_value, None) or (None, error message).
+    """
+    if not isinstance(item, dict) or not all([item.get('plan_id'), item.get('patient_id'), item.get('part_index'), item.get('sud_value') is not None]):
+        return None, 'Missing required fields'
+    if item.get('prompt_id') is not None and (not isinstance(item['prompt_id'], str) or len(item['prompt_id']) > 64):
+        return None, 'Invalid prompt_id'
+    try:
+        return {**item, 'part_index': int(item['part_index']), 'sud_value': int(item['sud_value'])}, None
+    except Exception:
+        return None, 'Invalid part_index or SUD value'
+
+def _submit_sud_feedback_bulk(items):
+    """Validate and store a batch of SUD feedback entries (e.g. queued offline) in one write."""
+    if not items:
+        return jsonify({'status': 'error', 'message': 'Empty feedback list.'}), 400
+    batch = []
+    for i, item in enumerate(items):
+        entry, error = _sud_feedback_item(item)
+        if error:
+            return jsonify({'status': 'error', 'message': f'{error} in item {i}.'}), 400
+        batch.append(entry)
+    try:
+        feedback_ids = exposure_plan_service.submit_feedback_bulk(batch)
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    timeseries_store.record([
+        {'patient_id': item['patient_id'], 'kind': 'sud', 'value': item['sud_value'], 'source': 'exposure_plan',
+         'plan_id': item['plan_id'], 'part_index': item['part_index'], **({'prompt_id': item['prompt_id']} if item.get('prompt_id') else {}),
+         # Readings queued offline are filed at the time they were taken, not the upload
+         'timestamp': parse_utc(item['timestamp']) if item.get('timestamp') else None}
+        for item in batch
+    ])
+    mark_changed('timeseries')
+    publish_event('sud.submitted', patient_ids=sorted({item['patient_id'] for item in batch}), count=len(batch), source='exposure_plan')
+    return jsonify({'status': 'success', 'feedback_ids': feedback_ids})
+
+@bp.route('/api/usage-events', methods=['POST'])
+def api_usage_events():
+    """Record app usage: one event ({patient_id, duration, session_index?, timestamp?}) or {'events': [...]}."""
+    data = request.json or {}
+    items = data['events'] if isinstance(data.get('events'), list) else [data]
+    events = []
+    for i, item in enumerate(items):
+        if not isinstance(item, dict) or not item.get('patient_id') or item.get('duration') is None:
+            return jsonify({'status': 'error', 'message': f'Missing patient_id or duration in item {i}.'}), 400
+        try:
+            event = {'patient_id': item['patient_id'], 'kind': 'usage', 'value': float(item['duration'])}
+            if item.get('timestamp'):
+                event['timestamp'] = parse_utc(item['timestamp'])
+            if item.get('session_index') is not None:
+                event['session_index'] = int(item['session_index'])
+        except (TypeError, ValueError):
+            return jsonify({'status': 'error', 'message': f'Invalid duration, session_index or timestamp in item {i}.'}), 400
+        events.append(event)
+    recorded = timeseries_store.record(events)
+    mark_changed('timeseries')
+    return jsonify({'status': 'success', 'recorded': recorded})
+
+@bp.route('/api/patients/<patient_id>/timeseries', methods=['GET'])
+def api_patient_timeseries(patient_id):
+    """SUD or usage rollups for a patient: ?kind=sud|usage&granularity=hour|day|week&start=&end= (ISO dates)."""
+    kind = request.args.get('kind', 'sud')
+    granularity = request.args.get('granularity', 'day')
+    if kind not in KINDS or granularity not in GRANULARITIES:
+        return jsonify({'status': 'error', 'message': 'Invalid kind or granularity.'}), 400
+    try:
+        start = parse_utc(request.args['start']) if request.args.get('start') else None
+        end = parse_utc(request.args['end']) if request.args.get('end') else None
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid start or end date.'}), 400
+    series = timeseries_store.series(patient_id, kind, granularity, start, end)
+    return jsonify({'status': 'success', 'kind': kind, 'granularity': granularity, 'series': series})
+
+@bp.route('/api/analytics/sud', methods=['GET'])
+def api_sud_analytics():
+    """
+    Cohort SUD outcomes: habituation slopes, within/between-session change, peak-to-end reduction
+    per chapter, days to target range and outlier sessions.
+    Optional: ?patient_id=a,b&start=&end= (ISO dates)&target_max=40&session_gap_hours=2
+    """
+    patient_ids = [p for p in request.args.get('patient_id', '').split(',') if p] or None
+    try:
+        start = parse_utc(request.args['start']) if request.args.get('start') else None
+        end = parse_utc(request.args['end']) if request.args.get('end') else None
+        target_max = float(request.args.get('target_max', 40))
+        session_gap_hours = float(request.args.get('session_gap_hours', 2))
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid date or numeric parameter.'}), 400
+
+    def compute():
+        from services.sud_analytics import SudSeries, analyze  # NumPy is only imported when analytics are requested
+        series = SudSeries.load(timeseries_store.events, patient_ids, start, end)
+        return analyze(series, target_max=target_max, session_gap_hours=session_gap_hours)
+
+    key = 'analytics:sud:' + request.query_string.decode('utf-8')
+    analytics = cached(key, compute, ('timeseries',))
+    return jsonify({'status': 'success', **analytics})
+
+@bp.route('/api/reports/cohort', methods=['GET'])
+def api_cohort_reports():
+    """Weekly cohort outcome reports built offline by 'flask cohort-report'. Optional ?week=YYYY-MM-DD&limit=12"""
+    try:
+        week = datetime.fromisoformat(request.args['week']) if request.args.get('week') else None
+        limit = min(int(request.args.get('limit', 12)), 104)
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid week or limit.'}), 400
+    key = f'reports:cohort:{week}:{limit}'
+    reports = cached(key, lambda: list_reports(mongo.db.reports, limit, week), ('reports',), ttl=300)
+    return jsonify({'status': 'success', 'reports': reports})
+
+@bp.route('/api/sync', methods=['GET'])
+def api_sync():
+    """
+    Delta sync for the mobile app: the session patient's stories, plans, SUD feedback and
+    tombstones changed since ?token= (omit it for a full sync). Store the returned sync_token;
+    while has_more is true, call again with it straight away. reset=true means drop local data first.
+    """
+    patient_id = session.get('patient_id')
+    if not patient_id:
+        return jsonify({'status': 'error', 'message': 'No patient ID in session.'}), 400
+    try:
+        changes = sync_service.changes(patient_id, request.args.get('token'))
+    except ValueError as e:
+        return jsonify({'status': 'error', 'message': str(e)}), 400
+    return jsonify({'status': 'success', **changes})
+
+@bp.route('/api/get-sud-feedback', methods=['GET'])
 def get_sud_feedback():
     plan_id = request.args.get('plan_id')
     patient_id = request.args.get('patient_id')
+    try:
+        start = parse_utc(request.args['start']) if request.args.get('start') else None
+        end = parse_utc(request.args['end']) if request.args.get('end') else None
+    except ValueError:
+        return jsonify({'status': 'error', 'message': 'Invalid start or end date.'}), 400
     if plan_id:
-        feedback = exposure_plan_service.get_feedback_for_plan(plan_id)
+        feedback = exposure_plan_service.get_feedback_for_plan(plan_id, start, end)
     elif patient_id:
-        feedback = exposure_plan_service.get_feedback_for_patient(patient_id)
+        feedback = exposure_plan_service.get_feedback_for_patient(patient_id, start, end)
     else:
         return jsonify({'status': 'error', 'message': 'Missing plan_id or patient_id.'}), 400
     # Serialize feedback objects
@@ -638,46 +1142,36 @@ def get_sud_feedback():
     ]
     return jsonify({'status': 'success', 'feedback': feedback_list})
 
-@app.route('/api/patient-lookup', methods=['POST'])
+@bp.route('/api/patient-lookup', methods=['POST'])
 def patient_lookup():
     data = request.json
     name = data.get('name', '').strip()
     if not name:
         return jsonify({'status': 'error', 'message': 'Missing name'}), 400
 
-    # Try exact match first
-    patient = mongo.db.patients.find_one({'name': name}, {'_id': 0})
-    if not patient:
-        # Try case-insensitive exact match
-        patient = mongo.db.patients.find_one(
-            {'name': {'$regex': f'^{name}$', '$options': 'i'}}, {'_id': 0}
-        )
-    if not patient:
-        # Try partial match (anywhere in the name, case-insensitive)
-        patient = mongo.db.patients.find_one(
-            {'name': {'$regex': name, '$options': 'i'}}, {'_id': 0}
-        )
+    # Normalized exact match, then prefix/partial match
+    patient = patient_lookup_service.find_patient(name, {'_id': 0, 'patient_id': 1})
     if not patient:
         return jsonify({'status': 'error', 'message': 'Patient not found'}), 404
 
     session['patient_id'] = patient['patient_id']
     return jsonify({'status': 'success', 'patient_id': patient['patient_id']})
 
-@app.route('/session')
+@bp.route('/session')
 def session_page():
     patient_id = session.get('patient_id')
     if not patient_id:
         return redirect('/welcome')
-    scenario_state = session.get('scenario_state', {})
+    scenario_state = exposure_service.get_scenario(patient_id) or {}
     stage = scenario_state.get('stage', 1)
-    story_doc = mongo.db.stories.find_one({'patient_id': patient_id, 'stage': stage}, sort=[('timestamp', -1)])
+    story_doc = story_store.hydrate_one(mongo.db.stories.find_one({'patient_id': patient_id, 'stage': stage}, sort=[('timestamp', -1)]))
     story = story_doc['result']['story'] if story_doc else None
     audio_file = story_doc['result'].get('audio_file') if story_doc and 'result' in story_doc else None
     sud = scenario_state['sud_history'][-1] if 'sud_history' in scenario_state and scenario_state['sud_history'] else None
     session_complete = stage > 3
     return render_template('session.html', story=story, sud=sud, stage=stage, session_complete=session_complete, audio_file=audio_file)
 
-@app.route('/feedback', methods=['GET', 'POST'])
+@bp.route('/feedback', methods=['GET', 'POST'])
 def feedback():
     patient_id = session.get('patient_id')
     if not patient_id:
@@ -693,14 +1187,25 @@ def feedback():
             'timestamp': datetime.utcnow()
         }
         mongo.db.session_feedback.insert_one(feedback_data)
+        mark_changed('feedback')
+        publish_event('feedback.submitted', patient_id=patient_id, numeric=feedback_data['numeric'])
         mongo.db.patients.update_one({'patient_id': patient_id}, {'$push': {'feedback': feedback_data}})
         patient = mongo.db.patients.find_one({'patient_id': patient_id}, {'name': 1, '_id': 0})
-        log_audit('feedback', patient.get('name', patient_id), f"Feedback: {feedback_data['numeric']}")
+        log_audit('feedback', patient.get('name', patient_id), f"Feedback: {feedback_data['numeric']}", patient_id=patient_id)
         session['feedback_submitted'] = True
         return render_template('feedback_thanks.html')
     return render_template('feedback.html')
 
-@app.route('/api/story-action', methods=['POST'])
+def _story_status_synced(story, status):
+    """Rejected stories disappear from the patient's app: a sync tombstone removes them, a later status brings them back."""
+    if not story.get('patient_id'):
+        return
+    if status == 'rejected':
+        sync_service.tombstone(story['patient_id'], 'stories', str(story['_id']))
+    else:
+        sync_service.restore(story['patient_id'], 'stories', str(story['_id']))
+
+@bp.route('/api/story-action', methods=['POST'])
 def api_story_action():
     data = request.json
     action = data.get('action')
@@ -718,17 +1223,22 @@ def api_story_action():
         update['status'] = 'rejected'
     elif action == 'regenerate':
         # Placeholder: regenerate summary (first 30 words)
+        story_store.hydrate_one(story)
         story_text = story.get('result', {}).get('story', '')
         summary = ' '.join(story_text.split()[:30]) + ('...' if len(story_text.split()) > 30 else '')
         update['status'] = 'regenerated'
         update['summary'] = summary
     else:
         return jsonify({'status': 'error', 'message': 'Unknown action'}), 400
+    update['updated_at'] = datetime.utcnow()
     mongo.db.stories.update_one({'_id': ObjectId(story_id)}, {'$set': update})
+    _story_status_synced(story, update['status'])
+    mark_changed('stories')
+    publish_event('story.updated', patient_id=patient_id, story_id=story_id, action=action, status=update['status'])
     return jsonify({'status': 'success', 'message': f'Story {action}d!'})
 
 
-@app.route('/config.js')
+@bp.route('/config.js')
 def config_js():
     # Dynamically get the server's IP address for local network
     hostname = socket.gethostname()
@@ -737,91 +1247,84 @@ def config_js():
     js = f"window.API_BASE_URL = '{api_base}';"
     return js, 200, {'Content-Type': 'application/javascript'}
 
-@app.route('/api/therapist/patients_overview')
+# No ETag here: the entries depend on the clock (days since the last session, the weekly window)
+# and on rewards, which are written outside this app, so write stamps cannot tell when they change
+@bp.route('/api/therapist/patients_overview')
 def api_patients_overview():
     # Example: fetch all patients and their progress
     patients = list(mongo.db.patients.find({}, {'_id': 0, 'patient_id': 1, 'name': 1, 'avatar_url': 1, 'flagged': 1}))
-    overview = []
     now = datetime.utcnow()
-    week_ago = now - timedelta(days=7)
-    for p in patients:
-        patient_id = p.get('patient_id')
-        if not patient_id:
-            continue  # Skip patients without patient_id
-        # Get last session date
-        last_story = mongo.db.stories.find_one({'patient_id': patient_id}, sort=[('timestamp', -1)])
-        last_session_date = last_story['timestamp'].isoformat() if last_story and 'timestamp' in last_story else None
-        last_session_days_ago = None
-        if last_story and 'timestamp' in last_story:
-            last_session_days_ago = (now - last_story['timestamp']).days
-        # Get last 5 SUDs
-        suds = list(mongo.db.stories.find({'patient_id': patient_id}).sort('timestamp', -1).limit(5))
-        sud_trend = [s.get('sud', None) for s in reversed(suds)]
-        # High SUD trend: last 3 SUDs all >= 7
-        high_sud_trend = False
-        if len(sud_trend) >= 3 and all(s is not None and s >= 7 for s in sud_trend[-3:]):
-            high_sud_trend = True
-        # Progress: number of completed sessions (out of 3)
-        progress = min(len([s for s in suds if s.get('stage')]), 3) * 33
-        # Flagged
-        flagged = p.get('flagged', False)
-        # Latest session note
-        notes = list(mongo.db.session_feedback.find({'patient_id': patient_id, 'therapist_note': {'$exists': True, '$ne': ''}}).sort('timestamp', -1).limit(1))
-        latest_note = notes[0]['therapist_note'] if notes else None
-        notes_count = mongo.db.session_feedback.count_documents({'patient_id': patient_id, 'therapist_note': {'$exists': True, '$ne': ''}})
-        # --- New metrics ---
-        # Usage logs
-        usage_logs = list(mongo.db.usage_logs.find({'patient_id': patient_id}))
-        total_app_time = sum(u.get('duration', 0) for u in usage_logs)
-        weekly_app_time = sum(u.get('duration', 0) for u in usage_logs if u.get('timestamp') and u['timestamp'] >= week_ago)
-        usage_hours = [u['timestamp'].hour for u in usage_logs if 'timestamp' in u]
-        # Session difficulties (from stories or feedback)
-        session_difficulties = [s.get('difficulty') for s in mongo.db.stories.find({'patient_id': patient_id}).sort('stage', 1) if s.get('difficulty') is not None]
-        # Stories completed
-        stories_completed = mongo.db.stories.count_documents({'patient_id': patient_id, 'status': 'completed'})
-        # SUD by chapter
-        sud_by_chapter = [s.get('sud') for s in mongo.db.stories.find({'patient_id': patient_id}).sort('stage', 1)]
-        # Rewards (trophies/stars)
-        rewards = mongo.db.rewards.count_documents({'patient_id': patient_id}) if 'rewards' in mongo.db.list_collection_names() else 0
-        # Progress rate (sessions per week)
-        session_timestamps = [s['timestamp'] for s in mongo.db.stories.find({'patient_id': patient_id}, {'timestamp': 1}) if 'timestamp' in s]
-        progress_rate = 0.0
-        if session_timestamps:
-            session_timestamps.sort()
-            total_weeks = max(1, (session_timestamps[-1] - session_timestamps[0]).days / 7)
-            progress_rate = len(session_timestamps) / total_weeks if total_weeks > 0 else len(session_timestamps)
-        # Hotspots (sessions much slower/faster than average)
-        session_durations = [u.get('duration', 0) for u in usage_logs if 'session_index' in u]
-        avg_duration = sum(session_durations) / len(session_durations) if session_durations else 0
-        hotspots = [u['session_index'] for u in usage_logs if 'session_index' in u and ((u.get('duration', 0) > avg_duration * 1.5) or (u.get('duration', 0) < avg_duration * 0.5))]
-        overview.append({
-            'name': p.get('name', ''),
-            'avatar_url': p.get('avatar_url'),
-            'last_session_date': last_session_date,
-            'last_session_days_ago': last_session_days_ago,
-            'sud_trend': sud_trend,
-            'high_sud_trend': high_sud_trend,
-            'progress': progress,
-            'flagged': flagged,
-            'patient_id': patient_id,
-            'latest_note': latest_note,
-            'notes_count': notes_count,
-            # New metrics
-            'total_app_time': total_app_time,
-            'weekly_app_time': weekly_app_time,
-            'usage_hours': usage_hours,
-            'session_difficulties': session_difficulties,
-            'stories_completed': stories_completed,
-            'sud_by_chapter': sud_by_chapter,
-            'rewards': rewards,
-            'progress_rate': progress_rate,
-            'hotspots': hotspots
-        })
+    with_rewards = 'rewards' in mongo.db.list_collection_names()
+    overview = [
+        overview_entry(p, load_overview_data(mongo.db, p['patient_id'], with_rewards), now)
+        for p in patients if p.get('patient_id')  # Skip patients without patient_id
+    ]
     return jsonify({'status': 'success', 'patients': overview})
 
-@app.route('/dashboard/patients_overview')
+@bp.route('/dashboard/patients_overview')
 def dashboard_patients_overview():
     return render_template('dashboard/patients_overview.html')
 
+@bp.cli.command('compress-stories')
+def compress_stories_command():
+    """Move existing story payloads into compressed story_content documents."""
+    migrated = StoryStore(mongo.db, compress=True).compress_existing()
+    print(f"Done: {migrated} stories compressed.")
+
+@bp.cli.command('backfill-timeseries')
+def backfill_timeseries_command():
+    """Load existing SUD values and usage_logs into the time-series store (run once)."""
+    loaded = timeseries_store.backfill()
+    print(f"Done: {loaded} events loaded.")
+
+@bp.cli.command('cohort-report')
+@click.option('--full', is_flag=True, help='Reprocess all data instead of only what changed since the last run.')
+@click.option('--every', type=float, default=None, help='Keep running, every N minutes (for a scheduler process).')
+@click.option('--partitions', type=int, default=4, help='Number of parallel patient partitions.')
+def cohort_report_command(full, every, partitions):
+    """Incrementally rebuild the weekly cohort reports (run from cron, or with --every)."""
+    job = CohortReportJob(mongo.db, partitions=partitions)
+    if full:
+        job.reset()
+    while True:
+        if job.run():
+            mark_changed('reports')  # the API workers' cached reports
+        if not every:
+            break
+        time.sleep(every * 60)
+
+@bp.cli.command('upload-audio')
+def upload_audio_command():
+    """Copy audio files from the local audio directory into the configured audio store."""
+    if isinstance(audio_store.resolve(), LocalAudioStore):
+        print("AUDIO_STORAGE is not gridfs; nothing to do.")
+        return
+    uploaded = 0
+    for name in sorted(os.listdir(AUDIO_DIR)):
+        if name.endswith('.mp3') and not audio_store.exists(name):
+            with open(os.path.join(AUDIO_DIR, name), 'rb') as f:
+                audio_store.save(name, f.read())
+            uploaded += 1
+    print(f"Done: {uploaded} audio files uploaded.")
+
+@bp.cli.command('warm-up')
+def warm_up_command():
+    """Build the services, LLM client and Mongo indexes now (checks the configuration)."""
+    warm_up(current_app._get_current_object())
+
+@bp.cli.command('migrate')
+@click.option('--to', 'to_version', type=int, default=None, help='Stop after this migration version.')
+@click.option('--status', is_flag=True, help='List migrations and their state instead of running them.')
+def migrate_command(to_version, status):
+    """Apply pending data migrations (see migrations/); safe to interrupt and re-run."""
+    runner = MigrationRunner(mongo.db)
+    if status:
+        for migration, state in runner.status():
+            detail = f"{state['status']}, {state.get('processed', 0)} processed" if state else 'pending'
+            print(f"{migration}: {detail}")
+        return
+    applied = runner.run(to_version=to_version)
+    print(f"Done: {len(applied)} migrations applied, {len(runner.pending())} pending.")
+
 if __name__ == '__main__':
-    app.run(debug=True) 
\ No newline at end of file
+    create_app().run(debug=True) 
\ No newline at end of file
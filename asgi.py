@@ -0,0 +1,265 @@
+"""
+ASGI entry point: `uvicorn asgi:app --workers N`.
+
+The long-running and read-heavy endpoints are served by async handlers: scenario generation
+(POST /api/start-scenario, /api/next-scenario), GET /api/stories and the therapist overview.
+They use motor for Mongo and the async LLM client, so a 30-90 second generation holds a
+coroutine rather than a worker thread, and the dashboard is not queued behind generations.
+Every other route is served by the Flask app (app.create_app()), mounted as a WSGI application on
+its own pool of WSGI_THREADS threads (default 64), so Flask requests that hold a thread for long
+(the SSE event stream) cannot starve the thread pool the async handlers use for session and
+store calls. `python app.py` and WSGI servers keep working unchanged.
+"""
+import os
+import time
+import asyncio
+from datetime import datetime
+from a2wsgi import WSGIMiddleware
+from motor.motor_asyncio import AsyncIOMotorClient
+from starlette.applications import Starlette
+from starlette.concurrency import run_in_threadpool
+from starlette.middleware import Middleware
+from starlette.middleware.cors import CORSMiddleware
+from starlette.responses import Response
+from starlette.routing import Mount, Route
+from werkzeug.http import parse_accept_header, parse_date, parse_etags, http_date
+
+import app as flask_module
+from agents.llm_governor import LLMOverloaded, llm_priority
+from services.patient_overview import aload_overview_data, overview_entry
+from services.exposure import ChapterInProgressError
+from services.story_store import StoryStore
+from utils.http_cache import make_etag, choose_encoding, encode_body, decode_body
+from utils.idempotency import HEADER as IDEMPOTENCY_HEADER, key_error, record_id, request_fingerprint
+from utils.pagination import apaginate_args
+
+# WARM_UP=1 builds the services and LLM clients in the background at startup (see app.warm_up)
+flask_app = flask_module.create_app()
+motor_client = AsyncIOMotorClient(flask_app.config['MONGO_URI'])
+adb = motor_client.get_default_database()
+story_store = StoryStore(adb, compress=flask_module.story_store.compress, codec=flask_module.story_store.codec)
+
+
+def json_response(request, payload, status=200, headers=None, min_size=1024):
+    """JSON response encoded like jsonify (ObjectId, datetimes, UTF-8 Hebrew), compressed like compress_response."""
+    return body_response(request, flask_app.json.dumps(payload).encode('utf-8'), status, headers, min_size)
+
+
+def body_response(request, body, status=200, headers=None, min_size=1024):
+    headers = {**(headers or {}), 'Vary': 'Accept-Encoding'}
+    encoding = choose_encoding(parse_accept_header(request.headers.get('accept-encoding')))
+    if encoding and status == 200 and len(body) >= min_size:
+        body = encode_body(body, encoding)
+        headers['Content-Encoding'] = encoding
+    return Response(body, status_code=status, headers=headers, media_type='application/json')
+
+
+def error(request, message, status=400):
+    return json_response(request, {'status': 'error', 'message': message}, status)
+
+
+async def read_json(request):
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+# --- Server-side session (see utils/server_session.py); the handlers only read an existing one ---
+
+def _session_backend():
+    return flask_app.session_interface.backend
+
+
+async def load_session(request):
+    sid = request.cookies.get(flask_app.config['SESSION_COOKIE_NAME'])
+    if not sid or len(sid) > 64:
+        return None, {}
+    data = await run_in_threadpool(_session_backend().load, sid)
+    return sid, data or {}
+
+
+# --- Conditional GET, as utils.http_cache.conditional does for the Flask views ---
+
+async def conditional_json(request, tags, build):
+    token, last_modified = await run_in_threadpool(flask_module.version_stamps.get, *tags)
+    etag = make_etag(f"{request.url.path}?{request.url.query}", token)
+    headers = {'ETag': f'W/"{etag}"', 'Cache-Control': 'no-cache'}
+    if last_modified:
+        headers['Last-Modified'] = http_date(last_modified)
+    if_none_match = request.headers.get('if-none-match')
+    if if_none_match:
+        not_modified = parse_etags(if_none_match).contains_weak(etag)
+    else:
+        since = parse_date(request.headers.get('if-modified-since'))
+        not_modified = bool(last_modified and since and last_modified <= since)
+    if not_modified:
+        return Response(status_code=304, headers=headers)
+    payload, status = await build()
+    return json_response(request, payload, status, headers if status == 200 else None)
+
+
+# --- Idempotency-Key, as utils.idempotency.idempotent does for the Flask views ---
+
+def idempotent(handler, wait=120.0, poll_interval=0.5):
+    async def wrapper(request):
+        key = request.headers.get(IDEMPOTENCY_HEADER)
+        if key is None:
+            return await handler(request)
+        _, session = await load_session(request)
+        owner = session.get('patient_id')
+        if not owner:
+            return await handler(request)
+        message = key_error(key)
+        if message:
+            return error(request, message)
+        store = flask_module.idempotency_store
+        rid = record_id(owner, request.url.path, key)
+        fingerprint = request_fingerprint(request.method, request.url.path, await request.body())
+        deadline = time.monotonic() + wait
+        while True:
+            state, record = await run_in_threadpool(store.begin, rid, fingerprint)
+            if state != 'in_progress':
+                break
+            if time.monotonic() >= deadline:
+                return json_response(request, {'status': 'error', 'message': 'A request with this Idempotency-Key is still in progress.'}, 409, {'Retry-After': '5'})
+            await asyncio.sleep(poll_interval)
+        if state == 'mismatch':
+            return error(request, f'{IDEMPOTENCY_HEADER} was already used for a different request.', 422)
+        if state == 'replay':
+            return body_response(request, record['body'].encode('utf-8'), record['status'], {'Idempotent-Replayed': 'true'})
+        try:
+            response = await handler(request)
+        except BaseException:
+            await run_in_threadpool(store.abandon, rid)
+            raise
+        if response.status_code >= 500:
+            await run_in_threadpool(store.abandon, rid)
+        else:
+            body = decode_body(response.body, response.headers.get('content-encoding'))
+            await run_in_threadpool(store.complete, rid, response.status_code, body.decode('utf-8'))
+        return response
+    return wrapper
+
+
+# --- Handlers ---
+
+async def start_scenario(request):
+    initial_sud, message = flask_module._scenario_sud(await read_json(request), 'initial_sud', 'Missing initial SUD value.')
+    if message:
+        return error(request, message)
+    _, session = await load_session(request)
+    patient_id = session.get('patient_id')
+    if not patient_id:
+        return error(request, 'No patient ID in session.')
+    patient_profile = await adb.patients.find_one({'patient_id': patient_id}, {'_id': 0})
+    if not patient_profile:
+        return error(request, 'Patient profile not found.')
+
+    with llm_priority('interactive'):
+        result = await flask_module.exposure_service.story_service.agenerate_story(
+            patient_profile=patient_profile,
+            exposure_stage=1,
+            last_sud=initial_sud,
+            previous_parts=None
+        )
+    await story_store.ainsert({
+        'patient_id': patient_id,
+        'stage': 1,
+        'result': result,
+        'sud': initial_sud,
+        'timestamp': datetime.utcnow()
+    })
+    await run_in_threadpool(flask_module.exposure_service.start_scenario, patient_id, initial_sud)
+    await run_in_threadpool(flask_module._scenario_started, patient_id, patient_profile, initial_sud)
+    return json_response(request, {'status': 'success', 'stage': 1, 'result': result})
+
+
+async def next_scenario(request):
+    current_sud, message = flask_module._scenario_sud(await read_json(request), 'current_sud', 'Missing SUD value.')
+    if message:
+        return error(request, message)
+    _, session = await load_session(request)
+    patient_id = session.get('patient_id')
+    if not patient_id:
+        return error(request, 'No scenario in progress.')
+
+    # Same chapter claim as the Flask view, in the shared progress store
+    exposure_service = flask_module.exposure_service
+    try:
+        stage = await run_in_threadpool(exposure_service.claim_next_chapter, patient_id, current_sud)
+    except ChapterInProgressError as e:
+        return json_response(request, {'status': 'error', 'message': str(e)}, 409, {'Retry-After': '5'})
+    if stage is None:
+        return error(request, 'No scenario in progress.')
+    await run_in_threadpool(flask_module._scenario_sud_recorded, patient_id, current_sud, stage)
+    if stage > 3:
+        return json_response(request, {'status': 'done'})
+
+    try:
+        patient_profile = await adb.patients.find_one({'patient_id': patient_id}, {'_id': 0})
+        previous_stories = await story_store.ahydrate(await adb.stories.find({'patient_id': patient_id}).sort('stage', 1).to_list(None))
+        with llm_priority('interactive'):
+            result = await exposure_service.story_service.agenerate_story(
+                patient_profile=patient_profile,
+                exposure_stage=stage,
+                last_sud=current_sud,
+                previous_parts=[doc['result']['story'] for doc in previous_stories]
+            )
+        await story_store.ainsert({
+            'patient_id': patient_id,
+            'stage': stage,
+            'result': result,
+            'sud': current_sud,
+            'timestamp': datetime.utcnow()
+        })
+    except BaseException:
+        await run_in_threadpool(exposure_service.release_chapter, patient_id, stage)
+        raise
+    await run_in_threadpool(exposure_service.complete_chapter, patient_id, stage)
+    await run_in_threadpool(flask_module._scenario_story_created, patient_id, stage)
+    return json_response(request, {'status': 'success', 'stage': stage, 'result': result})
+
+
+async def get_stories(request):
+    async def build():
+        try:
+            args = flask_module._story_page_args(request.query_params)
+            stories, next_cursor = await apaginate_args(adb.stories, args, keep_id=True)
+        except Exception as e:
+            return {'status': 'error', 'message': str(e)}, 400
+        flask_module.present_stories(await story_store.ahydrate(stories), 'fields' in request.query_params)
+        return {'status': 'success', 'stories': stories, 'next_cursor': next_cursor}, 200
+    return await conditional_json(request, ('stories',), build)
+
+
+async def patients_overview(request):
+    # Not conditional, like the Flask view: the entries depend on the clock and on rewards
+    patients = await adb.patients.find({}, {'_id': 0, 'patient_id': 1, 'name': 1, 'avatar_url': 1, 'flagged': 1}).to_list(None)
+    patients = [p for p in patients if p.get('patient_id')]
+    now = datetime.utcnow()
+    with_rewards = 'rewards' in await adb.list_collection_names()
+    # All patients at once, each with its reads in parallel; the driver's connection pool bounds the load
+    data = await asyncio.gather(*(aload_overview_data(adb, p['patient_id'], with_rewards) for p in patients))
+    return json_response(request, {'status': 'success', 'patients': [overview_entry(p, d, now) for p, d in zip(patients, data)]})
+
+
+async def llm_overloaded(request, exc):
+    # Same 503 + Retry-After as the Flask handler (app.llm_overloaded)
+    payload = {'status': 'error', 'message': 'Story generation is busy, please retry shortly.', 'retry_after': exc.retry_after}
+    return json_response(request, payload, 503, {'Retry-After': str(exc.retry_after)})
+
+
+app = Starlette(
+    routes=[
+        Route('/api/start-scenario', idempotent(start_scenario), methods=['POST']),
+        Route('/api/next-scenario', idempotent(next_scenario), methods=['POST']),
+        Route('/api/stories', get_stories, methods=['GET']),
+        Route('/api/therapist/patients_overview', patients_overview, methods=['GET']),
+        # Everything else (and other methods on the paths above) goes to Flask
+        Mount('/', app=WSGIMiddleware(flask_app, workers=int(os.environ.get('WSGI_THREADS', 64)))),
+    ],
+    # Same policy as flask_cors in app.py; it replaces (not duplicates) the headers Flask sets
+    middleware=[Middleware(CORSMiddleware, allow_origin_regex='.*', allow_credentials=True, allow_methods=['*'], allow_headers=['*'])],
+    exception_handlers={LLMOverloaded: llm_overloaded}
+)
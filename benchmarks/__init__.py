@@ -0,0 +1,4 @@
+"""
+End-to-end benchmarks: the app.py flows driven over HTTP against a local Mongo stand-in,
+a deterministic fake LLM server and a stub TTS engine. Run `python -m benchmarks.run --help`.
+"""
@@ -0,0 +1,184 @@
+"""
+Deterministic fake LLM server speaking the two protocols UnifiedLLMClient uses:
+  POST /v1/chat/completions  OpenAI chat completions (point OPENAI_BASE_URL at <url>/v1)
+  POST /api/generate         Ollama generate, non-streaming (point OLLAMA_BASE_URL at <url>)
+The reply depends only on the prompt: plans and stories are Hebrew filler text, SUD evaluations
+the {"expectedSUD", "explanation"} JSON ImpactEvalAgent parses. Each reply waits
+latency + per_token * completion tokens, +/- jitter derived from the prompt hash, so two runs with
+the same settings see the same latencies.
+
+Standalone (e.g. in front of a server started with uvicorn):
+    python -m benchmarks.fake_llm --port 8900 --latency 0.5 --per-token 0.002
+"""
+import re
+import json
+import time
+import hashlib
+import argparse
+import threading
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+
+WORDS = (
+    'הוא', 'היא', 'נושם', 'לאט', 'הרחוב', 'שקט', 'הלב', 'דופק', 'מהר', 'אבל', 'הוא', 'יודע', 'שזה', 'יעבור',
+    'האור', 'בחלון', 'רך', 'הקולות', 'מתרחקים', 'הידיים', 'רגועות', 'יותר', 'עכשיו', 'הזיכרון', 'עולה',
+    'ונעלם', 'הגוף', 'זוכר', 'והנשימה', 'מחזירה', 'אותו', 'לכאן', 'בטוח', 'כאן', 'ועכשיו',
+)
+STORY_WORDS = re.compile(r'at least (\d+) words')
+DEFAULT_STORY_WORDS = 1000
+PLAN_WORDS = 150
+
+
+def _digest(text):
+    return hashlib.sha256(text.encode('utf-8')).digest()
+
+
+def filler(seed, words, paragraph=60):
+    """`words` words of Hebrew filler chosen by `seed` (bytes), in paragraphs of about `paragraph` words."""
+    out = []
+    for i in range(words):
+        out.append(WORDS[(seed[i % len(seed)] + i * 7) % len(WORDS)])
+        if (i + 1) % paragraph == 0 and i + 1 < words:
+            out[-1] += '.\n'
+        elif (i + 1) % 12 == 0:
+            out[-1] += '.'
+    return ' '.join(out).replace('\n ', '\n') + '.'
+
+
+class FakeLLM:
+    """Replies and simulated latency for a prompt; shared by both protocols."""
+    def __init__(self, latency=0.2, per_token=0.0, jitter=0.2, story_words=None):
+        self.latency = latency
+        self.per_token = per_token
+        self.jitter = jitter
+        self.story_words = story_words
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def reply(self, prompt, max_tokens):
+        """(text, completion tokens) for a prompt; the kind of reply is recognised from the agents' prompts."""
+        seed = _digest(prompt)
+        if 'Last SUD Level:' in prompt:
+            text = json.dumps({'expectedSUD': 30 + seed[0] % 50, 'explanation': filler(seed, 40)}, ensure_ascii=False)
+        elif 'Generate plan for part' in prompt:
+            text = filler(seed, PLAN_WORDS, paragraph=25)
+        else:
+            match = STORY_WORDS.search(prompt)
+            words = self.story_words or (int(match.group(1)) if match else 60)
+            # A real model stops at max_tokens (Hebrew is about 3 tokens per word)
+            text = filler(seed, max(1, min(words, max_tokens // 3)))
+        return text, max(1, len(text) // 3)
+
+    def delay(self, prompt, tokens):
+        spread = (_digest(prompt)[-1] / 255 * 2 - 1) * self.jitter  # in [-jitter, +jitter]
+        return max(0.0, (self.latency + self.per_token * tokens) * (1 + spread))
+
+    def complete(self, prompt, max_tokens):
+        text, tokens = self.reply(prompt, max_tokens)
+        time.sleep(self.delay(prompt, tokens))
+        with self._lock:
+            self.calls += 1
+        return text, tokens
+
+
+def _content_text(content):
+    if isinstance(content, list):
+        return ' '.join(item.get('text', '') for item in content if isinstance(item, dict))
+    return str(content or '')
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = 'HTTP/1.1'
+    llm = None  # set by FakeLLMServer
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send(self, status, payload):
+        body = json.dumps(payload, ensure_ascii=False).encode('utf-8')
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        try:
+            data = json.loads(self.rfile.read(int(self.headers.get('Content-Length', 0))) or b'{}')
+        except ValueError:
+            return self._send(400, {'error': 'invalid JSON'})
+        if self.path.rstrip('/').endswith('/chat/completions'):
+            return self._send(200, self._openai(data))
+        if self.path.rstrip('/') == '/api/generate':
+            return self._send(200, self._ollama(data))
+        self._send(404, {'error': f'unknown path {self.path}'})
+
+    def _openai(self, data):
+        prompt = '\n'.join(_content_text(m.get('content')) for m in data.get('messages', []))
+        text, tokens = self.llm.complete(prompt, data.get('max_tokens') or 2000)
+        prompt_tokens = max(1, len(prompt) // 4)
+        return {
+            'id': 'chatcmpl-' + _digest(prompt).hex()[:24],
+            'object': 'chat.completion',
+            'created': 0,
+            'model': data.get('model', 'fake'),
+            'choices': [{'index': 0, 'message': {'role': 'assistant', 'content': text}, 'finish_reason': 'stop'}],
+            'usage': {'prompt_tokens': prompt_tokens, 'completion_tokens': tokens, 'total_tokens': prompt_tokens + tokens},
+        }
+
+    def _ollama(self, data):
+        prompt = data.get('prompt', '')
+        text, tokens = self.llm.complete(prompt, (data.get('options') or {}).get('num_predict') or 2000)
+        return {
+            'model': data.get('model', 'fake'),
+            'created_at': '1970-01-01T00:00:00Z',
+            'response': text,
+            'done': True,
+            'prompt_eval_count': max(1, len(prompt) // 4),
+            'eval_count': tokens,
+        }
+
+
+class FakeLLMServer:
+    """The fake served from a background thread: start(), then use .url; stop() when done."""
+    def __init__(self, host='127.0.0.1', port=0, **options):
+        self.llm = FakeLLM(**options)
+        handler = type('Handler', (_Handler,), {'llm': self.llm})
+        self.server = ThreadingHTTPServer((host, port), handler)
+        self.server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def start(self):
+        self._thread = threading.Thread(target=self.server.serve_forever, name='fake-llm', daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8900)
+    parser.add_argument('--latency', type=float, default=0.2, help='seconds per call (default 0.2)')
+    parser.add_argument('--per-token', type=float, default=0.0, help='extra seconds per completion token')
+    parser.add_argument('--jitter', type=float, default=0.2, help='+/- fraction of the delay, fixed per prompt')
+    parser.add_argument('--story-words', type=int, help='story length in words (default: what the prompt asks for)')
+    args = parser.parse_args()
+    server = FakeLLMServer(args.host, args.port, latency=args.latency, per_token=args.per_token,
+                           jitter=args.jitter, story_words=args.story_words)
+    print(f"Fake LLM at {server.url} (OPENAI_BASE_URL={server.url}/v1, OLLAMA_BASE_URL={server.url})")
+    try:
+        server.server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == '__main__':
+    main()
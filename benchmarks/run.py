@@ -0,0 +1,303 @@
+"""
+End-to-end benchmark of the app.py flows. Starts the fake LLM server (benchmarks/fake_llm.py),
+installs the stub TTS engine (benchmarks/stub_tts.py), seeds synthetic patients
+(benchmarks/seed.py) and serves the app in-process with a threaded server; then, at each
+concurrency level, that many virtual users run the flows over HTTP, each with its own session:
+  scenario  patient_create, patient_lookup, start_scenario, next_scenario (x2)
+  review    dashboard, overview, stories, story_action (approve), story_bundle
+and p50/p95/p99 latency and throughput are reported per endpoint.
+
+Mongo is mongomock (in-process, no server needed) unless --mongo-uri points at a real mongod;
+use a scratch database there, the benchmark writes to it. Run from the repository root:
+    python -m benchmarks.run --concurrency 1,4,16 --iterations 5 --json before.json
+    python -m benchmarks.run --concurrency 1,4,16 --iterations 5 --compare before.json
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import shutil
+import argparse
+import tempfile
+import threading
+import platform
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+FLOWS = ('scenario', 'review')
+ENDPOINTS = (
+    'patient_create', 'patient_lookup', 'start_scenario', 'next_scenario',
+    'dashboard', 'overview', 'stories', 'story_action', 'story_bundle',
+)
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a sorted list."""
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(q / 100 * len(values) + 0.5)) - 1))]
+
+
+class Recorder:
+    """Latencies (seconds) and errors per endpoint, shared by the worker threads."""
+    def __init__(self):
+        self.latencies = {}
+        self.errors = {}
+        self.first_error = {}
+        self._lock = threading.Lock()
+
+    def call(self, endpoint, send, ok=(200,)):
+        """Time send() (a requests call); returns the response, or None if it failed."""
+        started = time.perf_counter()
+        try:
+            response = send()
+            error = None if response.status_code in ok else f"HTTP {response.status_code}: {response.text[:200]}"
+        except Exception as e:
+            response, error = None, repr(e)
+        elapsed = time.perf_counter() - started
+        with self._lock:
+            if error:
+                self.errors[endpoint] = self.errors.get(endpoint, 0) + 1
+                self.first_error.setdefault(endpoint, error)
+            else:
+                self.latencies.setdefault(endpoint, []).append(elapsed)
+        return None if error else response
+
+    def summary(self, wall):
+        rows = {}
+        for endpoint in ENDPOINTS:
+            values = sorted(self.latencies.get(endpoint, []))
+            errors = self.errors.get(endpoint, 0)
+            if not values and not errors:
+                continue
+            rows[endpoint] = {
+                'count': len(values),
+                'errors': errors,
+                'p50_ms': _ms(percentile(values, 50)),
+                'p95_ms': _ms(percentile(values, 95)),
+                'p99_ms': _ms(percentile(values, 99)),
+                'max_ms': _ms(values[-1] if values else None),
+                'throughput_rps': round(len(values) / wall, 2) if wall else None,
+            }
+            if errors:
+                rows[endpoint]['first_error'] = self.first_error[endpoint]
+        return rows
+
+
+def _ms(seconds):
+    return None if seconds is None else round(seconds * 1000, 1)
+
+
+class VirtualUser:
+    """One client (own cookie session) running the flows; its random choices come from its own seed."""
+    def __init__(self, base_url, recorder, seed):
+        import requests
+        self.http = requests.Session()
+        self.base = base_url
+        self.recorder = recorder
+        self.rng = random.Random(seed)
+        self.name = f"bench user {seed}"
+
+    def scenario(self, iteration):
+        """Create a patient, log in as them and generate the three chapters."""
+        from benchmarks.seed import patient_profile
+        call, url = self.recorder.call, self.base
+        name = f"{self.name} {iteration}"
+        profile = patient_profile(self.rng, name, f"bench-{uuid.UUID(int=self.rng.getrandbits(128))}")
+        if not call('patient_create', lambda: self.http.post(f"{url}/api/patients", json=profile)):
+            return
+        if not call('patient_lookup', lambda: self.http.post(f"{url}/api/patient-lookup", json={'name': name})):
+            return
+        # The mobile app sends an Idempotency-Key with every generation request
+        sud = self.rng.randint(40, 90)
+        if not call('start_scenario', lambda: self.http.post(f"{url}/api/start-scenario", json={'initial_sud': sud},
+                                                             headers={'Idempotency-Key': uuid.uuid4().hex})):
+            return
+        for _ in range(2):
+            sud = max(0, sud - self.rng.randint(0, 20))
+            if not call('next_scenario', lambda: self.http.post(f"{url}/api/next-scenario", json={'current_sud': sud},
+                                                                headers={'Idempotency-Key': uuid.uuid4().hex})):
+                return
+
+    def review(self, iteration):
+        """The therapist's round: dashboard, patient overview, then review (the page has the text) and approve a story."""
+        call, url = self.recorder.call, self.base
+        call('dashboard', lambda: self.http.get(f"{url}/api/dashboard"))
+        call('overview', lambda: self.http.get(f"{url}/api/therapist/patients_overview"))
+        page = call('stories', lambda: self.http.get(f"{url}/api/stories", params={'limit': 20}))
+        stories = page.json().get('stories') if page else None
+        if not stories:
+            return
+        story = self.rng.choice(stories)
+        story_id = story['story_id']
+        approved = call('story_action', lambda: self.http.post(f"{url}/api/story-action", json={
+            'action': 'approve', 'patient_id': story['patient_id'], 'story_id': story_id
+        }))
+        if approved:
+            call('story_bundle', lambda: self.http.get(f"{url}/api/stories/{story_id}/bundle"))
+
+    def run(self, flows, iterations):
+        for i in range(iterations):
+            for flow in flows:
+                getattr(self, flow)(i)
+
+
+def run_level(base_url, concurrency, iterations, flows, seed):
+    """Run `concurrency` virtual users for `iterations` rounds each; (summary rows, wall seconds)."""
+    recorder = Recorder()
+    users = [VirtualUser(base_url, recorder, seed * 10007 + concurrency * 101 + n) for n in range(concurrency)]
+    threads = [threading.Thread(target=u.run, args=(flows, iterations), name=f"user-{n}") for n, u in enumerate(users)]
+    started = time.perf_counter()
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    wall = time.perf_counter() - started
+    return recorder.summary(wall), wall
+
+
+def print_table(results, baseline=None):
+    header = f"{'users':>5}  {'endpoint':<15}{'n':>6}{'err':>5}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'req/s':>9}"
+    if baseline:
+        header += f"{'p50 vs base':>13}{'p95 vs base':>13}"
+    print(header)
+    print('-' * len(header))
+    base = {(r['concurrency'], e): row for r in (baseline or {}).get('levels', []) for e, row in r['endpoints'].items()}
+    for level in results['levels']:
+        for endpoint, row in level['endpoints'].items():
+            cells = [row[k] if row[k] is not None else '-' for k in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput_rps')]
+            line = f"{level['concurrency']:>5}  {endpoint:<15}{row['count']:>6}{row['errors']:>5}" + ''.join(
+                f"{c:>10}" if i < 3 else f"{c:>9}" for i, c in enumerate(cells))
+            before = base.get((level['concurrency'], endpoint))
+            if before:
+                line += ''.join(f"{_delta(row[k], before[k]):>13}" for k in ('p50_ms', 'p95_ms'))
+            print(line)
+        print(f"{level['concurrency']:>5}  {'(all)':<15}{level['requests']:>6}{level['errors']:>5}"
+              f"{'':>30}{level['throughput_rps']:>9}   wall {level['wall_s']}s")
+    for level in results['levels']:
+        for endpoint, row in level['endpoints'].items():
+            if row.get('first_error'):
+                print(f"users={level['concurrency']} {endpoint}: {row['errors']} errors, first: {row['first_error']}")
+
+
+def _delta(after, before):
+    if not after or not before:
+        return '-'
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def _use_mongomock():
+    """Point pymongo/flask_pymongo at one shared in-process mongomock client."""
+    import mongomock
+    import pymongo
+    import flask_pymongo
+    client = mongomock.MongoClient()
+    pymongo.MongoClient = flask_pymongo.MongoClient = lambda *args, **kwargs: client
+    return client
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', default='1,4,16', help='comma-separated virtual user counts (default 1,4,16)')
+    parser.add_argument('--iterations', type=int, default=3, help='rounds of the flows per user and level (default 3)')
+    parser.add_argument('--warmup', type=int, default=1, help='unrecorded rounds by one user first (default 1)')
+    parser.add_argument('--flows', default=','.join(FLOWS), help=f"comma-separated flows to run (default {','.join(FLOWS)})")
+    parser.add_argument('--patients', type=int, default=50, help='synthetic patients to seed (default 50)')
+    parser.add_argument('--seed', type=int, default=1, help='seed for the data and the users\' choices (default 1)')
+    parser.add_argument('--provider', choices=('openai', 'ollama'), default='openai', help='LLM protocol to use (default openai)')
+    parser.add_argument('--llm-latency', type=float, default=0.2, help='fake LLM seconds per call (default 0.2)')
+    parser.add_argument('--llm-per-token', type=float, default=0.0, help='fake LLM extra seconds per completion token')
+    parser.add_argument('--llm-jitter', type=float, default=0.2, help='fake LLM +/- latency fraction, fixed per prompt (default 0.2)')
+    parser.add_argument('--story-words', type=int, help='words per generated chapter (default: what the prompt asks for)')
+    parser.add_argument('--tts-latency', type=float, default=0.0, help='stub TTS seconds per 1000 characters')
+    parser.add_argument('--mongo-uri', help='real MongoDB to use, including a scratch database name (default: mongomock)')
+    parser.add_argument('--json', help='write the results to this file')
+    parser.add_argument('--compare', help='results file of an earlier run to show p50/p95 changes against')
+    args = parser.parse_args()
+    flows = [f.strip() for f in args.flows.split(',') if f.strip()]
+    unknown = set(flows) - set(FLOWS)
+    if unknown:
+        parser.error(f"unknown flows: {', '.join(sorted(unknown))}")
+    levels = [int(c) for c in args.concurrency.split(',')]
+
+    # Relative paths (prompts, rules) are resolved against the repository root
+    os.chdir(ROOT)
+    sys.path.insert(0, ROOT)
+    from benchmarks import stub_tts
+    from benchmarks.fake_llm import FakeLLMServer
+    stub_tts.install(args.tts_latency)
+    llm = FakeLLMServer(latency=args.llm_latency, per_token=args.llm_per_token, jitter=args.llm_jitter,
+                        story_words=args.story_words).start()
+    # Read when the agents module is imported
+    os.environ['OPENAI_BASE_URL'] = f"{llm.url}/v1"
+    os.environ['OLLAMA_BASE_URL'] = llm.url
+    os.environ.setdefault('OPENAI_API_KEY', 'benchmark')
+    if not args.mongo_uri:
+        mock = _use_mongomock()
+        # mongomock has no time-series collections: a plain patient_events collection instead
+        mock['ptsd_bench'].create_collection('patient_events')
+
+    import logging
+    import contextlib
+    from werkzeug.serving import make_server
+    import app as appmod
+    from agents import PTSDAgents
+    from benchmarks.seed import seed as seed_data
+
+    scratch = tempfile.mkdtemp(prefix='ptsd-bench-')
+    # Debug output and story audio go to a scratch directory, not into the working tree
+    PTSDAgents.OUTPUT_DIR = os.path.join(scratch, 'generated_stories')
+    appmod.AUDIO_DIR = os.path.join(scratch, 'audio')
+    PTSDAgents.client.set_primary_provider(args.provider)
+    app = appmod.create_app({'MONGO_URI': args.mongo_uri or 'mongodb://localhost:27017/ptsd_bench'}, warm=False)
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)  # no access log line per request
+    server = make_server('127.0.0.1', 0, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='bench-server', daemon=True).start()
+    base_url = f"http://127.0.0.1:{server.server_port}"
+
+    results = {
+        'config': {k: v for k, v in vars(args).items() if k not in ('json', 'compare')},
+        'environment': {'python': platform.python_version(), 'platform': platform.platform(), 'cpus': os.cpu_count(),
+                        'mongo': 'mongomock' if not args.mongo_uri else 'mongodb'},
+        'levels': [],
+    }
+    try:
+        with app.app_context():
+            seeded = seed_data(appmod, args.patients, args.seed)
+        print(f"Seeded {len(seeded)} patients; app at {base_url}, fake LLM at {llm.url} ({args.provider})", file=sys.stderr)
+        # The agents print progress for every call: progress goes to stderr, the report to stdout afterwards
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            if args.warmup:
+                run_level(base_url, 1, args.warmup, flows, args.seed + 1)
+            for concurrency in levels:
+                calls = llm.llm.calls
+                rows, wall = run_level(base_url, concurrency, args.iterations, flows, args.seed)
+                requests_done = sum(r['count'] for r in rows.values())
+                results['levels'].append({
+                    'concurrency': concurrency,
+                    'wall_s': round(wall, 2),
+                    'requests': requests_done,
+                    'errors': sum(r['errors'] for r in rows.values()),
+                    'throughput_rps': round(requests_done / wall, 2),
+                    'llm_calls': llm.llm.calls - calls,
+                    'endpoints': rows,
+                })
+                print(f"users={concurrency}: {requests_done} requests in {wall:.1f}s", file=sys.stderr)
+    finally:
+        server.shutdown()
+        llm.stop()
+        shutil.rmtree(scratch, ignore_errors=True)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare, encoding='utf-8') as f:
+            baseline = json.load(f)
+    print_table(results, baseline)
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=2, ensure_ascii=False)
+
+
+if __name__ == '__main__':
+    main()
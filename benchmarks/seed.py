@@ -0,0 +1,97 @@
+"""
+Synthetic data for the benchmarks, written through the app's own services so documents have the
+same shape (and indexes) as in production: patients with the intake fields of
+/dashboard/patients/create, their story chapters, exposure plans, SUD feedback, SUD/usage events
+and therapist notes. The same seed always gives the same data (timestamps are relative to now).
+"""
+import random
+import datetime
+from benchmarks.fake_llm import filler
+from models.sud_feedback import SUDFeedback
+
+FIRST_NAMES = ('נועה', 'יונתן', 'מאיה', 'איתי', 'תמר', 'דניאל', 'שירה', 'עומר', 'רוני', 'אורי', 'ליאור', 'עדי')
+LAST_NAMES = ('כהן', 'לוי', 'מזרחי', 'פרץ', 'ביטון', 'אברהם', 'פרידמן', 'שפירא', 'גולן', 'אזולאי')
+SYMPTOMS = ('flashbacks', 'nightmares', 'hypervigilance', 'startle', 'irritability', 'insomnia', 'numbness')
+AVOIDANCES = ('crowds', 'driving', 'loud noises', 'news', 'public transport', 'the beach', 'fireworks')
+HOBBIES = ('running', 'music', 'cooking', 'reading', 'gardening', 'photography')
+STATUSES = ('pending', 'pending', 'approved', 'regenerated')
+
+
+def patient_profile(rng, name, patient_id):
+    """Intake fields of one synthetic patient, as the create form submits them."""
+    return {
+        'patient_id': patient_id,
+        'name': name,
+        'first_name': name.split()[0],
+        'last_name': ' '.join(name.split()[1:]),
+        'gender': rng.choice(('male', 'female')),
+        'age': str(rng.randint(19, 65)),
+        'city': 'תל אביב',
+        'occupation': 'engineer',
+        'hobbies': rng.sample(HOBBIES, 2),
+        'pet': rng.choice(('dog', 'cat', '')),
+        'ptsd_symptoms': rng.sample(SYMPTOMS, 3),
+        'general_symptoms': {k: rng.randint(1, 10) for k in ('intrusion', 'arousal', 'thoughts', 'avoidance', 'mood')},
+        'main_avoidances': rng.sample(AVOIDANCES, 2),
+        'triggers': [{'name': t, 'sud': rng.randint(30, 90)} for t in rng.sample(AVOIDANCES, 2)],
+        'somatic': {'cardio': ['palpitations'], 'breathing': ['shortness of breath']},
+        'pcl5': [rng.randint(0, 4) for _ in range(20)],
+        'phq9': [rng.randint(0, 3) for _ in range(9)],
+    }
+
+
+def _result(rng, stage):
+    seed = rng.randbytes(32)
+    return {
+        'plan': filler(seed, 80, paragraph=25),
+        'evaluation': {'expected_sud': 30 + seed[0] % 50, 'explanation': filler(seed[::-1], 30)},
+        'story': filler(seed, 300 * stage),
+        'audio_file': None,
+        **{key: '' for key in ('habituation_feedback', 'narrative_feedback', 'dialogue_feedback', 'rule_feedback', 'hebrew_feedback')},
+    }
+
+
+def seed(appmod, patients=50, seed=1):
+    """
+    Write `patients` synthetic patients with 1-3 chapters each and their feedback and events.
+    Must run in an app context. Returns the created patients' names.
+    """
+    rng = random.Random(seed)
+    now = datetime.datetime.utcnow()
+    db = appmod.mongo.db
+    names = []
+    for i in range(patients):
+        name = f"{rng.choice(FIRST_NAMES)} {rng.choice(LAST_NAMES)} {i:04d}"
+        patient_id = f"bench-{seed}-{i:04d}"
+        profile = patient_profile(rng, name, patient_id)
+        db.patients.insert_one(appmod.patient_lookup_service.with_name_key(dict(profile)))
+        appmod.patient_lookup_service.update_patient(patient_id, name)
+        names.append(name)
+
+        plan_id = appmod.exposure_plan_service.create_plan(patient_id, {
+            'plan_details': filler(rng.randbytes(32), 40),
+            'segments': [{'part': part} for part in (1, 2, 3)],
+        }, profile)
+        started = now - datetime.timedelta(days=rng.randint(1, 28), hours=rng.randint(0, 23))
+        feedback = []
+        for stage in range(1, rng.randint(1, 3) + 1):
+            timestamp = started + datetime.timedelta(minutes=20 * stage)
+            sud = rng.randint(10, 90)
+            appmod.story_store.insert({
+                'patient_id': patient_id,
+                'stage': stage,
+                'result': _result(rng, stage),
+                'sud': sud,
+                'status': rng.choice(STATUSES),
+                'timestamp': timestamp,
+            })
+            appmod.timeseries_store.record_sud(patient_id, sud, 'scenario', timestamp=timestamp, stage=stage)
+            feedback.append(SUDFeedback(f"{plan_id}-{stage}", plan_id, patient_id, stage, sud, timestamp.isoformat()))
+        appmod.exposure_plan_service.store.add_feedback(feedback)
+        appmod.timeseries_store.record_usage(patient_id, rng.randint(300, 2400), timestamp=started, session_index=1)
+        if rng.random() < 0.5:
+            db.session_feedback.insert_one({
+                'patient_id': patient_id, 'numeric': rng.randint(1, 10), 'text': '',
+                'therapist_note': filler(rng.randbytes(32), 15), 'timestamp': started,
+            })
+    return names
@@ -0,0 +1,158 @@
+"""
+Versioned data migrations.
+
+Each module named vNNNN_<name>.py in this package defines `migration`, an instance of a
+Migration subclass. MigrationRunner applies the pending ones in version order and records
+them in the `migrations` collection (one document per version). Run them with
+`flask migrate`; nothing runs at import or on process start.
+"""
+import datetime
+import importlib
+import pkgutil
+import time
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+class Migration:
+    """
+    One data migration over a collection, processed in `_id` order in batches of `batch_size`.
+    Subclasses set version, name, collection and query (the documents still to migrate) and
+    implement transform(doc), returning the write operations for that document (or None);
+    each batch's operations go to the collection in one unordered bulk_write.
+    After every batch the last processed `_id` is checkpointed, so an interrupted run resumes
+    where it stopped. A batch can be replayed if the process dies between its write and the
+    checkpoint, so transform() must be safe to apply twice (usually by having `query` exclude
+    already migrated documents).
+    """
+    version = None
+    name = None
+    collection = None
+    query = {}
+    projection = None
+    batch_size = 500
+
+    def transform(self, doc):
+        raise NotImplementedError
+
+    def target(self, db):
+        """Collection the write operations are applied to (default: the source collection)."""
+        return db[self.collection]
+
+    def __repr__(self):
+        return f"v{self.version:04d} {self.name}"
+
+
+def discover():
+    """The migrations defined in this package, in version order."""
+    found = []
+    for module in pkgutil.iter_modules(__path__):
+        if module.name.startswith('v'):
+            found.append(importlib.import_module(f"{__name__}.{module.name}").migration)
+    found.sort(key=lambda m: m.version)
+    versions = [m.version for m in found]
+    if len(set(versions)) != len(versions):
+        raise ValueError(f"Duplicate migration versions: {versions}")
+    return found
+
+
+class MigrationRunner:
+    """
+    Applies migrations and tracks them in the `migrations` collection:
+    {_id: version, name, status: running|failed|applied, last_id, processed, modified, ...}.
+    A lease on the migration's document keeps two processes from running it at the same time;
+    a run that died leaves the lease to expire, and the next run continues from last_id.
+    """
+    def __init__(self, db, migrations=None, lease=datetime.timedelta(minutes=10)):
+        self.db = db
+        self.state = db.migrations
+        self.migrations = migrations if migrations is not None else discover()
+        self.lease = lease
+
+    def status(self):
+        """[(migration, state document or None)] in version order."""
+        docs = {d['_id']: d for d in self.state.find({})}
+        return [(m, docs.get(m.version)) for m in self.migrations]
+
+    def pending(self):
+        return [m for m, doc in self.status() if not doc or doc.get('status') != 'applied']
+
+    def run(self, to_version=None, log=print):
+        """Apply pending migrations in order (up to to_version). Returns the versions applied; stops at the first failure."""
+        applied = []
+        for migration in self.pending():
+            if to_version is not None and migration.version > to_version:
+                break
+            if not self._apply(migration, log):
+                break
+            applied.append(migration.version)
+        return applied
+
+    def _acquire(self, migration, now):
+        lease = {'status': 'running', 'lease_until': now + self.lease, 'updated_at': now}
+        state = self.state.find_one_and_update(
+            {'_id': migration.version, 'status': {'$ne': 'applied'},
+             '$or': [{'lease_until': {'$exists': False}}, {'lease_until': {'$lt': now}}]},
+            {'$set': lease},
+            return_document=ReturnDocument.AFTER
+        )
+        if state is None and not self.state.find_one({'_id': migration.version}):
+            state = {'_id': migration.version, 'name': migration.name, 'started_at': now,
+                     'last_id': None, 'processed': 0, 'modified': 0, **lease}
+            try:
+                self.state.insert_one(state)
+            except DuplicateKeyError:
+                return None  # another process started it first
+        return state
+
+    def _apply(self, migration, log):
+        now = datetime.datetime.utcnow()
+        state = self._acquire(migration, now)
+        if state is None:
+            log(f"{migration}: applied or in progress in another process; stopping.")
+            return False
+        source = self.db[migration.collection]
+        last_id, processed, modified = state.get('last_id'), state.get('processed', 0), state.get('modified', 0)
+        remaining = source.count_documents(self._after(migration.query, last_id))
+        log(f"{migration}: {remaining} documents to process" + (f", resuming after {last_id}" if last_id is not None else ''))
+        started, done = time.monotonic(), 0
+        try:
+            while True:
+                batch = list(
+                    source.find(self._after(migration.query, last_id), migration.projection)
+                    .sort('_id', 1).limit(migration.batch_size)
+                )
+                if not batch:
+                    break
+                ops = [op for doc in batch for op in (migration.transform(doc) or [])]
+                if ops:
+                    result = migration.target(self.db).bulk_write(ops, ordered=False)
+                    modified += result.modified_count + result.upserted_count + result.inserted_count
+                last_id = batch[-1]['_id']
+                processed += len(batch)
+                done += len(batch)
+                self.state.update_one({'_id': migration.version}, {'$set': {
+                    'last_id': last_id, 'processed': processed, 'modified': modified,
+                    'lease_until': datetime.datetime.utcnow() + self.lease, 'updated_at': datetime.datetime.utcnow()
+                }})
+                rate = done / max(time.monotonic() - started, 1e-6)
+                log(f"{migration}: {done}/{max(remaining, done)} ({100.0 * done / max(remaining, done, 1):.0f}%), {rate:.0f} docs/s")
+        except Exception as e:
+            self.state.update_one({'_id': migration.version}, {
+                '$set': {'status': 'failed', 'error': str(e), 'updated_at': datetime.datetime.utcnow()},
+                '$unset': {'lease_until': ''}
+            })
+            log(f"{migration}: failed after {processed} documents: {e} (re-run to resume)")
+            return False
+        self.state.update_one({'_id': migration.version}, {
+            '$set': {'status': 'applied', 'applied_at': datetime.datetime.utcnow(), 'processed': processed, 'modified': modified},
+            '$unset': {'lease_until': '', 'error': ''}
+        })
+        log(f"{migration}: applied ({processed} processed, {modified} modified)")
+        return True
+
+    @staticmethod
+    def _after(query, last_id):
+        if last_id is None:
+            return query
+        return {'$and': [query, {'_id': {'$gt': last_id}}]} if query else {'_id': {'$gt': last_id}}
@@ -0,0 +1,23 @@
+import uuid
+from pymongo import UpdateOne
+from migrations import Migration
+
+
+class PatientIdentity(Migration):
+    """Give every patient a patient_id and a name (older records only had first_name/last_name)."""
+    version = 1
+    name = 'patient_identity'
+    collection = 'patients'
+    query = {'$or': [{'patient_id': {'$exists': False}}, {'name': {'$exists': False}}]}
+    projection = {'patient_id': 1, 'name': 1, 'first_name': 1, 'last_name': 1}
+
+    def transform(self, doc):
+        update = {}
+        if 'patient_id' not in doc:
+            update['patient_id'] = str(uuid.uuid4())
+        if 'name' not in doc:
+            update['name'] = f"{doc.get('first_name', '')} {doc.get('last_name', '')}".strip()
+        return [UpdateOne({'_id': doc['_id']}, {'$set': update})]
+
+
+migration = PatientIdentity()
@@ -0,0 +1,18 @@
+from pymongo import UpdateOne
+from migrations import Migration
+from services.patient_lookup_service import normalize_name
+
+
+class PatientNameKey(Migration):
+    """Store the normalized `name_key` used by exact patient lookups on patients created before it existed."""
+    version = 2
+    name = 'patient_name_key'
+    collection = 'patients'
+    query = {'patient_id': {'$exists': True}, 'name_key': {'$exists': False}}
+    projection = {'name': 1}
+
+    def transform(self, doc):
+        return [UpdateOne({'_id': doc['_id']}, {'$set': {'name_key': normalize_name(doc.get('name'))}})]
+
+
+migration = PatientNameKey()
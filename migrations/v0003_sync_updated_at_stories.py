@@ -0,0 +1,21 @@
+from pymongo import UpdateOne
+from migrations import Migration
+
+
+class SyncUpdatedAt(Migration):
+    """
+    Stamp `updated_at` (which the mobile delta sync reads) on documents written before the write
+    paths set it: their creation time, from `timestamp` or else the ObjectId.
+    """
+    version = 3
+    name = 'sync_updated_at_stories'
+    collection = 'stories'
+    query = {'updated_at': {'$exists': False}}
+    projection = {'timestamp': 1}
+
+    def transform(self, doc):
+        created = doc.get('timestamp') or doc['_id'].generation_time.replace(tzinfo=None)
+        return [UpdateOne({'_id': doc['_id']}, {'$set': {'updated_at': created}})]
+
+
+migration = SyncUpdatedAt()
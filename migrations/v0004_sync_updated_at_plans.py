@@ -0,0 +1,10 @@
+from migrations.v0003_sync_updated_at_stories import SyncUpdatedAt
+
+
+class PlanUpdatedAt(SyncUpdatedAt):
+    version = 4
+    name = 'sync_updated_at_plans'
+    collection = 'exposure_plans'
+
+
+migration = PlanUpdatedAt()
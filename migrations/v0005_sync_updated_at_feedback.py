@@ -0,0 +1,10 @@
+from migrations.v0003_sync_updated_at_stories import SyncUpdatedAt
+
+
+class FeedbackUpdatedAt(SyncUpdatedAt):
+    version = 5
+    name = 'sync_updated_at_feedback'
+    collection = 'sud_feedback'
+
+
+migration = FeedbackUpdatedAt()
@@ -0,0 +1,87 @@
+import os
+import datetime
+import hashlib
+from collections import namedtuple
+import gridfs
+
+# fileobj is seekable, so a Range request only reads the bytes it asks for
+StoredAudio = namedtuple('StoredAudio', ['fileobj', 'size', 'etag', 'last_modified'])
+
+
+def _valid_name(name):
+    return bool(name) and name == os.path.basename(name) and not name.startswith('.')
+
+
+class LocalAudioStore:
+    """
+    Dev storage: audio files in a local directory (static/audio by default).
+    Only works for a single node, since other nodes do not see the files.
+    """
+    def __init__(self, directory=os.path.join('static', 'audio')):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def save(self, name, data):
+        if not _valid_name(name):
+            raise ValueError(f'Invalid audio file name: {name}')
+        tmp_path = os.path.join(self.directory, name + '.tmp')
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, os.path.join(self.directory, name))
+
+    def open(self, name):
+        """Return a StoredAudio for name, or None if it does not exist."""
+        if not _valid_name(name):
+            return None
+        path = os.path.join(self.directory, name)
+        try:
+            f = open(path, 'rb')
+        except OSError:
+            return None
+        st = os.fstat(f.fileno())
+        return StoredAudio(
+            fileobj=f,
+            size=st.st_size,
+            etag=f'{st.st_size:x}-{int(st.st_mtime_ns):x}',
+            last_modified=datetime.datetime.fromtimestamp(st.st_mtime, datetime.timezone.utc)
+        )
+
+    def exists(self, name):
+        return _valid_name(name) and os.path.isfile(os.path.join(self.directory, name))
+
+
+class GridFSAudioStore:
+    """
+    Production storage: audio in a GridFS bucket, so every app node can serve every file
+    without a shared disk. Files are immutable; saving the same name again adds a new
+    revision and readers get the latest one.
+    """
+    def __init__(self, db, bucket_name='audio'):
+        self.bucket = gridfs.GridFSBucket(db, bucket_name=bucket_name)
+        self.files = db[f'{bucket_name}.files']
+
+    def save(self, name, data):
+        if not _valid_name(name):
+            raise ValueError(f'Invalid audio file name: {name}')
+        self.bucket.upload_from_stream(name, data, metadata={'sha256': hashlib.sha256(data).hexdigest()})
+
+    def open(self, name):
+        if not _valid_name(name):
+            return None
+        try:
+            grid_out = self.bucket.open_download_stream_by_name(name)
+        except gridfs.errors.NoFile:
+            return None
+        metadata = grid_out.metadata or {}
+        upload_date = grid_out.upload_date
+        if upload_date.tzinfo is None:
+            upload_date = upload_date.replace(tzinfo=datetime.timezone.utc)
+        return StoredAudio(
+            fileobj=grid_out,
+            size=grid_out.length,
+            etag=metadata.get('sha256') or str(grid_out._id),
+            last_modified=upload_date
+        )
+
+    def exists(self, name):
+        return _valid_name(name) and self.files.count_documents({'filename': name}, limit=1) > 0
@@ -1,50 +1,238 @@
 from models.audit import AuditLog
 import uuid
 import datetime
-from pymongo import MongoClient
+import time
+import os
+import threading
+import atexit
+import logging
+import weakref
+from collections import deque
+from pymongo import ASCENDING, DESCENDING
+from pymongo.errors import BulkWriteError
+
+logger = logging.getLogger(__name__)
+
+DELIVERY_MODES = ('sync', 'buffered', 'best_effort')
+
+# Services still to flush at interpreter shutdown; one atexit hook per process closes them all
+_open_services = weakref.WeakSet()
+_exit_hook_lock = threading.Lock()
+_exit_hook_registered = False
+
+
+def _close_all():
+    for service in list(_open_services):
+        service.close()
+
+
+def _register(service):
+    global _exit_hook_registered
+    with _exit_hook_lock:
+        _open_services.add(service)
+        if not _exit_hook_registered:
+            atexit.register(_close_all)
+            _exit_hook_registered = True
+
 
 class AuditService:
-    def __init__(self):
-        self.logs = []  # In-memory list of AuditLog
+    """
+    Audit log pipeline backed by the `audit` Mongo collection.
+    Entries are queued in a bounded in-process buffer and written with insert_many by a
+    background thread, flushed when `flush_size` entries are pending, every `flush_interval`
+    seconds, and at interpreter shutdown.
+    Only the writer thread (and close()) writes: request paths use drain(), which waits a bounded
+    time, so an unreachable database never holds a request for longer than that.
+    Delivery modes:
+    - 'sync': write through with insert_one before returning (no buffering).
+    - 'buffered': callers wait up to `max_block` seconds while the buffer is full and failed writes
+      are retried; past that (a long outage) the oldest entries are dropped and counted in `dropped`.
+    - 'best_effort': never block; entries are dropped when the buffer is full or a write fails.
+    """
+    def __init__(self, collection, delivery='buffered', max_buffer=1000, flush_size=100, flush_interval=2.0, max_block=5.0):
+        if delivery not in DELIVERY_MODES:
+            raise ValueError(f"delivery must be one of {', '.join(DELIVERY_MODES)}")
+        self.collection = collection
+        self.delivery = delivery
+        self.max_buffer = max_buffer
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.max_block = max_block
+        self._buffer = deque()
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._thread = None
+        self._pid = None
+        self._stopped = False
+        self._flush_requested = False
+        self._in_flight = 0  # entries taken from the buffer by a flush that has not finished
+        self._indexes_ready = False
+        self.dropped = 0
+        _register(self)
+
+    def ensure_indexes(self):
+        self.collection.create_index([('patient_id', ASCENDING), ('timestamp', DESCENDING)])
+        self.collection.create_index([('timestamp', DESCENDING)])
+        self.collection.create_index('log_id', unique=True, sparse=True)
+        self._indexes_ready = True
 
     def log_action(self, log_data):
         log_id = str(uuid.uuid4())
-        timestamp = datetime.datetime.utcnow().isoformat()
         log = AuditLog(
             log_id=log_id,
             patient_id=log_data.get('patient_id'),
             action=log_data.get('action'),
-            timestamp=timestamp,
+            timestamp=datetime.datetime.utcnow(),
             details=log_data.get('details'),
             therapist_id=log_data.get('therapist_id')
         )
-        self.logs.append(log)
+        doc = dict(log.__dict__)
+        # Fields read by the dashboard templates
+        doc['type'] = log.action
+        doc['patient_name'] = log_data.get('patient_name')
+        if self.delivery == 'sync':
+            self.collection.insert_one(doc)
+            return log_id
+        self._ensure_writer()
+        with self._cond:
+            if len(self._buffer) >= self.max_buffer:
+                if self.delivery == 'best_effort':
+                    self.dropped += 1
+                    return log_id
+                self._cond.notify_all()
+                deadline = time.monotonic() + self.max_block
+                while len(self._buffer) >= self.max_buffer and not self._stopped:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self._drop_oldest(len(self._buffer) - self.max_buffer + 1)
+                        break
+                    self._cond.wait(min(remaining, self.flush_interval))
+            self._buffer.append(doc)
+            if len(self._buffer) >= self.flush_size:
+                self._cond.notify_all()
         return log_id
 
-    def get_audit_log(self, patient_id=None):
+    def _drop_oldest(self, count):
+        """Under the lock: make room by discarding the `count` oldest pending entries."""
+        for _ in range(count):
+            self._buffer.popleft()
+        self.dropped += count
+        logger.warning("Audit buffer full: dropped the %d oldest entries (%d dropped in total)", count, self.dropped)
+
+    def drain(self, timeout=1.0):
+        """
+        Ask the writer thread to flush now and wait up to `timeout` seconds for the pending entries
+        to be stored (for reads that should see recent entries). Returns True if nothing is pending.
+        """
+        if self.delivery == 'sync':
+            return True
+        self._ensure_writer()
+        with self._cond:
+            self._flush_requested = True
+            self._cond.notify_all()
+            return self._cond.wait_for(lambda: not self._buffer and not self._in_flight, timeout)
+
+    def flush(self):
+        """Write all pending entries (writer thread and close()). Returns the number of entries written."""
+        written = 0
+        with self._flush_lock:
+            if not self._indexes_ready:
+                try:
+                    self.ensure_indexes()
+                except Exception:
+                    logger.exception("Audit index creation failed")
+            while True:
+                with self._cond:
+                    batch = [self._buffer.popleft() for _ in range(min(self.flush_size, len(self._buffer)))]
+                    self._in_flight = len(batch)
+                    self._cond.notify_all()
+                if not batch:
+                    return written
+                try:
+                    failed = self._write(batch)
+                finally:
+                    with self._cond:
+                        self._in_flight = 0
+                        self._cond.notify_all()
+                written += len(batch) - len(failed)
+                if failed:
+                    with self._cond:
+                        if self.delivery == 'best_effort':
+                            self.dropped += len(failed)
+                        else:
+                            self._buffer.extendleft(reversed(failed))
+                            # Callers kept filling the buffer while this batch was out: stay bounded
+                            if len(self._buffer) > self.max_buffer:
+                                self._drop_oldest(len(self._buffer) - self.max_buffer)
+                    return written
+
+    def _write(self, batch):
+        """Insert a batch; returns the entries that were not stored (to retry or drop)."""
+        try:
+            self.collection.insert_many(batch, ordered=False)
+            return []
+        except BulkWriteError as e:
+            # Duplicate keys (11000) are entries an earlier, partly failed attempt already stored:
+            # insert_many put an _id on each doc, so a retry of the whole batch hits them again
+            errors = e.details.get('writeErrors', [])
+            failed = [batch[err['index']] for err in errors if err.get('code') != 11000]
+            if failed:
+                logger.warning("Audit flush: %d of %d entries failed: %s", len(failed), len(batch), errors[0].get('errmsg'))
+            return failed
+        except Exception:
+            logger.exception("Audit flush failed")
+            return batch
+
+    def close(self):
+        """Stop the writer thread and flush what is left (called for every open service at exit)."""
+        with self._cond:
+            self._stopped = True
+            self._cond.notify_all()
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            self._thread.join(timeout=self.flush_interval * 2)
+        self.flush()
+
+    def _ensure_writer(self):
+        # Started lazily (and restarted after a fork) so importing/constructing has no side effects
+        if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._cond:
+            if self._thread and self._thread.is_alive() and self._pid == os.getpid():
+                return
+            self._pid = os.getpid()
+            self._stopped = False
+            self._thread = threading.Thread(target=self._run, name='audit-writer', daemon=True)
+            self._thread.start()
+
+    def _run(self):
+        backoff = False
+        while True:
+            with self._cond:
+                # A drain() request flushes early, but not while backing off from a failed write
+                if not self._stopped and (backoff or (len(self._buffer) < self.flush_size and not self._flush_requested)):
+                    self._cond.wait(self.flush_interval)
+                self._flush_requested = False
+                stopped = self._stopped
+            self.flush()
+            if stopped:
+                return
+            # Anything still pending after a flush means the write failed; wait before retrying
+            backoff = bool(self._buffer)
+
+    def get_audit_log(self, patient_id=None, start=None, end=None, limit=100):
+        """Newest-first audit entries, optionally for one patient and/or a [start, end) time range."""
+        self.drain()
+        query = {}
         if patient_id:
-            return [log for log in self.logs if log.patient_id == patient_id]
-        return self.logs
+            query['patient_id'] = patient_id
+        if start or end:
+            query['timestamp'] = {}
+            if start:
+                query['timestamp']['$gte'] = start
+            if end:
+                query['timestamp']['$lt'] = end
+        return list(self.collection.find(query, {'_id': 0}).sort('timestamp', DESCENDING).limit(limit))
 
     def review_audit_entry(self, log_id):
-        for log in self.logs:
-            if log.log_id == log_id:
-                return log
-        return None
-
-client = MongoClient("mongodb://localhost:27017/")
-db = client['ptsd_stories']
-patients = db.patients.find({})
-
-for p in patients:
-    update = {}
-    if 'patient_id' not in p:
-        update['patient_id'] = str(uuid.uuid4())
-    if 'name' not in p:
-        first = p.get('first_name', '')
-        last = p.get('last_name', '')
-        update['name'] = f"{first} {last}".strip()
-    if update:
-        db.patients.update_one({'_id': p['_id']}, {'$set': update})
-
-i = {p['patient_id']: p.get('name', p['patient_id']) for p in db.patients.find({}, {'patient_id': 1, 'name': 1, '_id': 0}) if 'patient_id' in p} 
\ No newline at end of file
+        self.drain()
+        return self.collection.find_one({'log_id': log_id}, {'_id': 0})
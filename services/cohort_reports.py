@@ -0,0 +1,233 @@
+import zlib
+import datetime
+from concurrent.futures import ThreadPoolExecutor
+from bson import ObjectId
+from bson.errors import InvalidId
+from pymongo import ASCENDING, UpdateOne
+from pymongo.errors import DuplicateKeyError
+from services.timeseries_store import TimeSeriesStore, bucket_start
+
+PASSED_SUMMARY = 'All rules passed.'
+EPOCH = datetime.datetime(1970, 1, 1)
+
+
+class CohortReportJob:
+    """
+    Offline job building weekly cohort outcome reports.
+    Each run only looks at data written since the previous run's watermark (by write time, so
+    late writes such as offline SUD uploads or a timeseries backfill are picked up too):
+    0. rebuild the time-series rollups of the patient-weeks with new events (repairs drift)
+    1. find the (patient, week) pairs with new SUD readings, stories or compliance checks
+    2. recompute a per-patient weekly partial for those pairs, in parallel partitions of patients
+    3. rebuild the cohort report of every affected week from its partials
+    Reports are stored in `reports` (one document per week) and served from there, so the
+    request path never runs these reads. A lease in `report_state` keeps runs from overlapping.
+    """
+    JOB_ID = 'cohort_weekly'
+
+    def __init__(self, db, partitions=4, lag=datetime.timedelta(minutes=1), lease=datetime.timedelta(minutes=30)):
+        self.db = db
+        self.partitions = partitions
+        self.lag = lag  # skip the last minute: buffered writers (audit, events) may still be flushing
+        self.lease = lease
+        self.state = db.report_state
+        self.partials = db.report_partials
+        self.reports = db.reports
+
+    def ensure_indexes(self):
+        self.partials.create_index([('week', ASCENDING), ('patient_id', ASCENDING)], unique=True)
+        self.reports.create_index([('type', ASCENDING), ('week', ASCENDING)])
+
+    # --- run control ---
+
+    def _acquire(self, now):
+        state = self.state.find_one_and_update(
+            {'_id': self.JOB_ID, '$or': [{'lease_until': {'$exists': False}}, {'lease_until': {'$lt': now}}]},
+            {'$set': {'lease_until': now + self.lease}},
+            upsert=False
+        )
+        if state is None and not self.state.find_one({'_id': self.JOB_ID}):
+            try:
+                self.state.insert_one({'_id': self.JOB_ID, 'watermark': EPOCH, 'lease_until': now + self.lease})
+            except DuplicateKeyError:
+                return None  # another run created it first
+            return {'watermark': EPOCH}
+        return state
+
+    def _release(self, watermark=None):
+        update = {'$unset': {'lease_until': ''}}
+        if watermark:
+            update['$set'] = {'watermark': watermark, 'last_run': datetime.datetime.utcnow()}
+        self.state.update_one({'_id': self.JOB_ID}, update)
+
+    def reset(self):
+        """Forget the watermark so the next run reprocesses all data."""
+        self.state.update_one({'_id': self.JOB_ID}, {'$set': {'watermark': EPOCH}}, upsert=True)
+
+    def run(self, log=print):
+        """Process new data since the watermark. Returns the list of rebuilt weeks, or None if another run holds the lease."""
+        now = datetime.datetime.utcnow()
+        state = self._acquire(now)
+        if state is None:
+            log("Another report run is in progress; skipping.")
+            return None
+        since, until = state.get('watermark') or EPOCH, now - self.lag
+        try:
+            self.ensure_indexes()
+            log(f"{TimeSeriesStore(self.db).reconcile(since, until)} patient-weeks of rollups rebuilt")
+            pairs = self._changed_pairs(since, until)
+            log(f"{len(pairs)} patient-weeks changed since {since.isoformat()}")
+            partitions = [[] for _ in range(self.partitions)]
+            for patient_id, week in pairs:
+                partitions[zlib.crc32(patient_id.encode('utf-8')) % self.partitions].append((patient_id, week))
+            with ThreadPoolExecutor(max_workers=self.partitions) as pool:
+                for done in pool.map(lambda part: self._build_partials(part, until), partitions):
+                    log(f"Partition done: {done} partials")
+            weeks = sorted({week for _, week in pairs})
+            for week in weeks:
+                self._build_report(week, until)
+            log(f"Rebuilt {len(weeks)} weekly reports")
+        except Exception:
+            self._release()
+            raise
+        self._release(watermark=until)
+        return weeks
+
+    # --- step 1: what changed ---
+
+    @staticmethod
+    def _written(field, window):
+        """Documents whose write-time `field` is in window; ones written before the field existed fall back to their timestamp."""
+        return {'$or': [{field: window}, {field: {'$exists': False}, 'timestamp': window}]}
+
+    def _changed_pairs(self, since, until):
+        window = {'$gte': since, '$lt': until}
+        pairs = set()
+        # Pairs come from each document's own timestamp, but what counts as new is when it was written
+        event_query = {'kind': 'sud', **self._written('recorded_at', window)}
+        for doc in self.db.patient_events.find(event_query, {'patient_id': 1, 'timestamp': 1}):
+            pairs.add((doc['patient_id'], bucket_start(doc['timestamp'], 'week')))
+        # New stories, and older stories whose status changed (the story store sets updated_at on both)
+        story_query = {'patient_id': {'$exists': True}, **self._written('updated_at', window)}
+        for doc in self.db.stories.find(story_query, {'patient_id': 1, 'timestamp': 1}):
+            if doc.get('timestamp'):
+                pairs.add((doc['patient_id'], bucket_start(doc['timestamp'], 'week')))
+        # Compliance checks carry no write time of their own: use their ObjectId's. It only has whole
+        # seconds, so the window is widened to whole seconds (partials are recomputed, re-reading is harmless)
+        last_second = until.replace(microsecond=0) + datetime.timedelta(seconds=1)
+        inserted = {'_id': {'$gte': ObjectId.from_datetime(since), '$lt': ObjectId.from_datetime(last_second)}}
+        checks = list(self.db.compliance.find(
+            {'timestamp': {'$type': 'date'}, '$or': [inserted, {'updated_at': window}]},
+            {'story_id': 1, 'patient_id': 1, 'timestamp': 1}
+        ))
+        story_ids = set()
+        for c in checks:
+            if not c.get('patient_id'):
+                try:
+                    story_ids.add(ObjectId(c.get('story_id')))
+                except (InvalidId, TypeError):
+                    pass
+        owners = {str(s['_id']): s.get('patient_id') for s in self.db.stories.find({'_id': {'$in': list(story_ids)}}, {'patient_id': 1})} if story_ids else {}
+        for c in checks:
+            patient_id = c.get('patient_id') or owners.get(c.get('story_id'))
+            if patient_id:
+                pairs.add((patient_id, bucket_start(c['timestamp'], 'week')))
+        return pairs
+
+    # --- step 2: per-patient weekly partials ---
+
+    def _build_partials(self, pairs, until):
+        ops = []
+        for patient_id, week in pairs:
+            window = {'$gte': week, '$lt': min(week + datetime.timedelta(days=7), until)}
+            suds = [e['value'] for e in self.db.patient_events.find(
+                {'patient_id': patient_id, 'kind': 'sud', 'timestamp': window}, {'value': 1}
+            ).sort('timestamp', ASCENDING)]
+            stories = list(self.db.stories.find({'patient_id': patient_id, 'timestamp': window}, {'stage': 1, 'status': 1}))
+            # Compliance docs may only carry the story_id, so match the patient's stories too
+            story_ids = [str(s['_id']) for s in self.db.stories.find({'patient_id': patient_id}, {'_id': 1})]
+            checks = list(self.db.compliance.find(
+                {'timestamp': window, '$or': [{'patient_id': patient_id}, {'story_id': {'$in': story_ids}}]},
+                {'summary': 1}
+            ))
+            partial = {
+                'patient_id': patient_id,
+                'week': week,
+                'sud_count': len(suds),
+                'sud_sum': sum(suds),
+                'sud_first': suds[0] if suds else None,
+                'sud_last': suds[-1] if suds else None,
+                'sud_max': max(suds) if suds else None,
+                'stories': len(stories),
+                'stories_completed': sum(1 for s in stories if s.get('status') in ('approved', 'completed')),
+                'max_stage': max((s.get('stage') or 0 for s in stories), default=0),
+                'compliance_checks': len(checks),
+                'compliance_failures': sum(1 for c in checks if c.get('summary') != PASSED_SUMMARY),
+                'updated_at': until
+            }
+            ops.append(UpdateOne({'week': week, 'patient_id': patient_id}, {'$set': partial}, upsert=True))
+        if ops:
+            self.partials.bulk_write(ops, ordered=False)
+        return len(ops)
+
+    # --- step 3: cohort report per week ---
+
+    def _build_report(self, week, until):
+        partials = list(self.partials.find({'week': week}, {'_id': 0}))
+        patient_ids = [p['patient_id'] for p in partials]
+        profiles = {
+            p['patient_id']: p for p in self.db.patients.find(
+                {'patient_id': {'$in': patient_ids}}, {'_id': 0, 'patient_id': 1, 'pcl5': 1, 'phq9': 1}
+            )
+        }
+        pcl5 = [sum(profiles[pid]['pcl5']) for pid in patient_ids if profiles.get(pid, {}).get('pcl5')]
+        phq9 = [sum(profiles[pid]['phq9']) for pid in patient_ids if profiles.get(pid, {}).get('phq9')]
+        with_sud = [p for p in partials if p['sud_count']]
+        sud_readings = sum(p['sud_count'] for p in partials)
+        stories = sum(p['stories'] for p in partials)
+        completed = sum(p['stories_completed'] for p in partials)
+        checks = sum(p['compliance_checks'] for p in partials)
+        failures = sum(p['compliance_failures'] for p in partials)
+        report = {
+            'type': self.JOB_ID,
+            'week': week,
+            'generated_at': until,
+            'patients_active': len(partials),
+            'baselines': {
+                'pcl5_patients': len(pcl5),
+                'pcl5_mean_total': sum(pcl5) / len(pcl5) if pcl5 else None,
+                'phq9_patients': len(phq9),
+                'phq9_mean_total': sum(phq9) / len(phq9) if phq9 else None
+            },
+            'sud': {
+                'readings': sud_readings,
+                'mean': sum(p['sud_sum'] for p in partials) / sud_readings if sud_readings else None,
+                'mean_change': sum(p['sud_last'] - p['sud_first'] for p in with_sud) / len(with_sud) if with_sud else None,
+                'trajectories': [
+                    {'patient_id': p['patient_id'], 'first': p['sud_first'], 'last': p['sud_last'], 'max': p['sud_max'],
+                     'mean': p['sud_sum'] / p['sud_count']}
+                    for p in sorted(with_sud, key=lambda p: p['patient_id'])
+                ]
+            },
+            'completion': {
+                'stories': stories,
+                'stories_completed': completed,
+                'rate': completed / stories if stories else None,
+                'patients_reached_final_stage': sum(1 for p in partials if p['max_stage'] >= 3)
+            },
+            'compliance': {
+                'checks': checks,
+                'failures': failures,
+                'failure_rate': failures / checks if checks else None
+            }
+        }
+        self.reports.replace_one({'_id': f"{self.JOB_ID}:{week.date().isoformat()}"}, report, upsert=True)
+
+
+def list_reports(reports, limit=12, week=None):
+    """Stored weekly reports, newest first (or the one for `week`)."""
+    query = {'type': CohortReportJob.JOB_ID}
+    if week:
+        query['week'] = bucket_start(week, 'week')
+    docs = reports.find(query, {'_id': 0}).sort('week', -1).limit(limit)
+    return [{**d, 'week': d['week'].date().isoformat(), 'generated_at': d['generated_at'].isoformat()} for d in docs]
@@ -1,43 +1,69 @@
+import datetime
 from services.story_gen import StoryGenerationService
+from services.progress_store import InMemoryProgressStore
+
+SCENARIO_CHAPTERS = 3
+# A chapter claimed longer ago than this is assumed abandoned (worker died mid-generation) and can be claimed again
+CHAPTER_CLAIM_TIMEOUT = datetime.timedelta(minutes=10)
+
+class ProgressConflictError(RuntimeError):
+    """Raised when a progress update keeps losing to concurrent writers."""
+
+class ChapterInProgressError(RuntimeError):
+    """Raised when the next scenario chapter is already being generated by another request."""
 
 class ExposureProgressionService:
     """
     Manages the exposure plan, tracks progress, and adjusts difficulty.
+    Progress lives in a pluggable store (InMemoryProgressStore for dev, MongoProgressStore to share
+    it across workers); updates are optimistic: read, compute, compare-and-set on the version, retry.
     """
-    def __init__(self):
-        self.story_service = StoryGenerationService()
-        # In-memory store for demo; replace with DB in production
-        self.patient_progress = {}  # patient_id: {stage, sud_history, feedback, therapist_override}
+    def __init__(self, store=None, max_retries=5, audio_store=None):
+        self.story_service = StoryGenerationService(audio_store=audio_store)
+        self.store = store or InMemoryProgressStore()  # patient_id: {stage, sud_history, feedback, therapist_override, version}
+        self.max_retries = max_retries
+
+    def _apply(self, patient_id, compute):
+        """Run compute(progress) -> (set_fields, push, result) and commit it atomically, retrying on conflicts."""
+        for _ in range(self.max_retries):
+            progress = self.store.get(patient_id)
+            set_fields, push, result = compute(progress)
+            if set_fields is None and push is None:
+                return result  # nothing to write
+            if self.store.update(patient_id, progress['version'], set_fields=set_fields, push=push):
+                return result
+        raise ProgressConflictError(f'Could not update progress for patient {patient_id} after {self.max_retries} attempts')
 
     def get_current_stage(self, patient_id):
         """Get the current exposure stage for a patient."""
-        progress = self.patient_progress.get(patient_id, {})
-        return progress.get('stage', 1)  # Default to stage 1 (planning)
+        return self.store.get(patient_id).get('stage', 1)  # Default to stage 1 (planning)
 
     def advance_stage(self, patient_id, last_sud, feedback=None, therapist_override=None, trauma_type=None, symptoms=None):
         """
         Advance the patient to the next exposure stage, or repeat/pause based on SUD/feedback and rules.
         Returns: dict with next_stage, recommendation, and safety_notes
         """
+        return self._apply(patient_id, lambda progress: self._next_stage(progress, last_sud, feedback, therapist_override))
+
+    def _next_stage(self, progress, last_sud, feedback, therapist_override):
         # Rule-based SUD targets
         sud_targets = {
             1: (50, 70),
             2: (60, 80),
             3: (0, 40)
         }
-        progress = self.patient_progress.setdefault(patient_id, {'stage': 1, 'sud_history': [], 'feedback': [], 'therapist_override': None})
         current_stage = progress['stage']
         min_sud, max_sud = sud_targets.get(current_stage, (0, 100))
         safety_notes = []
         # Therapist override always takes precedence
         if therapist_override is not None:
-            progress['stage'] = therapist_override
-            return {'next_stage': therapist_override, 'recommendation': 'Therapist override', 'safety_notes': []}
+            return {'stage': therapist_override}, None, {'next_stage': therapist_override, 'recommendation': 'Therapist override', 'safety_notes': []}
         # Adaptive logic
+        push = {}
         if last_sud is not None:
-            progress['sud_history'].append({'stage': current_stage, 'sud': last_sud})
+            push['sud_history'] = {'stage': current_stage, 'sud': last_sud}
         if feedback:
-            progress['feedback'].append({'stage': current_stage, 'feedback': feedback})
+            push['feedback'] = {'stage': current_stage, 'feedback': feedback}
         # Progression logic
         if last_sud is None:
             recommendation = 'No SUD reported. Stay at current stage.'
@@ -59,16 +85,70 @@ class ExposureProgressionService:
         else:
             next_stage = current_stage
             recommendation = 'No change.'
-        progress['stage'] = next_stage
-        return {'next_stage': next_stage, 'recommendation': recommendation, 'safety_notes': safety_notes}
+        return {'stage': next_stage}, push, {'next_stage': next_stage, 'recommendation': recommendation, 'safety_notes': safety_notes}
 
     def record_progress(self, patient_id, data):
         """Record progress or feedback for a patient."""
-        progress = self.patient_progress.setdefault(patient_id, {'stage': 1, 'sud_history': [], 'feedback': [], 'therapist_override': None})
-        if 'sud' in data:
-            progress['sud_history'].append({'stage': progress['stage'], 'sud': data['sud']})
-        if 'feedback' in data:
-            progress['feedback'].append({'stage': progress['stage'], 'feedback': data['feedback']})
-        if 'therapist_override' in data:
-            progress['therapist_override'] = data['therapist_override']
-        return True 
\ No newline at end of file
+        def compute(progress):
+            push, set_fields = {}, {}
+            if 'sud' in data:
+                push['sud_history'] = {'stage': progress['stage'], 'sud': data['sud']}
+            if 'feedback' in data:
+                push['feedback'] = {'stage': progress['stage'], 'feedback': data['feedback']}
+            if 'therapist_override' in data:
+                set_fields['therapist_override'] = data['therapist_override']
+            return set_fields, push, True
+        return self._apply(patient_id, compute) 
+
+    # --- Scenario chapters (start-scenario / next-scenario) ---
+    # The chapter counter lives in the progress document (`scenario`), not in the session, so
+    # concurrent requests for the same patient go through the same compare-and-set.
+
+    def get_scenario(self, patient_id):
+        """{stage, sud_history} of the patient's current scenario, or None if none was started."""
+        return self.store.get(patient_id).get('scenario')
+
+    def start_scenario(self, patient_id, initial_sud):
+        """Record a (re)started scenario at chapter 1."""
+        scenario = {'stage': 1, 'sud_history': [initial_sud], 'claim': None}
+        return self._apply(patient_id, lambda progress: ({'scenario': scenario}, None, scenario))
+
+    def claim_next_chapter(self, patient_id, sud, now=None):
+        """
+        Reserve the next chapter for generation. Returns its number, None when no scenario was
+        started, or a number past SCENARIO_CHAPTERS once the scenario is finished (recorded at once).
+        Raises ChapterInProgressError while another request holds an unexpired claim.
+        """
+        now = now or datetime.datetime.utcnow()
+        def compute(progress):
+            scenario = progress.get('scenario')
+            if not scenario:
+                return None, None, None
+            claim = scenario.get('claim')
+            if claim and now - claim['since'] < CHAPTER_CLAIM_TIMEOUT:
+                raise ChapterInProgressError(f"Chapter {claim['stage']} is already being generated")
+            stage = scenario['stage'] + 1
+            if stage > SCENARIO_CHAPTERS:
+                return {'scenario': {'stage': stage, 'sud_history': scenario['sud_history'] + [sud], 'claim': None}}, None, stage
+            return {'scenario': {**scenario, 'claim': {'stage': stage, 'sud': sud, 'since': now}}}, None, stage
+        return self._apply(patient_id, compute)
+
+    def complete_chapter(self, patient_id, stage):
+        """Move the scenario to a claimed chapter once it is stored. Returns False if the claim was lost."""
+        def compute(progress):
+            scenario = progress.get('scenario') or {}
+            claim = scenario.get('claim')
+            if not claim or claim['stage'] != stage:
+                return None, None, False
+            return {'scenario': {'stage': stage, 'sud_history': scenario['sud_history'] + [claim['sud']], 'claim': None}}, None, True
+        return self._apply(patient_id, compute)
+
+    def release_chapter(self, patient_id, stage):
+        """Drop the claim on a chapter whose generation failed, so the patient can retry it."""
+        def compute(progress):
+            scenario = progress.get('scenario') or {}
+            claim = scenario.get('claim')
+            if not claim or claim['stage'] != stage:
+                return None, None, False
+            return {'scenario': {**scenario, 'claim': None}}, None, True
+        return self._apply(patient_id, compute)
@@ -3,12 +3,17 @@ from models.sud_feedback import SUDFeedback
 import uuid
 import datetime
 from utils.rule_loader import load_rules_from_markdown, get_rule_text
+from services.exposure_plan_store import InMemoryPlanStore
+from utils.timestamps import parse_utc
+
+def _utc_iso(value):
+    """Normalize a client-supplied ISO timestamp to the naive-UTC format used for stored feedback (ValueError if invalid)."""
+    return parse_utc(value).isoformat()
 
 class ExposurePlanService:
-    def __init__(self):
-        # In-memory store for demo; replace with DB in production
-        self.plans = {}  # plan_id: ExposurePlan
-        self.sud_feedback = []  # List of SUDFeedback
+    def __init__(self, store=None):
+        # InMemoryPlanStore for dev/tests, MongoPlanStore in production (shared by all workers)
+        self.store = store or InMemoryPlanStore()
         # Load rules from markdown directory (adjust path as needed)
         self.rules = load_rules_from_markdown('cursorrules/ptsd-cbt/core-rules')
 
@@ -33,25 +38,19 @@ class ExposurePlanService:
             rules_applied=rules_applied,
             coping_mechanisms=plan_data.get('coping_mechanisms', [])
         )
-        self.plans[plan_id] = plan
+        self.store.save_plan(plan)
         return plan_id
 
     def get_plan(self, plan_id):
         """Retrieve an exposure plan by ID."""
-        return self.plans.get(plan_id)
+        return self.store.get_plan(plan_id)
 
     def update_plan(self, plan_id, update_data):
         """Update an existing exposure plan."""
-        plan = self.plans.get(plan_id)
-        if not plan:
-            return False
-        for key, value in update_data.items():
-            if hasattr(plan, key):
-                setattr(plan, key, value)
-        return True
+        return self.store.update_plan(plan_id, update_data)
 
     def validate_plan(self, plan_id):
-        plan = self.plans.get(plan_id)
+        plan = self.store.get_plan(plan_id)
         if not plan:
             return {'valid': False, 'errors': ['Plan not found']}
         errors = []
@@ -75,23 +74,54 @@ class ExposurePlanService:
         return {'valid': len(errors) == 0, 'errors': errors}
 
     # SUD Feedback Methods
-    def submit_feedback(self, plan_id, patient_id, part_index, sud_value, therapist_note=None):
-        feedback_id = str(uuid.uuid4())
-        timestamp = datetime.datetime.utcnow().isoformat()
-        feedback = SUDFeedback(
-            feedback_id=feedback_id,
+    def _new_feedback(self, plan_id, patient_id, part_index, sud_value, therapist_note=None, timestamp=None, prompt_id=None):
+        return SUDFeedback(
+            feedback_id=str(uuid.uuid4()),
             plan_id=plan_id,
             patient_id=patient_id,
             part_index=part_index,
             sud_value=sud_value,
-            timestamp=timestamp,
-            therapist_note=therapist_note
+            timestamp=_utc_iso(timestamp) if timestamp else datetime.datetime.utcnow().isoformat(),
+            therapist_note=therapist_note,
+            prompt_id=prompt_id
         )
-        self.sud_feedback.append(feedback)
-        return feedback_id
 
-    def get_feedback_for_plan(self, plan_id):
-        return [f for f in self.sud_feedback if f.plan_id == plan_id]
+    def check_feedback_plans(self, pairs):
+        """Raise ValueError unless every (plan_id, patient_id) names an existing plan of that patient."""
+        for plan_id, patient_id in sorted(set(pairs)):
+            plan = self.store.get_plan(plan_id)
+            if not plan or plan.patient_id != patient_id:
+                raise ValueError(f'Unknown exposure plan {plan_id} for patient {patient_id}.')
+
+    def submit_feedback(self, plan_id, patient_id, part_index, sud_value, therapist_note=None):
+        """Store one SUD feedback entry. Raises ValueError like submit_feedback_bulk."""
+        self.check_feedback_plans([(plan_id, patient_id)])
+        feedback = self._new_feedback(plan_id, patient_id, part_index, sud_value, therapist_note)
+        self.store.add_feedback([feedback])
+        return feedback.feedback_id
+
+    def submit_feedback_bulk(self, items):
+        """
+        Store several SUD feedback entries in one write.
+        - items: list of dicts with plan_id, patient_id, part_index, sud_value and optional
+          therapist_note / timestamp (ISO string, e.g. when the reading was taken offline) /
+          prompt_id (the session bundle prompt that was answered)
+        Returns: list of feedback_ids in the same order.
+        Raises ValueError if a plan does not exist or belongs to another patient.
+        """
+        self.check_feedback_plans((item['plan_id'], item['patient_id']) for item in items)
+        feedback = [
+            self._new_feedback(
+                item['plan_id'], item['patient_id'], item['part_index'], item['sud_value'],
+                item.get('therapist_note'), item.get('timestamp'), item.get('prompt_id')
+            )
+            for item in items
+        ]
+        self.store.add_feedback(feedback)
+        return [f.feedback_id for f in feedback]
+
+    def get_feedback_for_plan(self, plan_id, start=None, end=None):
+        return self.store.feedback_for_plan(plan_id, start, end)
 
-    def get_feedback_for_patient(self, patient_id):
-        return [f for f in self.sud_feedback if f.patient_id == patient_id] 
\ No newline at end of file
+    def get_feedback_for_patient(self, patient_id, start=None, end=None):
+        return self.store.feedback_for_patient(patient_id, start, end) 
\ No newline at end of file
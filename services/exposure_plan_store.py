@@ -0,0 +1,126 @@
+import datetime
+import threading
+from pymongo import ASCENDING
+from models.exposure_plan import ExposurePlan
+from models.sud_feedback import SUDFeedback
+from utils.timestamps import naive_utc
+
+
+def _in_range(timestamp, start=None, end=None):
+    # Stored timestamps are naive UTC; bounds from clients may carry an offset
+    ts = datetime.datetime.fromisoformat(timestamp) if isinstance(timestamp, str) else timestamp
+    start, end = naive_utc(start), naive_utc(end)
+    return (start is None or ts >= start) and (end is None or ts < end)
+
+
+class InMemoryPlanStore:
+    """
+    Dev/test storage for exposure plans and SUD feedback.
+    Feedback is indexed by plan_id and patient_id, so lookups do not scan all feedback.
+    Data is per-process and lost on restart.
+    """
+    def __init__(self):
+        self._plans = {}  # plan_id: ExposurePlan
+        self._by_plan = {}  # plan_id: [SUDFeedback]
+        self._by_patient = {}  # patient_id: [SUDFeedback]
+        self._lock = threading.Lock()
+
+    def save_plan(self, plan):
+        with self._lock:
+            self._plans[plan.plan_id] = plan
+
+    def get_plan(self, plan_id):
+        return self._plans.get(plan_id)
+
+    def update_plan(self, plan_id, update_data):
+        with self._lock:
+            plan = self._plans.get(plan_id)
+            if not plan:
+                return False
+            for key, value in update_data.items():
+                if hasattr(plan, key):
+                    setattr(plan, key, value)
+            return True
+
+    def add_feedback(self, feedback_list):
+        with self._lock:
+            for f in feedback_list:
+                self._by_plan.setdefault(f.plan_id, []).append(f)
+                self._by_patient.setdefault(f.patient_id, []).append(f)
+
+    def feedback_for_plan(self, plan_id, start=None, end=None):
+        return [f for f in self._by_plan.get(plan_id, []) if _in_range(f.timestamp, start, end)]
+
+    def feedback_for_patient(self, patient_id, start=None, end=None):
+        return [f for f in self._by_patient.get(patient_id, []) if _in_range(f.timestamp, start, end)]
+
+
+class MongoPlanStore:
+    """
+    Production storage: `exposure_plans` and `sud_feedback` collections, shared by all workers.
+    Feedback has compound indexes on (plan_id, timestamp) and (patient_id, timestamp), so both
+    lookups and time-range queries stay index scans as feedback accumulates.
+    Plans and feedback carry `updated_at` for the mobile delta sync (services/sync_service.py).
+    """
+    def __init__(self, db):
+        self.plans = db.exposure_plans
+        self.feedback = db.sud_feedback
+        self._indexes_ready = False
+
+    def ensure_indexes(self):
+        self.plans.create_index('plan_id', unique=True)
+        self.feedback.create_index([('plan_id', ASCENDING), ('timestamp', ASCENDING)])
+        self.feedback.create_index([('patient_id', ASCENDING), ('timestamp', ASCENDING)])
+        self._indexes_ready = True
+
+    def _ready(self):
+        if not self._indexes_ready:
+            self.ensure_indexes()
+
+    def save_plan(self, plan):
+        self._ready()
+        doc = {**plan.to_dict(), 'updated_at': datetime.datetime.utcnow()}
+        self.plans.replace_one({'plan_id': plan.plan_id}, doc, upsert=True)
+
+    def get_plan(self, plan_id):
+        doc = self.plans.find_one({'plan_id': plan_id}, {'_id': 0, 'updated_at': 0})
+        return ExposurePlan.from_dict(doc) if doc else None
+
+    def update_plan(self, plan_id, update_data):
+        plan = self.get_plan(plan_id)
+        if not plan:
+            return False
+        fields = {k: v for k, v in update_data.items() if hasattr(plan, k) and k != 'plan_id'}
+        if fields:
+            self.plans.update_one({'plan_id': plan_id}, {'$set': {**fields, 'updated_at': datetime.datetime.utcnow()}})
+        return True
+
+    def add_feedback(self, feedback_list):
+        self._ready()
+        docs = []
+        now = datetime.datetime.utcnow()
+        for f in feedback_list:
+            doc = dict(f.__dict__)
+            doc['timestamp'] = datetime.datetime.fromisoformat(f.timestamp)
+            doc['updated_at'] = now
+            docs.append(doc)
+        if docs:
+            self.feedback.insert_many(docs, ordered=False)
+
+    def _find_feedback(self, query, start, end):
+        if start or end:
+            query['timestamp'] = {}
+            if start:
+                query['timestamp']['$gte'] = start
+            if end:
+                query['timestamp']['$lt'] = end
+        return [
+            SUDFeedback(**{**doc, 'timestamp': doc['timestamp'].isoformat()})
+            for doc in self.feedback.find(query, {'_id': 0, 'updated_at': 0}).sort('timestamp', ASCENDING)
+        ]
+
+    def feedback_for_plan(self, plan_id, start=None, end=None):
+        return self._find_feedback({'plan_id': plan_id}, start, end)
+
+    def feedback_for_patient(self, patient_id, start=None, end=None):
+        return self._find_feedback({'patient_id': patient_id}, start, end)
@@ -0,0 +1,169 @@
+import re
+import time
+import bisect
+import logging
+import threading
+import unicodedata
+
+logger = logging.getLogger(__name__)
+
+_SPACE_RE = re.compile(r'\s+')
+
+
+def normalize_name(name):
+    """Lookup key for a patient name: no niqqud/diacritics, case-folded, single spaces."""
+    if not name:
+        return ''
+    # NFKD splits letters from their marks; Hebrew niqqud and cantillation are combining marks
+    name = ''.join(c for c in unicodedata.normalize('NFKD', name) if not unicodedata.combining(c))
+    return _SPACE_RE.sub(' ', name).strip().casefold()
+
+
+def _trigrams(key):
+    return {key[i:i + 3] for i in range(len(key) - 2)}
+
+
+class PatientLookupService:
+    """
+    Patient login/search by name.
+    Exact matches are a single query on the indexed `name_key` field stored on each patient.
+    Partial matches use an in-process prefix (sorted keys) and trigram index, loaded lazily,
+    updated on patient create/edit and reloaded every `refresh_interval` seconds so other
+    workers' changes show up. The periodic reload runs in a background thread (one at a time)
+    while requests keep using the current index; only the first load makes a request wait.
+    """
+    def __init__(self, collection, refresh_interval=300):
+        self.collection = collection
+        self.refresh_interval = refresh_interval
+        self._lock = threading.Lock()
+        self._reload_lock = threading.Lock()  # one rebuild at a time
+        self._indexes_ready = False
+        self._loaded_at = None
+        self._pending = None  # (patient_id, name_key) updates made while a rebuild is scanning
+        self._keys = []  # sorted list of (name_key, patient_id)
+        self._by_patient = {}  # patient_id: name_key
+        self._trigrams = {}  # trigram: set of patient_ids
+
+    def ensure_indexes(self):
+        self.collection.create_index('name_key')
+        self._indexes_ready = True
+
+    def with_name_key(self, patient_data):
+        """Set `name_key` on a patient document (or $set payload) that carries a name."""
+        if 'name' in patient_data:
+            patient_data['name_key'] = normalize_name(patient_data.get('name'))
+        return patient_data
+
+    def find_patient(self, name, projection=None):
+        """Exact normalized match first, then the best partial match. Returns the patient or None."""
+        projection = projection or {'_id': 0}
+        key = normalize_name(name)
+        if not key:
+            return None
+        patient = self.collection.find_one({'name_key': key}, projection)
+        if patient:
+            return patient
+        candidates = self.search(name, limit=1)
+        if candidates:
+            return self.collection.find_one({'patient_id': candidates[0]}, projection)
+        return None
+
+    def search(self, name, limit=20):
+        """patient_ids whose name starts with, then contains, the query."""
+        key = normalize_name(name)
+        if not key:
+            return []
+        self._maybe_reload()
+        with self._lock:
+            matches = []
+            i = bisect.bisect_left(self._keys, (key, ''))
+            while i < len(self._keys) and self._keys[i][0].startswith(key) and len(matches) < limit:
+                matches.append(self._keys[i][1])
+                i += 1
+            if len(matches) < limit and len(key) >= 3:
+                grams = _trigrams(key)
+                postings = sorted((self._trigrams.get(g, set()) for g in grams), key=len)
+                found = set.intersection(*postings) if postings else set()
+                seen = set(matches)
+                for pid in sorted(found, key=lambda p: self._by_patient[p]):
+                    if pid not in seen and key in self._by_patient[pid]:
+                        matches.append(pid)
+                        if len(matches) >= limit:
+                            break
+        return matches
+
+    def update_patient(self, patient_id, name):
+        """Refresh one entry of the in-process index after a patient create/edit."""
+        key = normalize_name(name)
+        with self._lock:
+            if self._pending is not None:
+                self._pending.append((patient_id, key))  # the running rebuild may have read the old name
+            if self._loaded_at is None:
+                return
+            self._remove(patient_id)
+            self._add(patient_id, key)
+
+    def reload(self):
+        """Rebuild the in-process index now (stored name_key values are backfilled by migration v0002)."""
+        with self._reload_lock:
+            self._rebuild()
+
+    def _rebuild(self):
+        if not self._indexes_ready:
+            self.ensure_indexes()
+        with self._lock:
+            self._pending = []
+        keys, by_patient, trigrams = [], {}, {}
+        for p in self.collection.find({'patient_id': {'$exists': True}}, {'patient_id': 1, 'name': 1}):
+            key = normalize_name(p.get('name'))
+            if not key:
+                continue
+            keys.append((key, p['patient_id']))
+            by_patient[p['patient_id']] = key
+            for g in _trigrams(key):
+                trigrams.setdefault(g, set()).add(p['patient_id'])
+        keys.sort()
+        with self._lock:
+            self._keys, self._by_patient, self._trigrams = keys, by_patient, trigrams
+            for patient_id, key in self._pending:
+                self._remove(patient_id)
+                self._add(patient_id, key)
+            self._pending = None
+            self._loaded_at = time.monotonic()
+
+    def _maybe_reload(self):
+        if self._loaded_at is None:
+            # Nothing to serve yet: wait for the first load (one caller builds it, the others wait)
+            with self._reload_lock:
+                if self._loaded_at is None:
+                    self._rebuild()
+        elif time.monotonic() - self._loaded_at > self.refresh_interval and self._reload_lock.acquire(blocking=False):
+            threading.Thread(target=self._background_reload, name='patient-lookup-reload', daemon=True).start()
+
+    def _background_reload(self):
+        try:
+            self._rebuild()
+        except Exception:
+            with self._lock:
+                self._pending = None
+            logger.exception("Patient lookup index reload failed")
+        finally:
+            self._reload_lock.release()
+
+    def _add(self, patient_id, key):
+        if not key:
+            return
+        bisect.insort(self._keys, (key, patient_id))
+        self._by_patient[patient_id] = key
+        for g in _trigrams(key):
+            self._trigrams.setdefault(g, set()).add(patient_id)
+
+    def _remove(self, patient_id):
+        key = self._by_patient.pop(patient_id, None)
+        if key is None:
+            return
+        i = bisect.bisect_left(self._keys, (key, patient_id))
+        if i < len(self._keys) and self._keys[i] == (key, patient_id):
+            del self._keys[i]
+        for g in _trigrams(key):
+            self._trigrams.get(g, set()).discard(patient_id)
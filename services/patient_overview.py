@@ -0,0 +1,115 @@
+import asyncio
+import datetime
+from pymongo import ASCENDING, DESCENDING
+from services.timeseries_store import bucket_start
+
+NOTE_QUERY = {'therapist_note': {'$exists': True, '$ne': ''}}
+
+
+def _reads(patient_id, with_rewards):
+    """
+    The reads behind one overview entry as (name, collection, query, projection, sort, limit);
+    limit=None counts instead of fetching. Usage and SUD values come from the TimeSeriesStore
+    collections (raw events and hourly rollups).
+    """
+    reads = [
+        ('stories', 'stories', {'patient_id': patient_id}, {'timestamp': 1, 'stage': 1, 'difficulty': 1, 'status': 1, 'sud': 1}, None, 0),
+        ('notes', 'session_feedback', {'patient_id': patient_id, **NOTE_QUERY}, {'therapist_note': 1}, [('timestamp', DESCENDING)], 0),
+        ('sud_events', 'patient_events', {'patient_id': patient_id, 'kind': 'sud'}, {'_id': 0, 'value': 1}, [('timestamp', DESCENDING)], 5),
+        ('usage_sessions', 'patient_events', {'patient_id': patient_id, 'kind': 'usage', 'session_index': {'$exists': True}},
+         {'_id': 0, 'value': 1, 'session_index': 1}, [('timestamp', DESCENDING)], 0),
+        ('usage_hours', 'patient_event_rollups', {'patient_id': patient_id, 'kind': 'usage', 'granularity': 'hour'},
+         {'_id': 0, 'start': 1, 'count': 1, 'sum': 1}, None, 0),
+    ]
+    if with_rewards:
+        reads.append(('rewards', 'rewards', {'patient_id': patient_id}, None, None, None))
+    return reads
+
+
+def load_overview_data(db, patient_id, with_rewards):
+    """Run the reads for one patient on a pymongo database."""
+    data = {'rewards': 0}
+    for name, collection, query, projection, sort, limit in _reads(patient_id, with_rewards):
+        if limit is None:
+            data[name] = db[collection].count_documents(query)
+            continue
+        cursor = db[collection].find(query, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        data[name] = list(cursor.limit(limit))
+    return data
+
+
+async def aload_overview_data(db, patient_id, with_rewards):
+    """Run the reads for one patient concurrently on a motor (asyncio) database."""
+    async def run(collection, query, projection, sort, limit):
+        if limit is None:
+            return await db[collection].count_documents(query)
+        cursor = db[collection].find(query, projection)
+        if sort:
+            cursor = cursor.sort(sort)
+        return await cursor.limit(limit).to_list(None)
+    reads = _reads(patient_id, with_rewards)
+    results = await asyncio.gather(*(run(*read[1:]) for read in reads))
+    return {'rewards': 0, **{read[0]: result for read, result in zip(reads, results)}}
+
+
+def _by_stage(stories):
+    # Same order as sort('stage', 1): stories without a stage first
+    return sorted(stories, key=lambda s: (s.get('stage') is not None, s.get('stage') or 0))
+
+
+def overview_entry(patient, data, now):
+    """One patient's row of the therapist overview, from the data loaded by (a)load_overview_data."""
+    patient_id = patient['patient_id']
+    week_ago = now - datetime.timedelta(days=7)
+    stories = data['stories']
+    # Last session date
+    timestamps = sorted(s['timestamp'] for s in stories if 'timestamp' in s)
+    last_timestamp = timestamps[-1] if timestamps else None
+    # Last 5 SUDs
+    sud_trend = [e['value'] for e in reversed(data['sud_events'])]
+    # High SUD trend: last 3 SUDs all >= 7
+    high_sud_trend = len(sud_trend) >= 3 and all(s is not None and s >= 7 for s in sud_trend[-3:])
+    # Progress: number of completed sessions (out of 3), from the 5 latest stories
+    latest = sorted(stories, key=lambda s: s.get('timestamp') or datetime.datetime.min, reverse=True)[:5]
+    progress = min(len([s for s in latest if s.get('stage')]), 3) * 33
+    # App usage, from the hourly rollups (keeps the 7-day window exact to the hour)
+    week_start = bucket_start(week_ago, 'hour')
+    usage_hours = []
+    for bucket in data['usage_hours']:
+        usage_hours.extend([bucket['start'].hour] * bucket['count'])
+    usage_hours.sort()
+    # Progress rate (sessions per week)
+    progress_rate = 0.0
+    if timestamps:
+        total_weeks = max(1, (timestamps[-1] - timestamps[0]).days / 7)
+        progress_rate = len(timestamps) / total_weeks if total_weeks > 0 else len(timestamps)
+    # Hotspots (sessions much slower/faster than average)
+    session_usage = data['usage_sessions']
+    session_durations = [u['value'] for u in session_usage]
+    avg_duration = sum(session_durations) / len(session_durations) if session_durations else 0
+    by_stage = _by_stage(stories)
+    return {
+        'name': patient.get('name', ''),
+        'avatar_url': patient.get('avatar_url'),
+        'last_session_date': last_timestamp.isoformat() if last_timestamp else None,
+        'last_session_days_ago': (now - last_timestamp).days if last_timestamp else None,
+        'sud_trend': sud_trend,
+        'high_sud_trend': high_sud_trend,
+        'progress': progress,
+        'flagged': patient.get('flagged', False),
+        'patient_id': patient_id,
+        'latest_note': data['notes'][0]['therapist_note'] if data['notes'] else None,
+        'notes_count': len(data['notes']),
+        # New metrics
+        'total_app_time': sum(b['sum'] for b in data['usage_hours']),
+        'weekly_app_time': sum(b['sum'] for b in data['usage_hours'] if b['start'] >= week_start),
+        'usage_hours': usage_hours,
+        'session_difficulties': [s.get('difficulty') for s in by_stage if s.get('difficulty') is not None],
+        'stories_completed': sum(1 for s in stories if s.get('status') == 'completed'),
+        'sud_by_chapter': [s.get('sud') for s in by_stage],
+        'rewards': data['rewards'],
+        'progress_rate': progress_rate,
+        'hotspots': [u['session_index'] for u in reversed(session_usage) if (u['value'] > avg_duration * 1.5) or (u['value'] < avg_duration * 0.5)]
+    }
@@ -0,0 +1,79 @@
+import copy
+import threading
+from pymongo import ReturnDocument
+from pymongo.errors import DuplicateKeyError
+
+
+def new_progress(patient_id):
+    return {'patient_id': patient_id, 'stage': 1, 'sud_history': [], 'feedback': [], 'therapist_override': None, 'version': 0}
+
+
+class InMemoryProgressStore:
+    """Per-process progress store for dev/tests. Same compare-and-set contract as MongoProgressStore."""
+    def __init__(self):
+        self._progress = {}  # patient_id: progress dict
+        self._lock = threading.Lock()
+
+    def get(self, patient_id):
+        with self._lock:
+            return copy.deepcopy(self._progress.get(patient_id) or new_progress(patient_id))
+
+    def update(self, patient_id, expected_version, set_fields=None, push=None):
+        """
+        Apply $set/$push-style changes if the stored version still equals expected_version.
+        Returns False when another writer got there first.
+        """
+        with self._lock:
+            progress = self._progress.get(patient_id) or new_progress(patient_id)
+            if progress['version'] != expected_version:
+                return False
+            progress.update(copy.deepcopy(set_fields or {}))
+            for key, value in (push or {}).items():
+                progress[key].append(copy.deepcopy(value))
+            progress['version'] += 1
+            self._progress[patient_id] = progress
+            return True
+
+
+class MongoProgressStore:
+    """
+    Progress shared by all workers/nodes, one document per patient in `exposure_progress`.
+    Every write is a single find_one_and_update guarded by the document version, so two
+    concurrent advance_stage calls cannot both apply on top of the same state.
+    """
+    def __init__(self, collection):
+        self.collection = collection
+        self._indexes_ready = False
+
+    def ensure_indexes(self):
+        self.collection.create_index('patient_id', unique=True)
+        self._indexes_ready = True
+
+    def get(self, patient_id):
+        doc = self.collection.find_one({'patient_id': patient_id}, {'_id': 0})
+        return doc or new_progress(patient_id)
+
+    def update(self, patient_id, expected_version, set_fields=None, push=None):
+        if not self._indexes_ready:
+            self.ensure_indexes()
+        set_fields = dict(set_fields or {})
+        update = {'$inc': {'version': 1}}
+        if set_fields:
+            update['$set'] = set_fields
+        if push:
+            update['$push'] = push
+        defaults = {k: v for k, v in new_progress(patient_id).items() if k not in set_fields and k not in (push or {}) and k not in ('patient_id', 'version')}
+        if defaults:
+            update['$setOnInsert'] = defaults
+        try:
+            # expected_version 0 means "not stored yet": the upsert creates it, and the unique
+            # patient_id index turns a concurrent first write into a conflict instead of a duplicate
+            doc = self.collection.find_one_and_update(
+                {'patient_id': patient_id, 'version': expected_version},
+                update,
+                upsert=expected_version == 0,
+                return_document=ReturnDocument.AFTER
+            )
+        except DuplicateKeyError:
+            return False
+        return doc is not None
@@ -0,0 +1,199 @@
+import io
+import json
+import hashlib
+import zipfile
+from bson import ObjectId
+
+BUNDLE_FORMAT = 1
+SEGMENT_CHARS = 1500  # roughly 1-2 minutes of narration per audio segment
+MAX_SEGMENTS = 8
+# Entries get a fixed timestamp so the same content always zips to the same bytes (and hash)
+ZIP_DATE = (1980, 1, 1, 0, 0, 0)
+
+SUD_QUESTION = 'מה רמת ה-SUD שלך כעת? (0-100)'
+
+# MPEG audio layer III: bitrates (kbps) by version, sample rates by version
+_BITRATES = {
+    3: (0, 32, 40, 48, 56, 64, 80, 96, 112, 128, 160, 192, 224, 256, 320),  # MPEG-1
+    2: (0, 8, 16, 24, 32, 40, 48, 56, 64, 80, 96, 112, 128, 144, 160),  # MPEG-2 (gTTS output)
+}
+_BITRATES[0] = _BITRATES[2]  # MPEG-2.5
+_SAMPLE_RATES = {3: (44100, 48000, 32000), 2: (22050, 24000, 16000), 0: (11025, 12000, 8000)}
+
+
+def _frame_size(data, pos):
+    """Length of the MP3 (layer III) frame starting at pos, or None if there is no frame header there."""
+    if pos + 4 > len(data) or data[pos] != 0xFF or data[pos + 1] & 0xE0 != 0xE0:
+        return None
+    version, layer = (data[pos + 1] >> 3) & 3, (data[pos + 1] >> 1) & 3
+    bitrate_index, rate_index, padding = data[pos + 2] >> 4, (data[pos + 2] >> 2) & 3, (data[pos + 2] >> 1) & 1
+    if version == 1 or layer != 1 or bitrate_index in (0, 15) or rate_index == 3:
+        return None
+    bitrate, sample_rate = _BITRATES[version][bitrate_index], _SAMPLE_RATES[version][rate_index]
+    return (144000 if version == 3 else 72000) * bitrate // sample_rate + padding
+
+
+def mp3_frame_offsets(data):
+    """Byte offsets of the MP3 frames in data; ID3 tags and junk between frames are skipped."""
+    offsets = []
+    pos = 0
+    while pos < len(data):
+        if data[pos:pos + 3] == b'ID3' and pos + 10 <= len(data):
+            size = (data[pos + 6] << 21) | (data[pos + 7] << 14) | (data[pos + 8] << 7) | data[pos + 9]
+            pos += 10 + size
+            continue
+        size = _frame_size(data, pos)
+        if size:
+            offsets.append(pos)
+            pos += size
+        else:
+            pos += 1
+    return offsets
+
+
+def split_text(text, target=SEGMENT_CHARS, maximum=MAX_SEGMENTS):
+    """Group the story's paragraphs into about len/target segments (at most `maximum`)."""
+    paragraphs = [p.strip() for p in text.split('\n') if p.strip()]
+    if not paragraphs:
+        return []
+    count = max(1, min(maximum, len(paragraphs), round(len(text) / target)))
+    share = sum(len(p) for p in paragraphs) / count
+    segments, current, size = [], [], 0
+    for paragraph in paragraphs:
+        current.append(paragraph)
+        size += len(paragraph)
+        # Cut at the paragraph end nearest to the next even share (assuming the next paragraph is similar in size)
+        if size + len(paragraph) / 2 >= share * (len(segments) + 1) and len(segments) < count - 1:
+            segments.append('\n'.join(current))
+            current = []
+    if current:
+        segments.append('\n'.join(current))
+    return segments
+
+
+def split_audio(data, weights):
+    """
+    Cut an MP3 into len(weights) parts at frame boundaries, each part's share of the frames
+    proportional to its weight (the text length it narrates). Returns [data] if data has no MP3 frames.
+    """
+    offsets = mp3_frame_offsets(data)
+    if len(weights) < 2 or len(offsets) < len(weights):
+        return [data]
+    total, frames = sum(weights), len(offsets)
+    starts, running = [0], 0
+    for weight in weights[:-1]:
+        running += weight
+        starts.append(min(frames - 1, max(starts[-1] + 1, round(frames * running / total))))
+    cuts = [0] + [offsets[i] for i in starts[1:]] + [len(data)]
+    return [data[cuts[i]:cuts[i + 1]] for i in range(len(weights))]
+
+
+class SessionBundleService:
+    """
+    Offline session bundles: one zip per approved chapter with everything the mobile app needs
+    to play it without a connection, built once and kept in the audio store:
+      manifest.json  story, stage, plan metadata, audio segments and the SUD prompts to show
+      story.txt      the full story text
+      audio/NN.mp3   the narration cut into segments (at MP3 frame boundaries), one per text segment
+    The app answers the SUD prompts offline and uploads them later in one call to
+    POST /api/submit-sud-feedback ({'feedback': [...]}), as described in manifest['sud_upload'],
+    filed under the patient's exposure plan with each answer's prompt_id.
+    Bundles are named by the SHA-256 of their bytes; `session_bundles` maps a story to its current
+    bundle and the state it was built from, so it is rebuilt only when the story changes.
+    """
+    def __init__(self, db, story_store, audio_store):
+        self.stories = db.stories
+        self.bundles = db.session_bundles
+        self.plans = db.exposure_plans
+        self.story_store = story_store
+        self.audio_store = audio_store
+
+    @staticmethod
+    def _source(story, plan_id):
+        result = story.get('result') or {}
+        return f"{BUNDLE_FORMAT}|{story['_id']}|{story.get('updated_at')}|{result.get('audio_file')}|{plan_id}"
+
+    def plan_id(self, story):
+        """The exposure plan SUD answers for the story are filed under: its own, else the patient's latest; None without one."""
+        if story.get('plan_id'):
+            return story['plan_id']
+        plan = self.plans.find_one({'patient_id': story.get('patient_id')}, {'plan_id': 1}, sort=[('updated_at', -1), ('_id', -1)])
+        return plan['plan_id'] if plan else None
+
+    def get(self, story):
+        """Bundle record ({'name', 'sha256', 'size'}) for an approved, hydrated story; built if missing or stale."""
+        plan_id = self.plan_id(story)
+        source = self._source(story, plan_id)
+        record = self.bundles.find_one({'_id': story['_id']})
+        if record and record['source'] == source and self.audio_store.exists(record['name']):
+            return record
+        data = self.build(story, plan_id)
+        digest = hashlib.sha256(data).hexdigest()
+        record = {'_id': story['_id'], 'source': source, 'name': f"bundle_{digest}.zip", 'sha256': digest, 'size': len(data)}
+        if not self.audio_store.exists(record['name']):
+            self.audio_store.save(record['name'], data)
+        self.bundles.replace_one({'_id': story['_id']}, record, upsert=True)
+        return record
+
+    def _audio(self, name):
+        audio = self.audio_store.open(name) if name else None
+        if audio is None:
+            return None
+        with audio.fileobj as f:
+            return f.read()
+
+    def build(self, story, plan_id=None):
+        """The bundle's zip bytes; the same story state (and plan) always gives the same bytes."""
+        result = story.get('result') or {}
+        text = result.get('story') or ''
+        segments = split_text(text) or [text]
+        audio = self._audio(result.get('audio_file'))
+        parts = split_audio(audio, [len(s) for s in segments]) if audio else []
+        if parts and len(parts) != len(segments):
+            # Audio that could not be cut: one segment with the whole text and file
+            segments = ['\n'.join(segments)]
+        story_id = str(story['_id'])
+        manifest = {
+            'format': BUNDLE_FORMAT,
+            'story_id': story_id,
+            'patient_id': story.get('patient_id'),
+            'stage': story.get('stage'),
+            'plan': result.get('plan'),
+            'expected_sud': (result.get('evaluation') or {}).get('expected_sud'),
+            'segments': [],
+            # Asked before the chapter and after every segment (the last one ends the chapter)
+            'sud_prompts': [{'id': 'before', 'after_segment': None, 'question': SUD_QUESTION, 'min': 0, 'max': 100}],
+            # One entry per answered prompt: this item plus the prompt's id as prompt_id, sud_value and
+            # the ISO timestamp it was given at. None when the patient has no exposure plan to file it under.
+            'sud_upload': {
+                'url': '/api/submit-sud-feedback',
+                'item': {'plan_id': plan_id, 'patient_id': story.get('patient_id'), 'part_index': story.get('stage')},
+            } if plan_id else None,
+        }
+        files = []
+        for i, segment in enumerate(segments, 1):
+            entry = {'index': i, 'text': segment, 'audio': None}
+            if parts:
+                name = f"audio/{i:02d}.mp3"
+                files.append((name, parts[i - 1]))
+                entry.update(audio=name, audio_size=len(files[-1][1]), audio_sha256=hashlib.sha256(files[-1][1]).hexdigest())
+            manifest['segments'].append(entry)
+            manifest['sud_prompts'].append({'id': f'after_{i}', 'after_segment': i, 'question': SUD_QUESTION, 'min': 0, 'max': 100})
+
+        buffer = io.BytesIO()
+        with zipfile.ZipFile(buffer, 'w') as bundle:
+            def add(name, data, compress):
+                info = zipfile.ZipInfo(name, ZIP_DATE)
+                info.compress_type = zipfile.ZIP_DEFLATED if compress else zipfile.ZIP_STORED
+                bundle.writestr(info, data)
+            add('manifest.json', json.dumps(manifest, ensure_ascii=False, sort_keys=True, default=str).encode('utf-8'), True)
+            add('story.txt', text.encode('utf-8'), True)
+            for name, data in files:
+                add(name, data, False)  # MP3 does not compress further
+        return buffer.getvalue()
+
+    def find_story(self, story_id):
+        """The hydrated story with this _id, or None."""
+        if not ObjectId.is_valid(story_id):
+            return None
+        return self.story_store.hydrate_one(self.stories.find_one({'_id': ObjectId(story_id)}))
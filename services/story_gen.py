@@ -4,9 +4,10 @@ from services.narrative_coherence_service import NarrativeCoherenceService
 from services.internal_dialogue_service import InternalDialogueService
 from services.rule_compliance_service import RuleComplianceService
 from services.hebrew_service import HebrewService
+from services.audio_store import LocalAudioStore
+import io
 import uuid
-from gtts import gTTS
-import os
+import asyncio
 
 class StoryGenerationService:
     """
@@ -18,8 +19,9 @@ class StoryGenerationService:
     - Rule compliance
     - Hebrew language
     Returns all feedback in the result dict.
+    The story audio is saved to audio_store (LocalAudioStore by default, GridFSAudioStore for multiple nodes).
     """
-    def __init__(self):
+    def __init__(self, audio_store=None):
         self.plan_agent = PlanGenAgent()
         self.eval_agent = ImpactEvalAgent()
         self.story_agent = StoryGenAgent()
@@ -28,6 +30,13 @@ class StoryGenerationService:
         self.dialogue_service = InternalDialogueService()
         self.rule_service = RuleComplianceService()
         self.hebrew_service = HebrewService()
+        self.audio_store = audio_store or LocalAudioStore()
+
+    def warm_up(self):
+        """Read the agent prompts and import gTTS ahead of the first generation."""
+        import gtts  # noqa: F401
+        for agent in (self.plan_agent, self.eval_agent, self.story_agent):
+            agent._prompt
 
     def format_patient_context(self, patient_profile):
         lines = []
@@ -59,15 +68,7 @@ class StoryGenerationService:
         - rules: string of clinical rules to inject into the LLM prompt (from .cursorrules or other source)
         Returns: dict with plan, evaluation, story, and feedback from modular services and validators.
         """
-        word_counts = {1: 1000, 2: 2000, 3: 3000}
-        word_count = word_counts.get(exposure_stage, 1000)
-
-        # Format patient context for LLM
-        context = self.format_patient_context(patient_profile)
-        patient_profile_with_wordcount = dict(patient_profile)
-        patient_profile_with_wordcount['word_count_instruction'] = (
-            f"Please ensure the generated plan and story for this part is approximately {word_count} words long."
-        )
+        context, word_count = self._prepare(patient_profile, exposure_stage)
 
         # Generate the plan
         plan = self.plan_agent.generate_plan(
@@ -88,20 +89,56 @@ class StoryGenerationService:
             rules=rules
         )
 
-        # If plan is a string, append the word count instruction for the story agent
-        if isinstance(plan, str):
-            plan_for_story = f"{plan}\n\nPlease ensure this story part is about {word_count} words."
-        else:
-            plan_for_story = plan
-
         # Generate the story
         story = self.story_agent.generate_story(
             part=exposure_stage,
-            plan=plan_for_story,
+            plan=self._plan_for_story(plan, word_count),
+            previous_parts=previous_parts,
+            rules=rules
+        )
+        return self._finish(plan, expected_sud, explanation, story)
+
+    async def agenerate_story(self, patient_profile, exposure_stage, last_sud=None, previous_parts=None, rules=None):
+        """
+        generate_story() for the ASGI serving mode: the LLM calls are awaited, and the validators
+        and text-to-speech run in a worker thread, so the event loop keeps serving other requests.
+        """
+        context, word_count = self._prepare(patient_profile, exposure_stage)
+        plan = await self.plan_agent.agenerate_plan(
+            part=exposure_stage,
+            patient_data=context,
+            previous_sud=last_sud,
+            rules=rules
+        )
+        expected_sud, explanation = await self.eval_agent.aevaluate_sud(
+            plan=plan,
+            patient_data=context,
+            last_patient_sud=last_sud,
+            rules=rules
+        )
+        story = await self.story_agent.agenerate_story(
+            part=exposure_stage,
+            plan=self._plan_for_story(plan, word_count),
             previous_parts=previous_parts,
             rules=rules
         )
+        return await asyncio.to_thread(self._finish, plan, expected_sud, explanation, story)
+
+    def _prepare(self, patient_profile, exposure_stage):
+        word_counts = {1: 1000, 2: 2000, 3: 3000}
+        word_count = word_counts.get(exposure_stage, 1000)
+
+        # Format patient context for LLM
+        context = self.format_patient_context(patient_profile)
+        return context, word_count
+
+    def _plan_for_story(self, plan, word_count):
+        # If plan is a string, append the word count instruction for the story agent
+        if isinstance(plan, str):
+            return f"{plan}\n\nPlease ensure this story part is about {word_count} words."
+        return plan
 
+    def _finish(self, plan, expected_sud, explanation, story):
         # Post-process with modular services
         habituation_feedback = self.habituation_service.validate_habituation_curve(story)
         narrative_feedback = self.narrative_service.validate_narrative_structure(story)
@@ -112,10 +149,12 @@ class StoryGenerationService:
         # Convert story to speech
         audio_file = None
         try:
+            from gtts import gTTS  # imported on first use, keeps app startup light
             tts = gTTS(story, lang='iw')
+            buffer = io.BytesIO()
+            tts.write_to_fp(buffer)
             audio_file = f"story_{uuid.uuid4().hex}.mp3"
-            audio_path = os.path.join('static', 'audio', audio_file)
-            tts.save(audio_path)
+            self.audio_store.save(audio_file, buffer.getvalue())
         except Exception as e:
             audio_file = None  # Optionally log error
         return {
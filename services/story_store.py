@@ -0,0 +1,129 @@
+import zlib
+import datetime
+from bson import Binary, ObjectId, json_util
+
+try:
+    import zstandard
+except ImportError:  # optional: zlib is always available
+    zstandard = None
+
+
+def _compress(data, codec):
+    if codec == 'zstd':
+        return zstandard.ZstdCompressor(level=10).compress(data)
+    return zlib.compress(data, 9)
+
+
+def _decompress(data, codec):
+    if codec == 'zstd':
+        if zstandard is None:
+            raise RuntimeError('Story content is zstd-compressed but the zstandard package is not installed')
+        return zstandard.ZstdDecompressor().decompress(data)
+    return zlib.decompress(data)
+
+
+class StoryStore:
+    """
+    Writes and reads `stories` documents.
+    With compress=True, the large generation payload in `result` (story text, plan, evaluation
+    explanation, validator feedback) is stored compressed in the `story_content` collection under
+    the story's _id; the story document keeps only metadata (audio_file, expected_sud) and a
+    `result.content_ref`. hydrate()/hydrate_one() put the content back transparently, so readers
+    see the same documents either way. Uncompressed documents are passed through untouched.
+    The a* methods do the same on a motor (asyncio) database, for the ASGI serving mode.
+    """
+    INLINE_FIELDS = ('audio_file',)
+
+    def __init__(self, db, compress=False, codec=None):
+        self.stories = db.stories
+        self.contents = db.story_content
+        self.compress = compress
+        self.codec = codec or ('zstd' if zstandard else 'zlib')
+
+    def _split(self, story_id, result):
+        """Return (metadata result, content document) for one story result."""
+        inline = {k: result[k] for k in self.INLINE_FIELDS if k in result}
+        content = {k: v for k, v in result.items() if k not in self.INLINE_FIELDS}
+        evaluation = content.get('evaluation')
+        if isinstance(evaluation, dict) and 'expected_sud' in evaluation:
+            inline['evaluation'] = {'expected_sud': evaluation['expected_sud']}
+        raw = json_util.dumps(content, ensure_ascii=False).encode('utf-8')
+        data = _compress(raw, self.codec)
+        inline['content_ref'] = {'codec': self.codec, 'size': len(raw), 'stored_size': len(data)}
+        return inline, {'_id': story_id, 'codec': self.codec, 'data': Binary(data)}
+
+    def insert(self, doc):
+        """Insert a story document, compressing its result when compression is on. Returns the _id."""
+        doc['updated_at'] = datetime.datetime.utcnow()  # read by the mobile delta sync
+        if not self.compress or not isinstance(doc.get('result'), dict):
+            return self.stories.insert_one(doc).inserted_id
+        story_id = doc.setdefault('_id', ObjectId())
+        inline, content = self._split(story_id, doc['result'])
+        # Content first, so a reader never sees a reference to missing content
+        self.contents.replace_one({'_id': story_id}, content, upsert=True)
+        self.stories.insert_one({**doc, 'result': inline})
+        return story_id
+
+    async def ainsert(self, doc):
+        doc['updated_at'] = datetime.datetime.utcnow()
+        if not self.compress or not isinstance(doc.get('result'), dict):
+            return (await self.stories.insert_one(doc)).inserted_id
+        story_id = doc.setdefault('_id', ObjectId())
+        inline, content = self._split(story_id, doc['result'])
+        await self.contents.replace_one({'_id': story_id}, content, upsert=True)
+        await self.stories.insert_one({**doc, 'result': inline})
+        return story_id
+
+    @staticmethod
+    def _pending(docs):
+        return {
+            d['_id']: d for d in docs
+            if isinstance(d.get('result'), dict) and 'content_ref' in d['result'] and '_id' in d
+        }
+
+    @staticmethod
+    def _merge(doc, content):
+        payload = json_util.loads(_decompress(content['data'], content.get('codec', 'zlib')).decode('utf-8'))
+        doc['result'].pop('content_ref', None)
+        doc['result'].update(payload)
+
+    def hydrate(self, docs):
+        """Merge decompressed content back into `result` for every compressed story in docs (by _id)."""
+        pending = self._pending(docs)
+        if not pending:
+            return docs
+        for content in self.contents.find({'_id': {'$in': list(pending)}}):
+            self._merge(pending[content['_id']], content)
+        return docs
+
+    async def ahydrate(self, docs):
+        pending = self._pending(docs)
+        if not pending:
+            return docs
+        async for content in self.contents.find({'_id': {'$in': list(pending)}}):
+            self._merge(pending[content['_id']], content)
+        return docs
+
+    def hydrate_one(self, doc):
+        if doc:
+            self.hydrate([doc])
+        return doc
+
+    def compress_existing(self, batch_size=100, log=print):
+        """
+        Migration: move the result payload of every uncompressed story into story_content.
+        Safe to re-run; already compressed stories are skipped. Returns the number migrated.
+        """
+        migrated = 0
+        query = {'result': {'$type': 'object'}, 'result.content_ref': {'$exists': False}}
+        while True:
+            batch = list(self.stories.find(query, {'result': 1}).sort('_id', 1).limit(batch_size))
+            if not batch:
+                break
+            for doc in batch:
+                inline, content = self._split(doc['_id'], doc['result'])
+                self.contents.replace_one({'_id': doc['_id']}, content, upsert=True)
+                self.stories.update_one({'_id': doc['_id']}, {'$set': {'result': inline}})
+            migrated += len(batch)
+            log(f"Compressed {migrated} stories")
+        return migrated
@@ -0,0 +1,188 @@
+import numpy as np
+
+DAY = 86400.0
+
+
+class SudSeries:
+    """
+    SUD readings of a cohort as parallel NumPy arrays, sorted by (patient, time).
+    - patient: index into patient_ids
+    - t: seconds since the epoch
+    - value: SUD score
+    - chapter: story stage / plan part of the reading, -1 if unknown
+    """
+    def __init__(self, patient_ids, patient, t, value, chapter):
+        self.patient_ids = patient_ids
+        self.patient = patient
+        self.t = t
+        self.value = value
+        self.chapter = chapter
+
+    def __len__(self):
+        return len(self.value)
+
+    @classmethod
+    def load(cls, events, patient_ids=None, start=None, end=None, batch_size=5000):
+        """Load SUD readings from the patient_events collection (see TimeSeriesStore)."""
+        query = {'kind': 'sud'}
+        if patient_ids:
+            query['patient_id'] = {'$in': list(patient_ids)}
+        if start or end:
+            query['timestamp'] = {}
+            if start:
+                query['timestamp']['$gte'] = start
+            if end:
+                query['timestamp']['$lt'] = end
+        projection = {'_id': 0, 'patient_id': 1, 'timestamp': 1, 'value': 1, 'stage': 1, 'part_index': 1}
+        pids, times, values, chapters = [], [], [], []
+        for doc in events.find(query, projection).batch_size(batch_size):
+            pids.append(doc['patient_id'])
+            times.append(doc['timestamp'])
+            values.append(doc['value'])
+            chapter = doc.get('stage', doc.get('part_index'))
+            chapters.append(-1 if chapter is None else chapter)
+        return cls.from_lists(pids, times, values, chapters)
+
+    @classmethod
+    def from_lists(cls, pids, times, values, chapters):
+        patient_ids, patient = np.unique(np.array(pids, dtype=object), return_inverse=True)
+        t = np.array(times, dtype='datetime64[ms]').astype(np.int64) / 1000.0
+        value = np.array(values, dtype=float)
+        chapter = np.array(chapters, dtype=np.int64)
+        order = np.lexsort((t, patient))
+        return cls(list(patient_ids), patient[order].astype(np.int64), t[order], value[order], chapter[order])
+
+
+def _group_starts(*keys):
+    """Indices where any of the (sorted) key arrays changes value; always includes 0."""
+    change = np.zeros(len(keys[0]), dtype=bool)
+    change[0] = True
+    for key in keys:
+        change[1:] |= key[1:] != key[:-1]
+    return np.flatnonzero(change)
+
+
+def _group_mean(groups, weights, n_groups):
+    """Mean of weights per group id, NaN for groups without values (ignores NaN weights)."""
+    valid = ~np.isnan(weights)
+    counts = np.bincount(groups[valid], minlength=n_groups)
+    sums = np.bincount(groups[valid], weights=weights[valid], minlength=n_groups)
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.where(counts > 0, sums / np.maximum(counts, 1), np.nan)
+
+
+def _robust_z(x):
+    """Modified z-score (median/MAD); 0 where the spread is zero."""
+    median = np.nanmedian(x)
+    mad = np.nanmedian(np.abs(x - median))
+    if not mad:
+        return np.zeros_like(x)
+    return 0.6745 * (x - median) / mad
+
+
+def _num(x):
+    return None if x is None or np.isnan(x) else round(float(x), 3)
+
+
+def analyze(series, target_max=40, session_gap_hours=2, outlier_z=3.5):
+    """
+    Cohort SUD outcome analytics, vectorized over all readings.
+    A session is a run of one patient's readings with no gap longer than session_gap_hours.
+    Returns {'patients': [...], 'chapters': [...], 'outlier_sessions': [...]}.
+    """
+    n_patients = len(series.patient_ids)
+    if len(series) == 0:
+        return {'patients': [], 'chapters': [], 'outlier_sessions': []}
+    patient, t, value, chapter = series.patient, series.t, series.value, series.chapter
+
+    # Sessions
+    new_session = np.zeros(len(t), dtype=bool)
+    new_session[0] = True
+    new_session[1:] = (patient[1:] != patient[:-1]) | (np.diff(t) > session_gap_hours * 3600)
+    session = np.cumsum(new_session) - 1
+    s_start = np.flatnonzero(new_session)
+    s_end = np.append(s_start[1:], len(t)) - 1
+    s_patient = patient[s_start]
+    within = value[s_end] - value[s_start]
+    s_peak = np.maximum.reduceat(value, s_start)
+    s_size = np.diff(np.append(s_start, len(t)))
+
+    # Between sessions: next session's first reading minus this session's last, same patient only
+    same_patient = s_patient[1:] == s_patient[:-1]
+    between = np.where(same_patient, value[s_start[1:]] - value[s_end[:-1]], np.nan)
+
+    # Habituation slope: least squares of SUD on days since the patient's first reading
+    p_first = np.flatnonzero(np.r_[True, patient[1:] != patient[:-1]])
+    x = (t - t[p_first][patient]) / DAY
+    n = np.bincount(patient, minlength=n_patients).astype(float)
+    sx = np.bincount(patient, weights=x, minlength=n_patients)
+    sy = np.bincount(patient, weights=value, minlength=n_patients)
+    sxx = np.bincount(patient, weights=x * x, minlength=n_patients)
+    sxy = np.bincount(patient, weights=x * value, minlength=n_patients)
+    denom = n * sxx - sx * sx
+    with np.errstate(invalid='ignore', divide='ignore'):
+        slope = np.where(denom > 0, (n * sxy - sx * sy) / np.where(denom > 0, denom, 1), np.nan)
+
+    # Peak-to-end reduction per (session, chapter) block
+    b_start = _group_starts(session, chapter)
+    b_end = np.append(b_start[1:], len(t)) - 1
+    b_reduction = np.maximum.reduceat(value, b_start) - value[b_end]
+    b_chapter = chapter[b_start]
+    b_patient = patient[b_start]
+
+    # Time to target range: days from the first reading to the first reading <= target_max
+    hits = np.flatnonzero(value <= target_max)
+    days_to_target = np.full(n_patients, np.nan)
+    if len(hits):
+        hit_patients, first_hit = np.unique(patient[hits], return_index=True)
+        days_to_target[hit_patients] = x[hits[first_hit]]
+
+    within_mean = _group_mean(s_patient, within, n_patients)
+    between_mean = _group_mean(s_patient[:-1], between, n_patients)
+    reduction_mean = _group_mean(b_patient, b_reduction, n_patients)
+    sessions_per_patient = np.bincount(s_patient, minlength=n_patients)
+    patients = [
+        {
+            'patient_id': series.patient_ids[i],
+            'readings': int(n[i]),
+            'sessions': int(sessions_per_patient[i]),
+            'habituation_slope_per_day': _num(slope[i]),
+            'mean_within_session_change': _num(within_mean[i]),
+            'mean_between_session_change': _num(between_mean[i]),
+            'mean_peak_to_end_reduction': _num(reduction_mean[i]),
+            'days_to_target': _num(days_to_target[i])
+        }
+        for i in range(n_patients)
+    ]
+
+    chapter_ids, chapter_index = np.unique(b_chapter, return_inverse=True)
+    chapter_counts = np.bincount(chapter_index)
+    chapter_means = np.bincount(chapter_index, weights=b_reduction) / chapter_counts
+    chapters = [
+        {
+            'chapter': int(c) if c >= 0 else None,
+            'blocks': int(chapter_counts[i]),
+            'mean_peak_to_end_reduction': _num(chapter_means[i]),
+            'median_peak_to_end_reduction': _num(np.median(b_reduction[chapter_index == i]))
+        }
+        for i, c in enumerate(chapter_ids)
+    ]
+
+    # Outlier sessions: unusually high peak or unusual within-session change, among multi-reading sessions
+    multi = s_size > 1
+    z_peak = _robust_z(s_peak)
+    z_change = np.where(multi, _robust_z(np.where(multi, within, np.nan)), 0.0) if multi.any() else np.zeros(len(within))
+    z = np.where(np.abs(z_peak) >= np.abs(z_change), z_peak, z_change)
+    outliers = np.flatnonzero(np.abs(z) > outlier_z)
+    outlier_sessions = [
+        {
+            'patient_id': series.patient_ids[s_patient[i]],
+            'start': np.datetime64(int(t[s_start[i]] * 1000), 'ms').astype(object).isoformat(),
+            'readings': int(s_size[i]),
+            'peak_sud': _num(s_peak[i]),
+            'within_session_change': _num(within[i]) if multi[i] else None,
+            'z_score': _num(z[i])
+        }
+        for i in outliers[np.argsort(-np.abs(z[outliers]))]
+    ]
+    return {'patients': patients, 'chapters': chapters, 'outlier_sessions': outlier_sessions}
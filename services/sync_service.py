@@ -0,0 +1,135 @@
+import datetime
+from pymongo import ASCENDING
+from utils.pagination import encode_cursor, decode_cursor, _range_query
+
+EPOCH = datetime.datetime(1970, 1, 1)
+SORT = [('updated_at', ASCENDING), ('_id', ASCENDING)]
+
+
+def _story_item(doc):
+    result = doc.get('result') if isinstance(doc.get('result'), dict) else {}
+    audio_file = result.get('audio_file')
+    return {
+        'id': str(doc['_id']),
+        'stage': doc.get('stage'),
+        'status': doc.get('status'),
+        'sud': doc.get('sud'),
+        'timestamp': doc.get('timestamp'),
+        'story': result.get('story'),
+        # Audio availability: the file is served (with Range support) by /api/audio/<name>
+        'audio_url': f"/api/audio/{audio_file}" if audio_file else None,
+        'updated_at': doc['updated_at'],
+    }
+
+
+def _plan_item(doc):
+    return {
+        'id': doc['plan_id'],
+        'plan_details': doc.get('plan_details'),
+        'segments': doc.get('segments', []),
+        'coping_mechanisms': doc.get('coping_mechanisms', []),
+        'updated_at': doc['updated_at'],
+    }
+
+
+def _feedback_item(doc):
+    return {
+        'id': doc['feedback_id'],
+        'plan_id': doc.get('plan_id'),
+        'part_index': doc.get('part_index'),
+        'prompt_id': doc.get('prompt_id'),
+        'sud_value': doc.get('sud_value'),
+        'timestamp': doc.get('timestamp'),
+        'therapist_note': doc.get('therapist_note'),
+        'updated_at': doc['updated_at'],
+    }
+
+
+class SyncService:
+    """
+    Delta sync for the mobile app: a patient's stories (with audio availability), exposure plans
+    and SUD feedback changed since a sync token, plus tombstones for items that went away.
+    Every synced document carries `updated_at`, set by each write path, and a
+    (patient_id, updated_at, _id) index, so a sync reads only the changed documents.
+
+    The token holds, per kind, the (updated_at, _id) position the client has seen. When a kind
+    is caught up, its position moves to `now - skew`: a write whose updated_at was stamped before
+    it committed (or on a node with a slightly earlier clock) is still picked up by the next sync.
+    Clients therefore see a few items twice and must apply items as upserts by id.
+    Tombstones are kept for `tombstone_ttl`; a token older than that gets a full resync with
+    reset=True, as it may have missed deletions.
+    """
+    KINDS = {
+        # kind: (collection, patient query, projection, item builder)
+        'stories': ('stories', {'status': {'$ne': 'rejected'}}, None, _story_item),
+        'plans': ('exposure_plans', {}, {'rules_applied': 0, 'validation_checklist': 0, 'anxiety_curve': 0}, _plan_item),
+        'feedback': ('sud_feedback', {}, None, _feedback_item),
+        'tombstones': ('sync_tombstones', {}, None, lambda d: {'kind': d['kind'], 'id': d['item_id'], 'updated_at': d['updated_at']}),
+    }
+
+    def __init__(self, db, story_store, skew=datetime.timedelta(seconds=5), tombstone_ttl=datetime.timedelta(days=30), limit=200):
+        self.db = db
+        self.story_store = story_store
+        self.skew = skew
+        self.tombstone_ttl = tombstone_ttl
+        self.limit = limit
+        self.tombstones = db.sync_tombstones
+
+    def ensure_indexes(self):
+        for collection, _, _, _ in self.KINDS.values():
+            self.db[collection].create_index([('patient_id', ASCENDING), ('updated_at', ASCENDING), ('_id', ASCENDING)])
+        self.tombstones.create_index('updated_at', expireAfterSeconds=int(self.tombstone_ttl.total_seconds()))
+
+    def tombstone(self, patient_id, kind, item_id):
+        """Record that an item no longer exists for the patient (deleted or hidden from the app)."""
+        self.tombstones.update_one(
+            {'patient_id': patient_id, 'kind': kind, 'item_id': item_id},
+            {'$set': {'updated_at': datetime.datetime.utcnow()}},
+            upsert=True
+        )
+
+    def restore(self, patient_id, kind, item_id):
+        """Undo tombstone(): the item is synced again (it must also get a new updated_at)."""
+        self.tombstones.delete_one({'patient_id': patient_id, 'kind': kind, 'item_id': item_id})
+
+    def _positions(self, token, now):
+        """Per-kind [updated_at, last _id or None] from a token; (positions, reset)."""
+        start = {kind: [EPOCH, None] for kind in self.KINDS}
+        if not token:
+            return start, False
+        positions = {}
+        for entry in decode_cursor(token):
+            if not isinstance(entry, list) or len(entry) != 3 or entry[0] not in self.KINDS or not isinstance(entry[1], datetime.datetime):
+                raise ValueError('Invalid sync token')
+            positions[entry[0]] = [entry[1], entry[2]]
+        if set(positions) != set(self.KINDS):
+            raise ValueError('Invalid sync token')
+        if min(p[0] for p in positions.values()) < now - self.tombstone_ttl:
+            return start, True  # deletions older than that are forgotten
+        return positions, False
+
+    def changes(self, patient_id, token=None):
+        """
+        Changes for the patient since `token` (None: everything). Returns a dict with one list
+        per kind, the next token, `has_more` (call again with the new token straight away) and
+        `reset` (drop local data first).
+        """
+        now = datetime.datetime.utcnow()
+        positions, reset = self._positions(token, now)
+        changes = {}
+        has_more = False
+        for kind, (collection, query, projection, item) in self.KINDS.items():
+            since, last_id = positions[kind]
+            position = _range_query(SORT, [since, last_id]) if last_id is not None else {'updated_at': {'$gte': since}}
+            docs = list(self.db[collection].find({'patient_id': patient_id, **query, **position}, projection).sort(SORT).limit(self.limit + 1))
+            if len(docs) > self.limit:
+                docs = docs[:self.limit]
+                has_more = True
+                positions[kind] = [docs[-1]['updated_at'], docs[-1]['_id']]
+            else:
+                positions[kind] = [max(since, now - self.skew), None]
+            if kind == 'stories':
+                self.story_store.hydrate(docs)
+            changes[kind] = [item(d) for d in docs]
+        next_token = encode_cursor([[kind, since, last_id] for kind, (since, last_id) in positions.items()])
+        return {**changes, 'sync_token': next_token, 'has_more': has_more, 'reset': reset}
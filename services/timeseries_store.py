@@ -0,0 +1,222 @@
+import datetime
+from pymongo import ASCENDING, DESCENDING, UpdateOne
+from pymongo.errors import CollectionInvalid, OperationFailure
+from utils.timestamps import naive_utc
+
+GRANULARITIES = ('hour', 'day', 'week')
+KINDS = ('sud', 'usage')
+
+
+def bucket_start(timestamp, granularity):
+    """Start of the hour/day/week (weeks start on Monday) containing timestamp."""
+    hour = timestamp.replace(minute=0, second=0, microsecond=0)
+    if granularity == 'hour':
+        return hour
+    day = hour.replace(hour=0)
+    if granularity == 'day':
+        return day
+    if granularity == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    raise ValueError(f'Unknown granularity: {granularity}')
+
+
+def _accumulate(rollups, doc):
+    """Add one event to the {(patient_id, kind, granularity, start): {count, sum, min, max}} aggregates."""
+    for granularity in GRANULARITIES:
+        key = (doc['patient_id'], doc['kind'], granularity, bucket_start(doc['timestamp'], granularity))
+        agg = rollups.setdefault(key, {'count': 0, 'sum': 0, 'min': doc['value'], 'max': doc['value']})
+        agg['count'] += 1
+        agg['sum'] += doc['value']
+        agg['min'] = min(agg['min'], doc['value'])
+        agg['max'] = max(agg['max'], doc['value'])
+
+
+class TimeSeriesStore:
+    """
+    SUD readings and app usage events for all patients.
+    Raw events go to the `patient_events` time-series collection (patient_id is the metaField);
+    every write also updates hourly/daily/weekly rollups in `patient_event_rollups`
+    (count, sum, min, max per patient, kind and bucket), so trends and totals are range reads
+    over a few rollup documents instead of scans over raw events.
+    - sud events: value is the SUD score
+    - usage events: value is the duration in seconds
+    """
+    def __init__(self, db):
+        self.db = db
+        self.events = db.patient_events
+        self.rollups = db.patient_event_rollups
+        self._ready = False
+
+    def ensure_collections(self):
+        if 'patient_events' not in self.db.list_collection_names():
+            try:
+                self.db.create_collection(
+                    'patient_events',
+                    timeseries={'timeField': 'timestamp', 'metaField': 'patient_id', 'granularity': 'hours'}
+                )
+            except (CollectionInvalid, OperationFailure):
+                pass  # created concurrently, or a server without time-series support: a plain collection works too
+        self.events.create_index([('patient_id', ASCENDING), ('timestamp', DESCENDING)])
+        try:
+            self.events.create_index([('recorded_at', ASCENDING)])
+        except OperationFailure:
+            pass  # time-series collections before MongoDB 6.0 only index the meta and time fields
+        self.rollups.create_index(
+            [('patient_id', ASCENDING), ('kind', ASCENDING), ('granularity', ASCENDING), ('start', ASCENDING)],
+            unique=True
+        )
+        self._ready = True
+
+    def record(self, events):
+        """
+        Store events ({patient_id, kind, value, timestamp?, ...extra fields}) and update their rollups.
+        Returns the number of events stored.
+        """
+        if not self._ready:
+            self.ensure_collections()
+        docs = []
+        rollups = {}
+        # Write time, distinct from the event's own (possibly much older) timestamp: incremental jobs watermark on it
+        recorded_at = datetime.datetime.utcnow()
+        for event in events:
+            if event.get('kind') not in KINDS:
+                raise ValueError(f"Unknown event kind: {event.get('kind')}")
+            doc = dict(event)
+            # Naive UTC like everything else stored, so events and their buckets line up
+            doc['timestamp'] = naive_utc(doc.get('timestamp')) or recorded_at
+            doc['recorded_at'] = recorded_at
+            if isinstance(doc.get('value'), bool) or not isinstance(doc.get('value'), (int, float)):
+                raise ValueError(f"Event value must be a number, got {doc.get('value')!r}")
+            docs.append(doc)
+            _accumulate(rollups, doc)
+        if not docs:
+            return 0
+        # Two writes, not atomic: if the process dies between them, reconcile() (run by the cohort
+        # report job) rebuilds the affected rollups from the raw events
+        self.events.insert_many(docs, ordered=False)
+        self.rollups.bulk_write([
+            UpdateOne(
+                {'patient_id': patient_id, 'kind': kind, 'granularity': granularity, 'start': start},
+                {
+                    '$inc': {'count': agg['count'], 'sum': agg['sum']},
+                    '$min': {'min': agg['min']},
+                    '$max': {'max': agg['max']}
+                },
+                upsert=True
+            )
+            for (patient_id, kind, granularity, start), agg in rollups.items()
+        ], ordered=False)
+        return len(docs)
+
+    def record_sud(self, patient_id, value, source, timestamp=None, **extra):
+        return self.record([{**extra, 'patient_id': patient_id, 'kind': 'sud', 'value': value, 'source': source, 'timestamp': timestamp}])
+
+    def record_usage(self, patient_id, duration, timestamp=None, **extra):
+        return self.record([{**extra, 'patient_id': patient_id, 'kind': 'usage', 'value': duration, 'timestamp': timestamp}])
+
+    def reconcile(self, since, until):
+        """
+        Rebuild, from the raw events, the rollups of every patient-week with events written in
+        [since, until). Repairs rollups that missed or double-counted an event because a write
+        failed between the event insert and the rollup update. Returns the number of patient-weeks.
+        """
+        window = {'$gte': since, '$lt': until}
+        written = {'$or': [{'recorded_at': window}, {'recorded_at': {'$exists': False}, 'timestamp': window}]}
+        weeks = {
+            (doc['patient_id'], bucket_start(doc['timestamp'], 'week'))
+            for doc in self.events.find(written, {'patient_id': 1, 'timestamp': 1})
+        }
+        for patient_id, week in weeks:
+            self._rebuild_week(patient_id, week)
+        return len(weeks)
+
+    def _rebuild_week(self, patient_id, week):
+        # Hour and day buckets nest inside the week, so the week's events determine all of them
+        span = {'$gte': week, '$lt': week + datetime.timedelta(days=7)}
+        rollups = {}
+        for doc in self.events.find({'patient_id': patient_id, 'timestamp': span}, {'patient_id': 1, 'kind': 1, 'value': 1, 'timestamp': 1}):
+            _accumulate(rollups, doc)
+        ops = [
+            UpdateOne(
+                {'patient_id': patient_id, 'kind': kind, 'granularity': granularity, 'start': start},
+                {'$set': agg},
+                upsert=True
+            )
+            for (_, kind, granularity, start), agg in rollups.items()
+        ]
+        stale = [
+            doc['_id'] for doc in self.rollups.find({'patient_id': patient_id, 'start': span}, {'kind': 1, 'granularity': 1, 'start': 1})
+            if (patient_id, doc['kind'], doc['granularity'], doc['start']) not in rollups
+        ]
+        if ops:
+            self.rollups.bulk_write(ops, ordered=False)
+        if stale:
+            self.rollups.delete_many({'_id': {'$in': stale}})
+
+    def series(self, patient_id, kind, granularity='day', start=None, end=None):
+        """Rollup buckets for one patient in [start, end), oldest first."""
+        if granularity not in GRANULARITIES:
+            raise ValueError(f'Unknown granularity: {granularity}')
+        query = {'patient_id': patient_id, 'kind': kind, 'granularity': granularity}
+        if start or end:
+            query['start'] = {}
+            if start:
+                query['start']['$gte'] = bucket_start(start, granularity)
+            if end:
+                query['start']['$lt'] = end
+        return [
+            {
+                'start': doc['start'].isoformat(),
+                'count': doc['count'],
+                'sum': doc['sum'],
+                'avg': doc['sum'] / doc['count'] if doc['count'] else None,
+                'min': doc['min'],
+                'max': doc['max']
+            }
+            for doc in self.rollups.find(query, {'_id': 0}).sort('start', ASCENDING)
+        ]
+
+    def total(self, patient_id, kind, start=None, granularity='week'):
+        """Sum of values since start (aligned down to the granularity), from rollups."""
+        return sum(bucket['sum'] for bucket in self.series(patient_id, kind, granularity, start=start))
+
+    def hour_histogram(self, patient_id, kind):
+        """Event count per hour of day (0-23), from the hourly rollups."""
+        counts = [0] * 24
+        for doc in self.rollups.find({'patient_id': patient_id, 'kind': kind, 'granularity': 'hour'}, {'start': 1, 'count': 1}):
+            counts[doc['start'].hour] += doc['count']
+        return counts
+
+    def latest(self, patient_id, kind, limit=5, projection=None, where=None):
+        """The most recent raw events of a kind (optionally filtered by `where`), newest first; limit=0 for all."""
+        fields = {'_id': 0, 'value': 1, 'timestamp': 1, **(projection or {})}
+        query = {**(where or {}), 'patient_id': patient_id, 'kind': kind}
+        return list(self.events.find(query, fields).sort('timestamp', DESCENDING).limit(limit))
+
+    def backfill(self, batch_size=500, log=print):
+        """
+        Migration: load existing SUD values (stories.sud, sud_feedback) and usage_logs into the store.
+        Run once on an empty store; re-running would count the same events twice.
+        """
+        sources = [
+            (self.db.stories, {'sud': {'$ne': None}, 'timestamp': {'$type': 'date'}},
+             lambda d: {'patient_id': d['patient_id'], 'kind': 'sud', 'value': d['sud'], 'source': 'scenario', 'stage': d.get('stage'), 'timestamp': d['timestamp']}),
+            (self.db.sud_feedback, {'timestamp': {'$type': 'date'}},
+             lambda d: {'patient_id': d['patient_id'], 'kind': 'sud', 'value': d['sud_value'], 'source': 'exposure_plan', 'part_index': d.get('part_index'), 'timestamp': d['timestamp']}),
+            (self.db.usage_logs, {'timestamp': {'$type': 'date'}},
+             lambda d: {'patient_id': d['patient_id'], 'kind': 'usage', 'value': d.get('duration', 0), 'timestamp': d['timestamp'],
+                        **({'session_index': d['session_index']} if 'session_index' in d else {})}),
+        ]
+        total = 0
+        for collection, query, to_event in sources:
+            query = {**query, 'patient_id': {'$exists': True}}
+            batch = []
+            for doc in collection.find(query).batch_size(batch_size):
+                batch.append(to_event(doc))
+                if len(batch) >= batch_size:
+                    total += self.record(batch)
+                    batch = []
+            if batch:
+                total += self.record(batch)
+            log(f"{collection.name}: {total} events loaded so far")
+        return total
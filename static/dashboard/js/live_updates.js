@@ -0,0 +1,17 @@
+// Push updates for dashboards: calls onChange (debounced) when the server publishes one of the
+// given event types on /api/events/stream. Falls back to polling every fallbackMs when
+// EventSource is unavailable.
+function onDashboardEvents(types, onChange, fallbackMs) {
+    let timer = null;
+    const trigger = (event) => {
+        clearTimeout(timer);
+        timer = setTimeout(() => onChange(event), 500);
+    };
+    if (!window.EventSource) {
+        setInterval(() => onChange(null), fallbackMs || 30000);
+        return null;
+    }
+    const source = new EventSource('/api/events/stream?types=' + encodeURIComponent(types.join(',')));
+    types.forEach(type => source.addEventListener(type, e => trigger(JSON.parse(e.data))));
+    return source;
+}
@@ -0,0 +1,33 @@
+import os
+import sys
+import pytest
+import mongomock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+
+@pytest.fixture
+def db():
+    return mongomock.MongoClient()['ptsd_test']
+
+
+@pytest.fixture
+def app_env(monkeypatch, tmp_path):
+    """app.py on a fresh mongomock database: (app module, flask app, db); audio and debug files go to tmp_path."""
+    import pymongo
+    import flask_pymongo
+    client = mongomock.MongoClient()
+    monkeypatch.setattr(pymongo, 'MongoClient', lambda *args, **kwargs: client)
+    monkeypatch.setattr(flask_pymongo, 'MongoClient', lambda *args, **kwargs: client)
+    monkeypatch.setenv('OPENAI_API_KEY', 'test')
+    monkeypatch.chdir(ROOT)  # prompts and rules are read relative to the repository root
+    import app as appmod
+    from agents import PTSDAgents
+    monkeypatch.setattr(appmod, 'AUDIO_DIR', str(tmp_path / 'audio'))
+    monkeypatch.setattr(PTSDAgents, 'OUTPUT_DIR', str(tmp_path / 'generated_stories'))
+    db = client['ptsd_stories']
+    db.create_collection('patient_events')  # mongomock has no time-series collections
+    flask_app = appmod.create_app({'MONGO_URI': 'mongodb://localhost:27017/ptsd_stories'}, warm=False)
+    flask_app.testing = True
+    return appmod, flask_app, db
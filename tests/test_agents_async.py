@@ -0,0 +1,28 @@
+import asyncio
+import threading
+from agents import PTSDAgents
+
+
+def test_async_agents_write_debug_files_off_the_event_loop(monkeypatch, tmp_path):
+    async def completion(messages, **kwargs):
+        return {'content': '{"expectedSUD": 40, "explanation": "ok"}', 'provider': 'openai'}
+    monkeypatch.setattr(PTSDAgents.client, 'achat_completion', completion)
+    monkeypatch.setattr(PTSDAgents, 'OUTPUT_DIR', str(tmp_path))
+    monkeypatch.setattr(PTSDAgents, 'load_prompt', lambda name: 'prompt')
+    writers = []
+    real_open = open
+
+    def recording_open(path, *args, **kwargs):
+        if str(path).startswith(str(tmp_path)):
+            writers.append(threading.get_ident())
+        return real_open(path, *args, **kwargs)
+    monkeypatch.setattr('builtins.open', recording_open)
+
+    async def run():
+        loop_thread = threading.get_ident()
+        assert await PTSDAgents.ImpactEvalAgent().aevaluate_sud('plan', 'data') == (40, 'ok')
+        await PTSDAgents.PlanGenAgent().agenerate_plan(1, 'data')
+        await PTSDAgents.StoryGenAgent().agenerate_story(1, 'plan')
+        return loop_thread
+    loop_thread = asyncio.run(run())
+    assert len(writers) == 3 and loop_thread not in writers
@@ -0,0 +1,149 @@
+import time
+import atexit
+from pymongo.errors import AutoReconnect, BulkWriteError
+from services import audit_service
+from services.audit_service import AuditService
+
+
+class FlakyCollection:
+    """Stores the batch, then fails like a connection lost before the reply (the first `failures` times)."""
+    def __init__(self, collection, failures=1):
+        self.collection = collection
+        self.failures = failures
+
+    def insert_many(self, docs, ordered=True):
+        result = self.collection.insert_many(docs, ordered=ordered)
+        if self.failures:
+            self.failures -= 1
+            raise AutoReconnect('connection reset')
+        return result
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+def _service(collection, delivery='buffered', **options):
+    service = AuditService(collection, delivery=delivery, **options)
+    service._ensure_writer = lambda: None  # flushed by the test, not the writer thread
+    audit_service._open_services.discard(service)
+    return service
+
+
+def test_flush_drains_a_batch_stored_by_a_failed_attempt(db):
+    service = _service(FlakyCollection(db.audit))
+    for i in range(3):
+        service.log_action({'action': 'view', 'patient_id': f'p{i}'})
+    assert service.flush() == 0
+    assert len(service._buffer) == 3
+    # The retry hits duplicate keys for everything already stored: delivered, not re-queued
+    assert service.flush() == 3
+    assert len(service._buffer) == 0
+    assert db.audit.count_documents({}) == 3
+
+
+class RejectingCollection:
+    """Stores every entry except those for `patient_id`, which fail validation (code 121)."""
+    def __init__(self, collection, patient_id):
+        self.collection = collection
+        self.patient_id = patient_id
+
+    def insert_many(self, docs, ordered=True):
+        errors = [{'index': i, 'code': 121, 'errmsg': 'Document failed validation'}
+                  for i, d in enumerate(docs) if d['patient_id'] == self.patient_id]
+        stored = [d for d in docs if d['patient_id'] != self.patient_id]
+        if stored:
+            self.collection.insert_many(stored)
+        if errors:
+            raise BulkWriteError({'writeErrors': errors, 'nInserted': len(docs) - len(errors)})
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+def test_flush_requeues_only_entries_that_failed(db):
+    service = _service(RejectingCollection(db.audit, 'p2'))
+    for i in range(1, 4):
+        service.log_action({'action': 'view', 'patient_id': f'p{i}'})
+    assert service.flush() == 2
+    assert [d['patient_id'] for d in service._buffer] == ['p2']
+    assert sorted(d['patient_id'] for d in db.audit.find()) == ['p1', 'p3']
+
+
+def test_best_effort_drops_failed_entries(db):
+    service = _service(RejectingCollection(db.audit, 'p2'), delivery='best_effort')
+    for i in range(1, 4):
+        service.log_action({'action': 'view', 'patient_id': f'p{i}'})
+    assert service.flush() == 2
+    assert not service._buffer and service.dropped == 1
+
+
+class DownCollection:
+    """Every write fails (Mongo unreachable); `hang` makes each attempt block that long first."""
+    def __init__(self, hang=0.0):
+        self.hang = hang
+        self.attempts = 0
+
+    def insert_many(self, docs, ordered=True):
+        self.attempts += 1
+        time.sleep(self.hang)
+        raise AutoReconnect('no servers available')
+
+
+def test_failed_batches_do_not_grow_the_buffer_past_its_cap():
+    service = _service(DownCollection(), max_buffer=5, flush_size=3)
+    service._indexes_ready = True
+    for i in range(5):
+        service.log_action({'action': 'view', 'patient_id': f'p{i}'})
+    original = service._write
+
+    def write(batch):
+        # More entries arrive while the batch is out, then it fails
+        for i in range(5, 8):
+            service.log_action({'action': 'view', 'patient_id': f'p{i}'})
+        return original(batch)
+    service._write = write
+    service.flush()
+    assert len(service._buffer) == 5
+    assert service.dropped == 3
+    # The oldest entries went first
+    assert [d['patient_id'] for d in service._buffer] == ['p3', 'p4', 'p5', 'p6', 'p7']
+
+
+def test_full_buffer_blocks_callers_only_up_to_max_block():
+    service = _service(DownCollection(), max_buffer=2, max_block=0.1)
+    for i in range(3):
+        service.log_action({'action': 'view', 'patient_id': f'p{i}'})
+    assert [d['patient_id'] for d in service._buffer] == ['p1', 'p2']
+    assert service.dropped == 1
+
+
+def test_drain_is_bounded_while_the_database_hangs():
+    collection = DownCollection(hang=2.0)
+    service = AuditService(collection, flush_interval=0.05)
+    audit_service._open_services.discard(service)
+    service._indexes_ready = True
+    service.log_action({'action': 'view', 'patient_id': 'p1'})
+    started = time.monotonic()
+    assert service.drain(timeout=0.2) is False
+    assert time.monotonic() - started < 1.0
+    with service._cond:
+        service._stopped = True  # let the writer thread end after its current attempt
+
+
+def test_one_exit_hook_per_process(db, monkeypatch):
+    registered = []
+    monkeypatch.setattr(atexit, 'register', registered.append)
+    monkeypatch.setattr(audit_service, '_exit_hook_registered', False)
+    services = [AuditService(db.audit) for _ in range(3)]
+    assert registered == [audit_service._close_all]
+    assert all(s in audit_service._open_services for s in services)
+    for service in services:
+        audit_service._open_services.discard(service)
+
+
+def test_drain_makes_pending_entries_readable(db):
+    service = AuditService(db.audit, flush_interval=5)
+    audit_service._open_services.discard(service)
+    log_id = service.log_action({'action': 'view', 'patient_id': 'p1'})
+    assert service.review_audit_entry(log_id)['patient_id'] == 'p1'
+    service.close()
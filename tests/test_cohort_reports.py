@@ -0,0 +1,51 @@
+import time
+import datetime
+from services.cohort_reports import CohortReportJob
+from services.timeseries_store import TimeSeriesStore, bucket_start
+
+
+def _job(db):
+    return CohortReportJob(db, partitions=2, lag=datetime.timedelta(0))
+
+
+def _run(job):
+    time.sleep(0.002)  # stored datetimes have millisecond resolution: keep writes and the run's cutoff apart
+    return job.run(log=lambda *_: None)
+
+
+def _report(db, week):
+    return db.reports.find_one({'week': week})
+
+
+def test_late_written_readings_for_an_old_week_are_picked_up(db):
+    db.create_collection('patient_events')  # mongomock has no time-series collections
+    store = TimeSeriesStore(db)
+    old = datetime.datetime.utcnow() - datetime.timedelta(days=21)
+    week = bucket_start(old, 'week')
+    store.record_sud('p1', 60, 'scenario', timestamp=old)
+    job = _job(db)
+    assert _run(job) == [week]
+    assert _report(db, week)['sud']['readings'] == 1
+
+    # An offline upload (or a backfill) written now, about a session three weeks ago
+    store.record_sud('p1', 30, 'exposure_plan', timestamp=old + datetime.timedelta(hours=1))
+    assert _run(job) == [week]
+    report = _report(db, week)
+    assert report['sud']['readings'] == 2
+    assert report['sud']['trajectories'][0]['last'] == 30
+
+    # Nothing new: nothing rebuilt
+    assert _run(job) == []
+
+
+def test_late_compliance_checks_are_picked_up_by_insertion_time(db):
+    old = datetime.datetime.utcnow() - datetime.timedelta(days=14)
+    week = bucket_start(old, 'week')
+    story_id = str(db.stories.insert_one({'patient_id': 'p1', 'stage': 1, 'status': 'approved', 'timestamp': old, 'updated_at': old}).inserted_id)
+    job = _job(db)
+    assert _run(job) == [week]
+    assert _report(db, week)['compliance']['checks'] == 0
+
+    db.compliance.insert_one({'story_id': story_id, 'summary': 'Rule 3 failed.', 'timestamp': old})
+    assert _run(job) == [week]
+    assert _report(db, week)['compliance'] == {'checks': 1, 'failures': 1, 'failure_rate': 1.0}
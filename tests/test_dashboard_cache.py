@@ -0,0 +1,11 @@
+def test_write_on_another_worker_invalidates_the_cached_dashboard(app_env):
+    appmod, app, db = app_env
+    client = app.test_client()
+    assert client.get('/api/dashboard').get_json()['summary']['pending_stories'] == 0
+    db.stories.insert_one({'patient_id': 'p1', 'stage': 1, 'status': 'pending'})
+    # Cached in this process until something says otherwise
+    assert client.get('/api/dashboard').get_json()['summary']['pending_stories'] == 0
+    # Another worker's write path bumps the shared stamp; this worker's cache is never touched
+    with app.app_context():
+        appmod.version_stamps.bump('stories')
+    assert client.get('/api/dashboard').get_json()['summary']['pending_stories'] == 1
@@ -0,0 +1,86 @@
+import datetime
+from utils.event_bus import MongoEventBus
+
+
+def _insert(db, seq, event_type='story.created'):
+    """An event committed by another node: seq already taken from the counter."""
+    db.events.insert_one({'seq': seq, 'type': event_type, 'data': {}, 'timestamp': datetime.datetime.utcnow()})
+
+
+def _bus(db, lag=10.0):
+    bus = MongoEventBus(db.events, lag=lag)
+    bus._next_seq = 1
+    return bus
+
+
+def test_publish_numbers_events_from_a_shared_counter(db):
+    first, second = MongoEventBus(db.events), MongoEventBus(db.events)
+    assert [first.publish('a'), second.publish('b'), first.publish('c')] == ['1', '2', '3']
+
+
+def test_event_committed_late_is_still_delivered(db):
+    bus = _bus(db)
+    _insert(db, 2)  # seq 1 was taken first but commits after seq 2
+    assert [e['id'] for e in bus._read_new(now=0)] == ['2']
+    _insert(db, 1)
+    _insert(db, 3)
+    assert [e['id'] for e in bus._read_new(now=1)] == ['1', '3']
+    assert bus._read_new(now=2) == []
+    assert bus._next_seq == 4
+
+
+def test_missing_seq_is_skipped_after_the_lag(db):
+    bus = _bus(db, lag=10)
+    _insert(db, 2)
+    assert [e['id'] for e in bus._read_new(now=0)] == ['2']
+    assert bus._read_new(now=5) == [] and bus._next_seq == 1
+    assert bus._read_new(now=10) == [] and bus._next_seq == 3
+    _insert(db, 3)
+    assert [e['id'] for e in bus._read_new(now=11)] == ['3']
+
+
+def test_subscribe_replays_events_after_last_event_id(db):
+    bus = MongoEventBus(db.events, poll_interval=60)
+    for event_type in ('a', 'b', 'c'):
+        bus.publish(event_type)
+    sub = bus.subscribe(last_event_id='1')
+    assert [sub.get(timeout=0)['type'], sub.get(timeout=0)['type']] == ['b', 'c']
+    assert sub.get(timeout=0) is None
+    sub.close()
+
+
+def _ids(sub):
+    ids = []
+    while True:
+        event = sub.get(timeout=0)
+        if event is None:
+            return ids
+        ids.append(event['id'])
+
+
+def test_reconnect_while_polling_gets_every_event_once(db):
+    bus = MongoEventBus(db.events, poll_interval=60)  # polled by the test
+    first = bus.subscribe()
+    bus.publish('a')
+    bus.publish('b')
+    bus._poll_once()
+    bus.publish('c')  # written after the last poll: not fanned out yet
+    second = bus.subscribe(last_event_id='0')
+    assert _ids(second) == ['1', '2']
+    bus._poll_once()
+    assert _ids(first) == ['1', '2', '3']
+    assert _ids(second) == ['3']
+    first.close()
+    second.close()
+
+
+def test_first_subscriber_starts_the_poller_after_its_replay(db):
+    bus = MongoEventBus(db.events, poll_interval=60)
+    for event_type in ('a', 'b', 'c'):
+        bus.publish(event_type)
+    sub = bus.subscribe(last_event_id='1')
+    assert _ids(sub) == ['2', '3']
+    bus.publish('d')  # between the replay and the first poll
+    bus._poll_once()
+    assert _ids(sub) == ['4']
+    sub.close()
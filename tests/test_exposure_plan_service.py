@@ -0,0 +1,60 @@
+import datetime
+import pytest
+from services.exposure_plan_service import ExposurePlanService
+from services.exposure_plan_store import InMemoryPlanStore, MongoPlanStore
+
+UTC_PLUS_3 = datetime.timezone(datetime.timedelta(hours=3))
+
+
+@pytest.fixture(params=['memory', 'mongo'])
+def service(request, db, monkeypatch):
+    monkeypatch.setattr('services.exposure_plan_service.load_rules_from_markdown', lambda path: {})
+    return ExposurePlanService(InMemoryPlanStore() if request.param == 'memory' else MongoPlanStore(db))
+
+
+def test_feedback_range_accepts_bounds_with_an_offset(service):
+    plan_id = service.create_plan('p1', {'plan_details': 'x'}, {})
+    service.submit_feedback_bulk([
+        {'plan_id': plan_id, 'patient_id': 'p1', 'part_index': 1, 'sud_value': 50, 'timestamp': '2024-05-01T08:00:00'},
+        {'plan_id': plan_id, 'patient_id': 'p1', 'part_index': 2, 'sud_value': 40, 'timestamp': '2024-05-01T10:00:00'},
+    ])
+    # 09:00+03:00 is 06:00 UTC, 12:00+03:00 is 09:00 UTC: only the 08:00 reading is inside
+    start = datetime.datetime(2024, 5, 1, 9, tzinfo=UTC_PLUS_3)
+    end = datetime.datetime(2024, 5, 1, 12, tzinfo=UTC_PLUS_3)
+    assert [f.sud_value for f in service.get_feedback_for_patient('p1', start, end)] == [50]
+    assert [f.sud_value for f in service.get_feedback_for_plan(plan_id, start, end)] == [50]
+
+
+def test_invalid_feedback_timestamps_raise_value_error(service):
+    plan_id = service.create_plan('p1', {'plan_details': 'x'}, {})
+    for timestamp in (12345, ['2024-05-01'], 'yesterday'):
+        with pytest.raises(ValueError):
+            service.submit_feedback_bulk([{'plan_id': plan_id, 'patient_id': 'p1', 'part_index': 1, 'sud_value': 50, 'timestamp': timestamp}])
+
+
+def test_bulk_route_answers_400_for_a_numeric_timestamp(app_env):
+    appmod, app, db = app_env
+    with app.app_context():
+        plan_id = appmod.exposure_plan_service.create_plan('p1', {'plan_details': 'x'}, {})
+    response = app.test_client().post('/api/submit-sud-feedback', json={'feedback': [
+        {'plan_id': plan_id, 'patient_id': 'p1', 'part_index': 1, 'sud_value': 50, 'timestamp': 1714550400},
+    ]})
+    assert response.status_code == 400
+
+
+@pytest.mark.parametrize('bulk', [False, True])
+def test_single_and_bulk_submit_accept_and_reject_the_same_plans(app_env, bulk):
+    appmod, app, db = app_env
+    with app.app_context():
+        plan_id = appmod.exposure_plan_service.create_plan('p1', {'plan_details': 'x'}, {})
+    client = app.test_client()
+
+    def submit(**fields):
+        item = {'plan_id': plan_id, 'patient_id': 'p1', 'part_index': 1, 'sud_value': 50, **fields}
+        return client.post('/api/submit-sud-feedback', json={'feedback': [item]} if bulk else item).status_code
+
+    assert submit() == 200
+    assert submit(plan_id='no-such-plan') == 400
+    assert submit(patient_id='p2') == 400
+    assert submit(sud_value='high') == 400
+    assert db.sud_feedback.count_documents({}) == 1
@@ -0,0 +1,105 @@
+import asyncio
+import time
+import threading
+import pytest
+from agents.llm_governor import LLMOverloaded, ProviderGovernor, _Waiter
+from agents.PTSDAgents import UnifiedLLMClient
+
+MESSAGES = [{'role': 'user', 'content': 'hi'}]
+RESULT = {'content': 'ok', 'provider': 'x', 'raw_response': {}}
+
+
+def _client(monkeypatch, openai, ollama, **governor):
+    client = UnifiedLLMClient()
+    client.governors = {name: ProviderGovernor(name, **{'max_in_flight': 1, 'timeout': 0.2, **governor}) for name in ('openai', 'ollama')}
+    monkeypatch.setattr(client, '_openai_completion', lambda *args, **kwargs: openai())
+    monkeypatch.setattr(client, '_ollama_completion', lambda *args, **kwargs: ollama())
+    return client
+
+
+def _fail(error):
+    def call():
+        raise error
+    return call
+
+
+def test_overloaded_provider_does_not_fall_back(monkeypatch):
+    ollama_calls = []
+    client = _client(monkeypatch, lambda: RESULT, lambda: ollama_calls.append(1) or RESULT)
+    held = client.governors['openai'].acquire(1)
+    started = time.monotonic()
+    with pytest.raises(LLMOverloaded) as raised:
+        client.chat_completion(MESSAGES)
+    assert raised.value.provider == 'openai'
+    assert time.monotonic() - started < 0.5  # one timeout, not one per provider
+    assert not ollama_calls
+    client.governors['openai'].release(held)
+
+
+def test_real_error_falls_back(monkeypatch):
+    client = _client(monkeypatch, _fail(RuntimeError('401 Unauthorized')), lambda: RESULT)
+    assert client.chat_completion(MESSAGES) is RESULT
+
+
+def test_real_error_then_overload_is_not_a_503(monkeypatch):
+    client = _client(monkeypatch, _fail(RuntimeError('401 Unauthorized')), lambda: RESULT)
+    held = client.governors['ollama'].acquire(1)
+    with pytest.raises(RuntimeError) as raised:
+        client.chat_completion(MESSAGES)
+    assert not isinstance(raised.value, LLMOverloaded)
+    assert '401' in str(raised.value)
+    client.governors['ollama'].release(held)
+
+
+def test_interactive_callers_are_admitted_before_batch():
+    governor = ProviderGovernor('openai', max_in_flight=1, timeout=5, aging=0)
+    held = governor.acquire(1, 'interactive')
+    order = []
+
+    def call(priority):
+        permit = governor.acquire(1, priority)
+        order.append(priority)
+        governor.release(permit)
+    threads = [threading.Thread(target=call, args=(p,)) for p in ('batch', 'normal', 'interactive')]
+    for t in threads:
+        t.start()
+        time.sleep(0.05)
+    governor.release(held)
+    for t in threads:
+        t.join()
+    assert order == ['interactive', 'normal', 'batch']
+
+
+def test_reserved_slots_are_only_for_interactive_calls():
+    governor = ProviderGovernor('openai', max_in_flight=4, reserved_interactive=1, timeout=0.1)
+    permits = [governor.acquire(1, 'normal') for _ in range(3)]
+    with pytest.raises(LLMOverloaded):
+        governor.acquire(1, 'batch')
+    permits.append(governor.acquire(1, 'interactive'))
+    for permit in permits:
+        governor.release(permit)
+
+
+def test_aging_moves_a_waiting_caller_up_one_class_per_interval():
+    batch, normal = _Waiter('batch', 0), _Waiter('normal', 1)
+    now = batch.enqueued
+    assert batch.key(now, 15) > normal.key(now, 15)
+    # After 15s more than the normal caller, the batch caller goes first
+    assert batch.key(now + 30, 15) < normal.key(now + 14, 15)
+
+
+def test_cancelled_waiter_leaves_the_queue():
+    governor = ProviderGovernor('openai', max_in_flight=1, timeout=2)
+    held = governor.acquire(1)
+
+    async def scenario():
+        waiting = asyncio.ensure_future(governor.aacquire(1))
+        await asyncio.sleep(0.1)
+        waiting.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await waiting
+        assert governor.stats()['waiting'] == 0
+        governor.release(held)
+        permit = await asyncio.wait_for(governor.aacquire(1), 0.5)
+        governor.release(permit)
+    asyncio.run(scenario())
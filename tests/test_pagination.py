@@ -0,0 +1,49 @@
+import pytest
+from utils.pagination import parse_fields, parse_order, paginate
+
+
+@pytest.mark.parametrize('fields', ['a,a.b', 'a.b,a', 'name,name', 'triggers.name, triggers'])
+def test_overlapping_fields_are_rejected(fields):
+    with pytest.raises(ValueError):
+        parse_fields(fields)
+
+
+def test_sibling_paths_with_a_common_prefix_are_allowed():
+    assert parse_fields('name,name_key,triggers.name,triggers.sud') == {
+        'name': 1, 'name_key': 1, 'triggers.name': 1, 'triggers.sud': 1}
+
+
+def test_sub_path_of_a_sort_key_is_folded_into_it(db):
+    db.audit.insert_many([{'timestamp': {'day': i, 'hour': 0}, 'action': 'x'} for i in range(3)])
+    docs, next_cursor = paginate(db.audit, projection={'timestamp.day': 1}, limit=2, sort=[('timestamp', 1)])
+    assert [d['timestamp']['day'] for d in docs] == [0, 1]
+    assert next_cursor
+
+
+def test_cursor_walks_every_document_once(db):
+    db.patients.insert_many([{'patient_id': f'p{i}', 'age': i % 3} for i in range(7)])
+    seen, cursor = [], None
+    while True:
+        docs, cursor = paginate(db.patients, projection={'patient_id': 1}, cursor=cursor, limit=3, sort=[('age', 1)])
+        seen += [d['patient_id'] for d in docs]
+        if not cursor:
+            break
+    assert sorted(seen) == [f'p{i}' for i in range(7)]
+
+
+def test_api_patients_rejects_overlapping_fields_with_400(app_env):
+    appmod, app, db = app_env
+    db.patients.insert_one({'patient_id': 'p1', 'name': 'A', 'triggers': [{'name': 't'}]})
+    client = app.test_client()
+    resp = client.get('/api/patients?fields=triggers,triggers.name')
+    assert resp.status_code == 400
+    resp = client.get('/api/patients?fields=patient_id,triggers.name')
+    assert resp.status_code == 200
+    assert resp.get_json()['patients'] == [{'patient_id': 'p1', 'triggers': [{'name': 't'}]}]
+
+
+def test_parse_order():
+    assert parse_order(None) == parse_order('asc') == 1
+    assert parse_order('desc') == -1
+    with pytest.raises(ValueError):
+        parse_order('newest')
@@ -0,0 +1,75 @@
+import time
+import threading
+from services.patient_lookup_service import PatientLookupService, normalize_name
+
+
+class CountingCollection:
+    """Counts full scans; a scan can be held open with `gate` to simulate a slow reload."""
+    def __init__(self, collection):
+        self.collection = collection
+        self.scans = 0
+        self.gate = None
+
+    def find(self, query, projection=None):
+        self.scans += 1
+        docs = list(self.collection.find(query, projection))
+        if self.gate:
+            self.gate.wait(5)
+        return docs
+
+    def __getattr__(self, name):
+        return getattr(self.collection, name)
+
+
+def _service(db, names, refresh_interval=300):
+    for i, name in enumerate(names):
+        db.patients.insert_one({'patient_id': f'p{i}', 'name': name, 'name_key': normalize_name(name)})
+    collection = CountingCollection(db.patients)
+    return PatientLookupService(collection, refresh_interval=refresh_interval), collection
+
+
+def test_first_load_is_built_once_for_concurrent_requests(db):
+    service, collection = _service(db, ['דנה כהן', 'דני לוי'])
+    collection.gate = threading.Event()
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(service.search('דנ'))) for _ in range(5)]
+    for t in threads:
+        t.start()
+    time.sleep(0.1)
+    collection.gate.set()
+    for t in threads:
+        t.join()
+    assert collection.scans == 1
+    assert all(sorted(r) == ['p0', 'p1'] for r in results)
+
+
+def test_stale_index_is_refreshed_in_the_background(db):
+    service, collection = _service(db, ['דנה כהן'], refresh_interval=0)
+    service.reload()
+    db.patients.insert_one({'patient_id': 'p9', 'name': 'דנה אבן', 'name_key': normalize_name('דנה אבן')})
+    collection.gate = threading.Event()
+    started = time.monotonic()
+    # Served from the current index while one reload runs; further requests do not start another
+    assert service.search('דנה') == ['p0']
+    assert service.search('דנה') == ['p0']
+    assert time.monotonic() - started < 1
+    collection.gate.set()
+    for _ in range(100):
+        if service._loaded_at and not service._reload_lock.locked():
+            break
+        time.sleep(0.01)
+    assert collection.scans == 2
+    assert sorted(service.search('דנה', limit=5)) == ['p0', 'p9']
+
+
+def test_updates_made_during_a_reload_are_kept(db):
+    service, collection = _service(db, ['דנה כהן'])
+    service.reload()
+    collection.gate = threading.Event()
+    reload = threading.Thread(target=service.reload)
+    reload.start()
+    time.sleep(0.05)  # the rebuild has read the old name
+    service.update_patient('p0', 'רותם כהן')
+    collection.gate.set()
+    reload.join()
+    assert service.search('רותם') == ['p0'] and service.search('דנה') == []
@@ -0,0 +1,8 @@
+def test_patients_overview_is_not_answered_from_write_stamps(app_env):
+    appmod, app, db = app_env
+    db.patients.insert_one({'patient_id': 'p1', 'name': 'A'})
+    client = app.test_client()
+    first = client.get('/api/therapist/patients_overview')
+    assert first.status_code == 200 and 'ETag' not in first.headers
+    again = client.get('/api/therapist/patients_overview', headers={'If-None-Match': 'W/"anything"'})
+    assert again.status_code == 200
@@ -0,0 +1,78 @@
+import datetime
+import pytest
+from services.exposure import ExposureProgressionService, ChapterInProgressError, CHAPTER_CLAIM_TIMEOUT
+from services.progress_store import InMemoryProgressStore, MongoProgressStore
+
+
+@pytest.fixture(params=['memory', 'mongo'])
+def service(request, db, monkeypatch):
+    monkeypatch.setenv('OPENAI_API_KEY', 'test')
+    store = InMemoryProgressStore() if request.param == 'memory' else MongoProgressStore(db.exposure_progress)
+    return ExposureProgressionService(store=store)
+
+
+def test_concurrent_requests_cannot_claim_the_same_chapter(service):
+    service.start_scenario('p1', 60)
+    assert service.claim_next_chapter('p1', 55) == 2
+    with pytest.raises(ChapterInProgressError):
+        service.claim_next_chapter('p1', 55)
+    assert service.complete_chapter('p1', 2)
+    assert service.get_scenario('p1')['stage'] == 2
+    assert service.get_scenario('p1')['sud_history'] == [60, 55]
+    assert service.claim_next_chapter('p1', 40) == 3
+
+
+def test_failed_generation_releases_the_chapter(service):
+    service.start_scenario('p1', 60)
+    assert service.claim_next_chapter('p1', 55) == 2
+    assert service.release_chapter('p1', 2)
+    assert service.claim_next_chapter('p1', 50) == 2
+    assert service.get_scenario('p1')['stage'] == 1
+
+
+def test_abandoned_claim_expires_and_the_old_request_cannot_complete(service):
+    service.start_scenario('p1', 60)
+    assert service.claim_next_chapter('p1', 55) == 2
+    later = datetime.datetime.utcnow() + CHAPTER_CLAIM_TIMEOUT + datetime.timedelta(seconds=1)
+    assert service.claim_next_chapter('p1', 50, now=later) == 2
+    assert service.complete_chapter('p1', 2)
+    assert not service.complete_chapter('p1', 2)
+    assert service.get_scenario('p1')['sud_history'] == [60, 50]
+
+
+def test_finished_scenario_and_missing_scenario(service):
+    assert service.claim_next_chapter('p1', 50) is None
+    service.start_scenario('p1', 60)
+    for stage in (2, 3):
+        service.claim_next_chapter('p1', 50)
+        service.complete_chapter('p1', stage)
+    assert service.claim_next_chapter('p1', 30) == 4
+    assert service.get_scenario('p1') == {'stage': 4, 'sud_history': [60, 50, 50, 30], 'claim': None}
+
+
+def test_next_scenario_route_uses_the_progress_store(app_env, monkeypatch):
+    appmod, app, db = app_env
+    db.patients.insert_one({'patient_id': 'p1', 'name': 'A'})
+    story_service = appmod.exposure_service.story_service
+    monkeypatch.setattr(story_service, 'generate_story', lambda **kwargs: {'story': f"chapter {kwargs['exposure_stage']}"})
+    client = app.test_client()
+    with client.session_transaction() as sess:
+        sess['patient_id'] = 'p1'
+    assert client.post('/api/start-scenario', json={'initial_sud': 60}).status_code == 200
+
+    # Another request is generating chapter 2: this one must not generate it again
+    appmod.exposure_service.claim_next_chapter('p1', 55)
+    response = client.post('/api/next-scenario', json={'current_sud': 55})
+    assert response.status_code == 409
+    appmod.exposure_service.release_chapter('p1', 2)
+
+    def fail(**kwargs):
+        raise RuntimeError('provider down')
+    monkeypatch.setattr(story_service, 'generate_story', fail)
+    with pytest.raises(RuntimeError):
+        client.post('/api/next-scenario', json={'current_sud': 55})
+    monkeypatch.setattr(story_service, 'generate_story', lambda **kwargs: {'story': f"chapter {kwargs['exposure_stage']}"})
+    response = client.post('/api/next-scenario', json={'current_sud': 55})
+    assert response.get_json()['stage'] == 2
+    assert sorted(d['stage'] for d in db.stories.find()) == [1, 2]
+    assert db.exposure_progress.find_one({'patient_id': 'p1'})['scenario']['stage'] == 2
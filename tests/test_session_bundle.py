@@ -0,0 +1,78 @@
+import io
+import json
+import zipfile
+import datetime
+from services.audio_store import LocalAudioStore
+from services.session_bundle import SessionBundleService, split_text
+from services.story_store import StoryStore
+
+FRAME = bytes([0xFF, 0xF3, 0x44, 0xC4]) + bytes(92)
+
+
+def _service(db, tmp_path):
+    return SessionBundleService(db, StoryStore(db), LocalAudioStore(str(tmp_path)))
+
+
+def _story(db, service, audio=None):
+    result = {'story': '\n'.join(f'פסקה {i} ' + 'מילה ' * 200 for i in range(6)), 'audio_file': None}
+    if audio:
+        service.audio_store.save('story.mp3', audio)
+        result['audio_file'] = 'story.mp3'
+    story_id = service.story_store.insert({'patient_id': 'p1', 'stage': 2, 'status': 'approved', 'result': result})
+    return service.find_story(str(story_id))
+
+
+def _manifest(data):
+    with zipfile.ZipFile(io.BytesIO(data)) as bundle:
+        return json.loads(bundle.read('manifest.json'))
+
+
+def test_bundle_is_deterministic_and_audio_is_split_at_frames(db, tmp_path):
+    service = _service(db, tmp_path)
+    story = _story(db, service, audio=FRAME * 300)
+    first, second = service.build(story), service.build(story)
+    assert first == second
+    manifest = _manifest(first)
+    assert len(manifest['segments']) == len(split_text(story['result']['story'])) > 1
+    assert sum(s['audio_size'] for s in manifest['segments']) == len(FRAME) * 300
+    assert all(s['audio_size'] % len(FRAME) == 0 for s in manifest['segments'])
+
+
+def test_sud_upload_is_filed_under_the_patients_plan(db, tmp_path):
+    service = _service(db, tmp_path)
+    story = _story(db, service)
+    db.exposure_plans.insert_one({'plan_id': 'old', 'patient_id': 'p1', 'updated_at': datetime.datetime(2024, 1, 1)})
+    db.exposure_plans.insert_one({'plan_id': 'current', 'patient_id': 'p1', 'updated_at': datetime.datetime(2024, 6, 1)})
+    db.exposure_plans.insert_one({'plan_id': 'other', 'patient_id': 'p2', 'updated_at': datetime.datetime(2025, 1, 1)})
+    record = service.get(story)
+    with service.audio_store.open(record['name']).fileobj as f:
+        manifest = _manifest(f.read())
+    assert manifest['sud_upload']['item'] == {'plan_id': 'current', 'patient_id': 'p1', 'part_index': 2}
+    assert len({p['id'] for p in manifest['sud_prompts']}) == len(manifest['sud_prompts'])
+
+
+def test_sud_upload_is_null_without_a_plan_and_rebuilt_once_there_is_one(db, tmp_path):
+    service = _service(db, tmp_path)
+    story = _story(db, service)
+    first = service.get(story)
+    assert _manifest(service.build(story, service.plan_id(story)))['sud_upload'] is None
+    db.exposure_plans.insert_one({'plan_id': 'plan-1', 'patient_id': 'p1', 'updated_at': datetime.datetime(2024, 6, 1)})
+    assert service.get(story)['sha256'] != first['sha256']
+
+
+def test_offline_answers_keep_their_prompt_and_need_a_real_plan(app_env):
+    appmod, app, db = app_env
+    with app.app_context():
+        plan_id = appmod.exposure_plan_service.create_plan('p1', {'plan_details': 'x'}, {})
+    client = app.test_client()
+    item = {'plan_id': plan_id, 'patient_id': 'p1', 'part_index': 2}
+    response = client.post('/api/submit-sud-feedback', json={'feedback': [
+        {**item, 'prompt_id': 'before', 'sud_value': 60}, {**item, 'prompt_id': 'after_1', 'sud_value': 40},
+    ]})
+    assert response.status_code == 200
+    assert sorted(d['prompt_id'] for d in db.sud_feedback.find()) == ['after_1', 'before']
+    response = client.post('/api/submit-sud-feedback', json={'feedback': [{**item, 'plan_id': 'story-id', 'sud_value': 50}]})
+    assert response.status_code == 400
+    response = client.post('/api/submit-sud-feedback', json={'feedback': [{**item, 'patient_id': 'p2', 'sud_value': 50}]})
+    assert response.status_code == 400
+    assert db.sud_feedback.count_documents({}) == 2
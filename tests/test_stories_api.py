@@ -0,0 +1,39 @@
+import datetime
+import pytest
+
+
+@pytest.fixture
+def stories_app(app_env, monkeypatch):
+    monkeypatch.setenv('STORY_STORAGE', 'compressed')
+    appmod, app, db = app_env
+    with app.app_context():
+        appmod.story_store.insert({
+            'patient_id': 'p1', 'stage': 1, 'status': 'pending', 'timestamp': datetime.datetime(2026, 1, 1),
+            'result': {'story': 'once upon a time', 'plan': 'the plan'},
+        })
+    return app, db
+
+
+@pytest.mark.parametrize('fields', ['result', 'result.story', 'status,result.story'])
+def test_result_fields_are_hydrated_without_overlapping_paths(stories_app, fields):
+    app, db = stories_app
+    assert db.story_content.count_documents({}) == 1  # stored compressed: the text comes from the content ref
+    response = app.test_client().get(f'/api/stories?fields={fields}')
+    assert response.status_code == 200
+    story = response.get_json()['stories'][0]
+    assert story['result']['story'] == 'once upon a time'
+    assert story['summary'] == 'once upon a time'
+
+
+
+def test_order_desc_pages_newest_first(app_env):
+    appmod, app, db = app_env
+    with app.app_context():
+        for stage in range(1, 6):
+            appmod.story_store.insert({'patient_id': 'p1', 'stage': stage, 'result': {'story': f'chapter {stage}'}})
+    client = app.test_client()
+    first = client.get('/api/stories?fields=stage&limit=2&order=desc').get_json()
+    assert [s['stage'] for s in first['stories']] == [5, 4]
+    second = client.get(f"/api/stories?fields=stage&limit=2&order=desc&cursor={first['next_cursor']}").get_json()
+    assert [s['stage'] for s in second['stories']] == [3, 2]
+    assert client.get('/api/stories?order=newest').status_code == 400
@@ -0,0 +1,69 @@
+import datetime
+from services.timeseries_store import TimeSeriesStore
+
+
+def test_aware_timestamps_are_stored_and_bucketed_as_utc(db):
+    db.create_collection('patient_events')
+    store = TimeSeriesStore(db)
+    aware = datetime.datetime(2024, 5, 1, 10, 30, tzinfo=datetime.timezone(datetime.timedelta(hours=3)))
+    store.record_usage('p1', 60, timestamp=aware)
+    store.record_usage('p1', 30, timestamp=datetime.datetime(2024, 5, 1, 7, 45))
+    assert {e['timestamp'] for e in db.patient_events.find()} == {datetime.datetime(2024, 5, 1, 7, 30), datetime.datetime(2024, 5, 1, 7, 45)}
+    hours = list(db.patient_event_rollups.find({'granularity': 'hour'}))
+    assert [(h['start'], h['count'], h['sum']) for h in hours] == [(datetime.datetime(2024, 5, 1, 7), 2, 90)]
+
+
+def test_usage_events_route_normalizes_client_offsets(app_env):
+    _, app, db = app_env
+    client = app.test_client()
+    response = client.post('/api/usage-events', json={'events': [
+        {'patient_id': 'p1', 'duration': 60, 'timestamp': '2024-05-01T10:30:00+03:00'},
+        {'patient_id': 'p1', 'duration': 60, 'timestamp': 12345},
+    ]})
+    assert response.status_code == 400
+    response = client.post('/api/usage-events', json={'patient_id': 'p1', 'duration': 60, 'timestamp': '2024-05-01T10:30:00+03:00'})
+    assert response.status_code == 200
+    assert db.patient_events.find_one()['timestamp'] == datetime.datetime(2024, 5, 1, 7, 30)
+
+
+def test_offline_sud_readings_keep_their_timestamp(app_env):
+    appmod, app, db = app_env
+    with app.app_context():
+        plan_id = appmod.exposure_plan_service.create_plan('p1', {'plan_details': 'x'}, {})
+    response = app.test_client().post('/api/submit-sud-feedback', json={'feedback': [
+        {'plan_id': plan_id, 'patient_id': 'p1', 'part_index': 1, 'sud_value': 55, 'timestamp': '2024-05-01T10:30:00+03:00'},
+    ]})
+    assert response.status_code == 200
+    event = db.patient_events.find_one({'kind': 'sud'})
+    assert event['timestamp'] == datetime.datetime(2024, 5, 1, 7, 30)
+
+
+def test_reconcile_rebuilds_rollups_that_drifted_from_the_events(db):
+    db.create_collection('patient_events')
+    store = TimeSeriesStore(db)
+    start = datetime.datetime.utcnow() - datetime.timedelta(minutes=5)
+    store.record_sud('p1', 40, 'scenario', timestamp=datetime.datetime(2024, 5, 1, 7, 10))
+    # A worker died after inserting an event but before its rollup update...
+    db.patient_events.insert_one({'patient_id': 'p1', 'kind': 'sud', 'value': 80, 'source': 'scenario',
+                                  'timestamp': datetime.datetime(2024, 5, 1, 9, 0), 'recorded_at': datetime.datetime.utcnow()})
+    # ...and a retried one counted a usage event twice in another week
+    store.record_usage('p1', 60, timestamp=datetime.datetime(2024, 5, 20, 8, 0))
+    db.patient_event_rollups.update_many({'kind': 'usage'}, {'$inc': {'count': 1, 'sum': 60}})
+    assert store.series('p1', 'sud', 'day')[0]['count'] == 1
+
+    assert store.reconcile(start, datetime.datetime.utcnow() + datetime.timedelta(seconds=1)) == 2
+    day = store.series('p1', 'sud', 'day')[0]
+    assert (day['count'], day['sum'], day['min'], day['max']) == (2, 120, 40, 80)
+    assert [(h['start'], h['count']) for h in store.series('p1', 'sud', 'hour')] == [('2024-05-01T07:00:00', 1), ('2024-05-01T09:00:00', 1)]
+    assert [(w['count'], w['sum']) for w in store.series('p1', 'usage', 'week')] == [(1, 60)]
+
+
+def test_reconcile_drops_rollups_without_events(db):
+    db.create_collection('patient_events')
+    store = TimeSeriesStore(db)
+    start = datetime.datetime.utcnow() - datetime.timedelta(minutes=5)
+    store.record_sud('p1', 40, 'scenario', timestamp=datetime.datetime(2024, 5, 1, 7, 10))
+    db.patient_event_rollups.insert_one({'patient_id': 'p1', 'kind': 'sud', 'granularity': 'hour',
+                                         'start': datetime.datetime(2024, 5, 2, 3), 'count': 1, 'sum': 70, 'min': 70, 'max': 70})
+    store.reconcile(start, datetime.datetime.utcnow() + datetime.timedelta(seconds=1))
+    assert [h['start'] for h in store.series('p1', 'sud', 'hour')] == ['2024-05-01T07:00:00']
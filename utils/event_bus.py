@@ -0,0 +1,233 @@
+import os
+import json
+import time
+import queue
+import threading
+import logging
+import itertools
+from collections import deque
+from datetime import datetime
+from pymongo import ASCENDING, ReturnDocument
+
+logger = logging.getLogger(__name__)
+
+
+class Subscription:
+    """
+    One listener's queue of events. If the listener falls behind by more than
+    `max_pending` events the oldest are dropped; dashboards re-fetch on the next event anyway.
+    """
+    def __init__(self, bus, types=None, max_pending=100):
+        self.bus = bus
+        self.types = set(types) if types else None
+        self._queue = queue.Queue(maxsize=max_pending)
+
+    def deliver(self, event):
+        if self.types and event['type'] not in self.types:
+            return
+        while True:
+            try:
+                self._queue.put_nowait(event)
+                return
+            except queue.Full:
+                try:
+                    self._queue.get_nowait()
+                except queue.Empty:
+                    pass
+
+    def get(self, timeout=None):
+        """Next event, or None if nothing arrived within timeout seconds."""
+        try:
+            return self._queue.get(timeout=timeout)
+        except queue.Empty:
+            return None
+
+    def close(self):
+        self.bus._unsubscribe(self)
+
+
+class InMemoryEventBus:
+    """
+    Single-process event bus: publish() hands the event straight to this process's subscribers.
+    The last `history` events are kept so reconnecting clients can catch up from their last id.
+    """
+    def __init__(self, history=200):
+        self._subscribers = set()
+        self._history = deque(maxlen=history)
+        self._ids = itertools.count(1)
+        self._lock = threading.Lock()
+
+    def publish(self, event_type, data=None):
+        with self._lock:
+            event = {'id': str(next(self._ids)), 'type': event_type, 'data': data or {}, 'timestamp': datetime.utcnow().isoformat()}
+            self._history.append(event)
+            subscribers = list(self._subscribers)
+        for sub in subscribers:
+            sub.deliver(event)
+        return event['id']
+
+    def subscribe(self, types=None, last_event_id=None):
+        sub = Subscription(self, types)
+        with self._lock:
+            if last_event_id and last_event_id.isdigit():
+                for event in self._history:
+                    if int(event['id']) > int(last_event_id):
+                        sub.deliver(event)
+            self._subscribers.add(sub)
+        return sub
+
+    def _unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+
+class MongoEventBus:
+    """
+    Event bus shared by all nodes through the `events` collection.
+    publish() inserts the event; one poller thread per process reads new events and fans them
+    out to local subscribers, so the database sees one query per poll interval per node
+    regardless of how many dashboards are connected. A TTL index prunes old events.
+
+    Events are ordered by `seq`, taken from a server-side counter ($inc in `counters`), not by
+    _id: ObjectIds are made by each client, so another node's later event can sort below one
+    already read. Two publishers may still commit out of seq order, so the poller delivers every
+    seq once and only moves past a missing one when it arrives, or after `lag` seconds (its
+    publisher failed between taking the seq and inserting the event).
+    """
+    def __init__(self, collection, poll_interval=1.0, retention=3600, lag=10.0):
+        self.collection = collection
+        self.counters = collection.database.counters
+        self.poll_interval = poll_interval
+        self.retention = retention
+        self.lag = lag
+        self._subscribers = set()
+        self._lock = threading.Lock()
+        self._poller = None
+        self._pid = None
+        self._next_seq = None  # lowest seq not delivered yet
+        self._seen = set()  # delivered seqs above a missing one
+        self._gap_since = None
+        self._indexes_ready = False
+
+    def ensure_indexes(self):
+        self.collection.create_index([('timestamp', ASCENDING)], expireAfterSeconds=self.retention)
+        self.collection.create_index('seq', unique=True, sparse=True)
+        self._indexes_ready = True
+
+    def publish(self, event_type, data=None):
+        if not self._indexes_ready:
+            self.ensure_indexes()
+        counter = self.counters.find_one_and_update(
+            {'_id': self.collection.name}, {'$inc': {'seq': 1}}, upsert=True, return_document=ReturnDocument.AFTER
+        )
+        doc = {'seq': counter['seq'], 'type': event_type, 'data': data or {}, 'timestamp': datetime.utcnow()}
+        self.collection.insert_one(doc)
+        return str(doc['seq'])
+
+    def subscribe(self, types=None, last_event_id=None):
+        sub = Subscription(self, types)
+        after = int(last_event_id) if last_event_id and last_event_id.isdigit() else None
+        # Under the lock the poller's position cannot move: every seq after `after` is either
+        # replayed here or left to the poller, never both and never neither
+        with self._lock:
+            started = self._ensure_poller(start_after=after)
+            if after is not None and started:
+                # A new poller starts at the client's position; its first read is the replay and
+                # leaves it right after the last replayed seq
+                for event in self._read_new():
+                    sub.deliver(event)
+            elif after is not None:
+                # Only what the running poller already fanned out; it delivers the rest to everyone
+                delivered = {'$or': [{'seq': {'$lt': self._next_seq}}, {'seq': {'$in': sorted(self._seen)}}]}
+                for doc in self.collection.find({'seq': {'$gt': after}, **delivered}).sort('seq', ASCENDING).limit(200):
+                    sub.deliver(self._to_event(doc))
+            self._subscribers.add(sub)
+        return sub
+
+    def _unsubscribe(self, sub):
+        with self._lock:
+            self._subscribers.discard(sub)
+
+    def _ensure_poller(self, start_after=None):
+        """Start the poller if this process has none, at start_after + 1 if given. Returns True if it was started."""
+        # Threads do not survive fork (e.g. gunicorn workers), so start one per process
+        if self._poller is not None and self._poller.is_alive() and self._pid == os.getpid():
+            return False
+        self._pid = os.getpid()
+        counter = self.counters.find_one({'_id': self.collection.name})
+        self._next_seq = (counter['seq'] if counter else 0) + 1
+        if start_after is not None:
+            self._next_seq = min(self._next_seq, start_after + 1)
+        self._seen = set()
+        self._gap_since = None
+        self._poller = threading.Thread(target=self._poll, name='event-bus-poller', daemon=True)
+        self._poller.start()
+        return True
+
+    def _poll(self):
+        while True:
+            time.sleep(self.poll_interval)
+            if not self._poll_once():
+                return
+
+    def _poll_once(self):
+        """Read new events and fan them out. Returns False (and stops the poller) when nobody is subscribed."""
+        with self._lock:
+            if not self._subscribers:
+                self._poller = None
+                return False
+            # Same lock as subscribe(): the subscribers read here are exactly those without a replay of these events
+            subscribers = list(self._subscribers)
+            try:
+                events = self._read_new()
+            except Exception:
+                logger.exception("Event bus poll failed")
+                return True
+        for event in events:
+            for sub in subscribers:
+                sub.deliver(event)
+        return True
+
+    def _read_new(self, now=None):
+        """Events not delivered yet, in seq order; advances the position past contiguous seqs."""
+        docs = list(self.collection.find({'seq': {'$gte': self._next_seq}}).sort('seq', ASCENDING).limit(500))
+        events = []
+        for doc in docs:
+            if doc['seq'] not in self._seen:
+                self._seen.add(doc['seq'])
+                events.append(self._to_event(doc))
+        while self._next_seq in self._seen:
+            self._seen.discard(self._next_seq)
+            self._next_seq += 1
+        if not self._seen:
+            self._gap_since = None
+            return events
+        # A seq below delivered ones is missing: it is still being inserted, or never will be
+        now = time.monotonic() if now is None else now
+        if self._gap_since is None:
+            self._gap_since = now
+        elif now - self._gap_since >= self.lag:
+            self._next_seq = min(self._seen)
+            while self._next_seq in self._seen:
+                self._seen.discard(self._next_seq)
+                self._next_seq += 1
+            self._gap_since = now if self._seen else None
+        return events
+
+    @staticmethod
+    def _to_event(doc):
+        return {'id': str(doc['seq']), 'type': doc['type'], 'data': doc.get('data', {}), 'timestamp': doc['timestamp'].isoformat()}
+
+
+def sse_stream(subscription, keepalive=15):
+    """Yield Server-Sent Events for a subscription, with a comment line as keep-alive while idle."""
+    try:
+        yield 'retry: 5000\n\n'
+        while True:
+            event = subscription.get(timeout=keepalive)
+            if event is None:
+                yield ': keep-alive\n\n'
+                continue
+            yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+    finally:
+        subscription.close()
@@ -0,0 +1,118 @@
+import gzip
+import hashlib
+import functools
+from datetime import datetime, timezone
+from flask import request, make_response
+
+try:
+    import brotli
+except ImportError:  # optional: gzip is always available
+    brotli = None
+
+COMPRESSIBLE_MIMETYPES = ('application/json', 'text/html', 'text/css', 'application/javascript')
+
+
+class VersionStamps:
+    """
+    One counter per data tag ('stories', 'patients', ...) in the `version_stamps` collection,
+    bumped by every write path. Reading the stamps is a single _id lookup, so a request can be
+    answered with 304 Not Modified before running its queries.
+    """
+    def __init__(self, collection):
+        self.collection = collection
+
+    def bump(self, *tags):
+        now = datetime.utcnow()
+        for tag in tags:
+            self.collection.update_one({'_id': tag}, {'$inc': {'version': 1}, '$set': {'updated_at': now}}, upsert=True)
+
+    def get(self, *tags):
+        """Return (token, last_modified) for the tags; the token changes whenever any tag is bumped."""
+        docs = {d['_id']: d for d in self.collection.find({'_id': {'$in': list(tags)}})}
+        token = '|'.join(f"{tag}:{docs[tag]['version'] if tag in docs else 0}" for tag in tags)
+        stamps = [d['updated_at'] for d in docs.values() if d.get('updated_at')]
+        last_modified = max(stamps).replace(microsecond=0, tzinfo=timezone.utc) if stamps else None
+        return token, last_modified
+
+
+def make_etag(full_path, token):
+    """Weak ETag value of a response: the request URL (with query string) and the tag versions."""
+    return hashlib.sha1(f"{full_path}#{token}".encode('utf-8')).hexdigest()
+
+
+def conditional(stamps, *tags):
+    """
+    Decorator for GET JSON views whose output only depends on the request and the given tags.
+    Adds a weak ETag (request URL + tag versions) and Last-Modified, and answers 304 when the
+    client's copy is current, without calling the view.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            if request.method != 'GET':
+                return view(*args, **kwargs)
+            token, last_modified = stamps.get(*tags)
+            etag = make_etag(request.full_path, token)
+            if request.if_none_match:
+                not_modified = request.if_none_match.contains_weak(etag)
+            else:
+                not_modified = bool(last_modified and request.if_modified_since and last_modified <= request.if_modified_since)
+            response = make_response('', 304) if not_modified else make_response(view(*args, **kwargs))
+            if response.status_code in (200, 304):
+                response.set_etag(etag, weak=True)
+                if last_modified:
+                    response.last_modified = last_modified
+                response.cache_control.no_cache = True  # always revalidate, 304 is cheap
+            return response
+        return wrapper
+    return decorator
+
+
+def choose_encoding(accept):
+    """'br', 'gzip' or None for a parsed Accept-Encoding header (werkzeug Accept)."""
+    if brotli is not None and accept['br'] and accept['br'] >= accept['gzip']:
+        return 'br'
+    if accept['gzip']:
+        return 'gzip'
+    return None
+
+
+def encode_body(data, encoding):
+    if encoding == 'br':
+        return brotli.compress(data, quality=5)
+    return gzip.compress(data, compresslevel=6)
+
+
+def decode_body(data, encoding):
+    if encoding == 'br':
+        return brotli.decompress(data)
+    return gzip.decompress(data) if encoding == 'gzip' else data
+
+
+def compress_response(response, min_size=1024):
+    """
+    after_request hook: gzip or brotli (if installed and preferred by the client) for text and
+    JSON responses. Streamed, partial and already encoded responses are left alone.
+    """
+    response.vary.add('Accept-Encoding')
+    if (
+        response.status_code != 200
+        or response.direct_passthrough
+        or response.is_streamed
+        or 'Content-Encoding' in response.headers
+        or response.mimetype not in COMPRESSIBLE_MIMETYPES
+        or request.method == 'HEAD'
+    ):
+        return response
+    encoding = choose_encoding(request.accept_encodings)
+    if not encoding:
+        return response
+    data = response.get_data()
+    if len(data) < min_size:
+        return response
+    response.set_data(encode_body(data, encoding))
+    response.headers['Content-Encoding'] = encoding
+    if response.get_etag()[0] and not response.get_etag()[1]:
+        # A strong validator must differ between encodings
+        response.set_etag(f"{response.get_etag()[0]}-{encoding}", weak=False)
+    return response
@@ -0,0 +1,190 @@
+import json
+import time
+import hashlib
+import functools
+import threading
+from datetime import datetime, timedelta
+from flask import request, make_response, jsonify, Response
+from pymongo.errors import DuplicateKeyError
+
+HEADER = 'Idempotency-Key'
+MAX_KEY_LENGTH = 255
+
+
+def request_fingerprint(method, path, body):
+    """Hash of what a request asks for: method, path and the JSON body in canonical form (raw bytes if not JSON)."""
+    try:
+        canonical = json.dumps(json.loads(body), sort_keys=True, separators=(',', ':')).encode('utf-8')
+    except ValueError:
+        canonical = body
+    return hashlib.sha256(method.encode('utf-8') + b' ' + path.encode('utf-8') + b'\n' + canonical).hexdigest()
+
+
+def record_id(scope, path, key):
+    """Keys are only unique per client, so records are scoped (e.g. by patient) and per endpoint."""
+    return hashlib.sha256(f"{scope}\n{path}\n{key}".encode('utf-8')).hexdigest()
+
+
+class InMemoryIdempotencyStore:
+    """Dev store: records in a dict, lost on restart and not shared between workers."""
+    def __init__(self, ttl=timedelta(hours=24), lease=timedelta(minutes=10)):
+        self.ttl = ttl
+        self.lease = lease
+        self._records = {}
+        self._lock = threading.Lock()
+
+    def begin(self, rid, fingerprint):
+        """See MongoIdempotencyStore.begin."""
+        now = datetime.utcnow()
+        with self._lock:
+            record = self._records.get(rid)
+            if record is None or record['expires_at'] <= now:
+                self._records[rid] = {'fingerprint': fingerprint, 'state': 'pending', 'lease_until': now + self.lease, 'expires_at': now + self.ttl}
+                return 'new', None
+            if record['fingerprint'] != fingerprint:
+                return 'mismatch', record
+            if record['state'] == 'done':
+                return 'replay', dict(record)
+            if record['lease_until'] <= now:
+                record['lease_until'] = now + self.lease  # the first attempt's worker died
+                return 'new', None
+            return 'in_progress', record
+
+    def complete(self, rid, status, body):
+        with self._lock:
+            record = self._records.get(rid)
+            if record:
+                record.update(state='done', status=status, body=body)
+
+    def abandon(self, rid):
+        with self._lock:
+            if self._records.get(rid, {}).get('state') == 'pending':
+                del self._records[rid]
+
+
+class MongoIdempotencyStore:
+    """
+    Idempotency records in the `idempotency_keys` collection: the request fingerprint and, once
+    the request has finished, its status and response body. A TTL index drops records `ttl`
+    after the first attempt. A pending record holds a lease, so a retry arriving while the first
+    attempt is still running waits for it instead of running the request again, and a retry
+    after a crashed worker's lease has expired runs it again.
+    """
+    def __init__(self, collection, ttl=timedelta(hours=24), lease=timedelta(minutes=10)):
+        self.collection = collection
+        self.ttl = ttl
+        self.lease = lease
+        self._indexes_ready = False
+
+    def ensure_indexes(self):
+        self.collection.create_index('expires_at', expireAfterSeconds=0)
+        self._indexes_ready = True
+
+    def begin(self, rid, fingerprint):
+        """
+        Claim a record for a request. Returns (state, record):
+        'new' (the caller runs the request), 'replay' (finished: record has status and body),
+        'in_progress' (another attempt holds the lease) or 'mismatch' (key reused for another request).
+        """
+        if not self._indexes_ready:
+            self.ensure_indexes()
+        now = datetime.utcnow()
+        pending = {'fingerprint': fingerprint, 'state': 'pending', 'lease_until': now + self.lease, 'expires_at': now + self.ttl}
+        try:
+            self.collection.insert_one({'_id': rid, **pending})
+            return 'new', None
+        except DuplicateKeyError:
+            pass
+        record = self.collection.find_one({'_id': rid})
+        if record is None:
+            # The attempt holding it was abandoned in between: try again
+            try:
+                self.collection.insert_one({'_id': rid, **pending})
+                return 'new', None
+            except DuplicateKeyError:
+                return 'in_progress', None
+        if record['expires_at'] <= now:
+            # Expired but not purged yet (the TTL monitor runs once a minute): start over
+            taken = self.collection.find_one_and_update(
+                {'_id': rid, 'expires_at': record['expires_at']},
+                {'$set': pending, '$unset': {'status': '', 'body': ''}}
+            )
+            return ('new', None) if taken else ('in_progress', None)
+        if record['fingerprint'] != fingerprint:
+            return 'mismatch', record
+        if record['state'] == 'done':
+            return 'replay', record
+        if record['lease_until'] <= now:
+            taken = self.collection.find_one_and_update(
+                {'_id': rid, 'state': 'pending', 'lease_until': record['lease_until']},
+                {'$set': {'lease_until': now + self.lease}}
+            )
+            if taken:
+                return 'new', None
+        return 'in_progress', record
+
+    def complete(self, rid, status, body):
+        self.collection.update_one({'_id': rid}, {'$set': {'state': 'done', 'status': status, 'body': body}, '$unset': {'lease_until': ''}})
+
+    def abandon(self, rid):
+        """Drop the pending record of a failed attempt, so a retry runs the request again."""
+        self.collection.delete_one({'_id': rid, 'state': 'pending'})
+
+
+def key_error(key):
+    """Error message for an unusable Idempotency-Key header value, or None."""
+    if not key or len(key) > MAX_KEY_LENGTH or not key.isprintable():
+        return f'{HEADER} must be 1-{MAX_KEY_LENGTH} printable characters.'
+    return None
+
+
+def idempotent(store, scope, wait=120.0, poll_interval=0.5):
+    """
+    Decorator for POST JSON views that clients retry: with an Idempotency-Key header, the first
+    request runs the view and its response (2xx or 4xx) is stored; a retry with the same key and
+    body gets the stored response (with Idempotent-Replayed: true) without running the view.
+    A retry arriving while the first attempt is still running waits up to `wait` seconds for its
+    result, then gets 409 with Retry-After. Reusing a key for a different body is rejected with 422.
+    5xx responses and exceptions release the key. Keys are scoped by scope() (e.g. the session's
+    patient); requests without a key or scope run the view as usual.
+    """
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            key = request.headers.get(HEADER)
+            owner = scope() if key is not None else None
+            if not owner:
+                return view(*args, **kwargs)
+            message = key_error(key)
+            if message:
+                return jsonify({'status': 'error', 'message': message}), 400
+            rid = record_id(owner, request.path, key)
+            fingerprint = request_fingerprint(request.method, request.path, request.get_data())
+            deadline = time.monotonic() + wait
+            while True:
+                state, record = store.begin(rid, fingerprint)
+                if state != 'in_progress':
+                    break
+                if time.monotonic() >= deadline:
+                    response = jsonify({'status': 'error', 'message': 'A request with this Idempotency-Key is still in progress.'})
+                    response.headers['Retry-After'] = '5'
+                    return response, 409
+                time.sleep(poll_interval)
+            if state == 'mismatch':
+                return jsonify({'status': 'error', 'message': f'{HEADER} was already used for a different request.'}), 422
+            if state == 'replay':
+                response = Response(record['body'], status=record['status'], mimetype='application/json')
+                response.headers['Idempotent-Replayed'] = 'true'
+                return response
+            try:
+                response = make_response(view(*args, **kwargs))
+            except BaseException:
+                store.abandon(rid)
+                raise
+            if response.status_code >= 500 or response.is_streamed:
+                store.abandon(rid)
+            else:
+                store.complete(rid, response.status_code, response.get_data(as_text=True))
+            return response
+        return wrapper
+    return decorator
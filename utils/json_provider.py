@@ -0,0 +1,53 @@
+from bson import ObjectId
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import orjson
+except ImportError:  # optional: the stdlib encoder is used instead
+    orjson = None
+
+
+class MongoJSONProvider(DefaultJSONProvider):
+    """
+    JSON provider for jsonify() and the |tojson template filter that encodes Mongo documents
+    directly: ObjectId becomes its hex string, datetimes keep Flask's HTTP date format.
+    Values are converted while encoding, so documents do not need to be copied first.
+    When orjson is installed it does the encoding (falling back to the stdlib encoder for
+    anything orjson rejects, e.g. integers beyond 64 bits). Non-ASCII text (Hebrew stories) is
+    written as UTF-8 rather than \\u escapes in both cases.
+    """
+    ensure_ascii = False
+
+    @staticmethod
+    def default(o):
+        if isinstance(o, ObjectId):
+            return str(o)
+        return DefaultJSONProvider.default(o)
+
+    def _orjson_dumps(self, obj, sort_keys, indent):
+        option = orjson.OPT_NON_STR_KEYS | orjson.OPT_PASSTHROUGH_DATETIME | orjson.OPT_PASSTHROUGH_DATACLASS
+        if sort_keys:
+            option |= orjson.OPT_SORT_KEYS
+        if indent:
+            option |= orjson.OPT_INDENT_2
+        return orjson.dumps(obj, default=self.default, option=option)
+
+    def dumps(self, obj, **kwargs):
+        # Only the options orjson can reproduce go through it; anything else uses json.dumps
+        if orjson is not None and set(kwargs) <= {'sort_keys'}:
+            try:
+                return self._orjson_dumps(obj, kwargs.get('sort_keys', self.sort_keys), False).decode('utf-8')
+            except TypeError:
+                pass
+        return super().dumps(obj, **kwargs)
+
+    def response(self, *args, **kwargs):
+        if orjson is None:
+            return super().response(*args, **kwargs)
+        obj = self._prepare_response_obj(args, kwargs)
+        indent = (self.compact is None and self._app.debug) or self.compact is False
+        try:
+            body = self._orjson_dumps(obj, self.sort_keys, indent) + b'\n'
+        except TypeError:
+            return super().response(*args, **kwargs)
+        return self._app.response_class(body, mimetype=self.mimetype)
@@ -0,0 +1,39 @@
+import threading
+
+
+class LazyService:
+    """
+    Stand-in for a module-level service that is built on first use.
+    Attribute access is forwarded to the object returned by `factory`, which runs once
+    (thread-safe) the first time the service is used, so importing a module that declares
+    services does no I/O. resolve() builds and returns the real object; reset() drops it so
+    the next use builds a new one (create_app() does this for every app it creates).
+    """
+    def __init__(self, factory):
+        self._factory = factory
+        self._target = None
+        self._lock = threading.Lock()
+
+    def resolve(self):
+        target = self._target
+        if target is None:
+            with self._lock:
+                if self._target is None:
+                    self._target = self._factory()
+                target = self._target
+        return target
+
+    @property
+    def built(self):
+        return self._target is not None
+
+    def reset(self):
+        with self._lock:
+            self._target = None
+
+    def __getattr__(self, name):
+        # Only called for attributes not found on the proxy itself
+        return getattr(self.resolve(), name)
+
+    def __repr__(self):
+        return f"<LazyService {self._target!r}>" if self.built else "<LazyService (not built)>"
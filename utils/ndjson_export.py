@@ -0,0 +1,87 @@
+import zlib
+from datetime import datetime
+from bson import ObjectId, json_util
+from bson.errors import InvalidId
+from bson.json_util import RELAXED_JSON_OPTIONS
+
+# Exportable collections: name -> (collection, patient filter field)
+EXPORTS = {
+    'stories': ('stories', 'patient_id'),
+    'feedback': ('session_feedback', 'patient_id'),
+    'audit': ('audit', 'patient_id'),
+}
+
+BATCH_SIZE = 500
+LINES_PER_CHUNK = 100
+
+
+def _parse_date(value, name):
+    try:
+        return datetime.fromisoformat(value)
+    except ValueError:
+        raise ValueError(f'Invalid {name} date: {value}')
+
+
+def build_export_query(args, patient_field):
+    """
+    Build the Mongo filter for an export from the request query parameters:
+    - patient_id: only this patient's documents
+    - start / end: ISO dates, inclusive start and exclusive end on `timestamp`
+    - resume_after: `_id` of the last record received by an interrupted download
+    Raises ValueError on malformed parameters.
+    """
+    query = {}
+    if args.get('patient_id'):
+        query[patient_field] = args['patient_id']
+    time_range = {}
+    if args.get('start'):
+        time_range['$gte'] = _parse_date(args['start'], 'start')
+    if args.get('end'):
+        time_range['$lt'] = _parse_date(args['end'], 'end')
+    if time_range:
+        query['timestamp'] = time_range
+    if args.get('resume_after'):
+        try:
+            query['_id'] = {'$gt': ObjectId(args['resume_after'])}
+        except (InvalidId, TypeError):
+            raise ValueError('Invalid resume_after token')
+    return query
+
+
+def iter_ndjson(collection, query, hydrate=None):
+    """
+    Stream documents as NDJSON (one Extended JSON document per line) in `_id` order,
+    so the `_id` of the last complete line can be used as the resume token.
+    Yields encoded chunks of LINES_PER_CHUNK lines; memory use does not depend on the result size.
+    - hydrate: optional callable applied to each chunk of documents before encoding
+      (e.g. StoryStore.hydrate to inline compressed story content)
+    """
+    cursor = collection.find(query).sort('_id', 1).batch_size(BATCH_SIZE)
+    docs = []
+    try:
+        for doc in cursor:
+            docs.append(doc)
+            if len(docs) >= LINES_PER_CHUNK:
+                yield _encode_lines(docs, hydrate)
+                docs = []
+        if docs:
+            yield _encode_lines(docs, hydrate)
+    finally:
+        cursor.close()
+
+
+def _encode_lines(docs, hydrate):
+    if hydrate:
+        hydrate(docs)
+    lines = [json_util.dumps(doc, json_options=RELAXED_JSON_OPTIONS, ensure_ascii=False) for doc in docs]
+    return ('\n'.join(lines) + '\n').encode('utf-8')
+
+
+def gzip_chunks(chunks):
+    """Gzip-compress a stream of byte chunks on the fly."""
+    compressor = zlib.compressobj(6, zlib.DEFLATED, 31)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
@@ -0,0 +1,155 @@
+import base64
+import binascii
+from bson import json_util
+from pymongo import ASCENDING, DESCENDING
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 200
+
+
+def encode_cursor(values):
+    """Encode the sort key values of the last returned document as an opaque token."""
+    raw = json_util.dumps(values).encode('utf-8')
+    return base64.urlsafe_b64encode(raw).decode('ascii').rstrip('=')
+
+
+def decode_cursor(token):
+    """Decode a token produced by encode_cursor. Raises ValueError if it was tampered with."""
+    try:
+        padded = token + '=' * (-len(token) % 4)
+        values = json_util.loads(base64.urlsafe_b64decode(padded.encode('ascii')))
+    except (binascii.Error, UnicodeError, ValueError, TypeError) as e:
+        raise ValueError('Invalid cursor') from e
+    if not isinstance(values, list):
+        raise ValueError('Invalid cursor')
+    return values
+
+
+def _covers(parent, field):
+    """True if projecting `parent` already returns `field` (same path or a dotted sub-path of it)."""
+    return field == parent or field.startswith(parent + '.')
+
+
+def parse_fields(fields_param):
+    """
+    Turn a `fields=a,b,c` query parameter into a Mongo projection.
+    Returns None when no fields were requested (i.e. return the full document).
+    Raises ValueError on invalid or overlapping paths (e.g. `a,a.b`), which Mongo rejects.
+    """
+    if not fields_param:
+        return None
+    fields = [f.strip() for f in fields_param.split(',') if f.strip()]
+    for field in fields:
+        if field.startswith('$') or '..' in field or field.startswith('.') or field.endswith('.'):
+            raise ValueError(f'Invalid field name: {field}')
+    for i, field in enumerate(fields):
+        for other in fields[i + 1:]:
+            if _covers(field, other) or _covers(other, field):
+                raise ValueError(f'Overlapping fields: {field}, {other}')
+    return {f: 1 for f in fields} or None
+
+
+def parse_limit(limit_param, default=DEFAULT_PAGE_SIZE, maximum=MAX_PAGE_SIZE):
+    """Clamp a `limit=` query parameter into [1, maximum]."""
+    if limit_param in (None, ''):
+        return default
+    try:
+        limit = int(limit_param)
+    except (TypeError, ValueError):
+        raise ValueError('Invalid limit')
+    return max(1, min(limit, maximum))
+
+
+def parse_order(order_param):
+    """`order=asc|desc` (default asc) as a sort direction."""
+    if order_param in (None, '', 'asc'):
+        return ASCENDING
+    if order_param == 'desc':
+        return DESCENDING
+    raise ValueError('Invalid order')
+
+
+def _range_query(sort, values):
+    """Build the "strictly after the cursor" filter for a (possibly compound) sort."""
+    clauses = []
+    for i, (field, direction) in enumerate(sort):
+        clause = {sort[j][0]: values[j] for j in range(i)}
+        clause[field] = {'$gt' if direction == 1 else '$lt': values[i]}
+        clauses.append(clause)
+    return clauses[0] if len(clauses) == 1 else {'$or': clauses}
+
+
+def _page_spec(query, projection, cursor, sort):
+    """The (query, projection, sort) to run for a page; the extra sort keys are projected so the next cursor can be built."""
+    sort = list(sort or [])
+    if not any(field == '_id' for field, _ in sort):
+        sort.append(('_id', 1))
+    query = dict(query or {})
+    if cursor:
+        values = decode_cursor(cursor)
+        if len(values) != len(sort):
+            raise ValueError('Invalid cursor')
+        query = {'$and': [query, _range_query(sort, values)]} if query else _range_query(sort, values)
+    if projection is not None:
+        projection = dict(projection)
+        for field, _ in sort:
+            if any(_covers(parent, field) for parent in projection):
+                continue
+            # A requested sub-path of a sort key would collide with it; the sort key returns it anyway
+            projection = {f: v for f, v in projection.items() if not _covers(field, f)}
+            projection[field] = 1
+    return query, projection, sort
+
+
+def _page_result(docs, sort, limit, keep_id):
+    next_cursor = None
+    if len(docs) > limit:
+        docs = docs[:limit]
+        last = docs[-1]
+        next_cursor = encode_cursor([last.get(field) for field, _ in sort])
+    if not keep_id:
+        for doc in docs:
+            doc.pop('_id', None)
+    return docs, next_cursor
+
+
+def paginate(collection, query=None, projection=None, cursor=None, limit=DEFAULT_PAGE_SIZE, sort=None, keep_id=False):
+    """
+    Return one page of documents from `collection` and the cursor for the next page.
+    - sort: list of (field, direction); `_id` is always appended as the tie breaker so the
+      order is total and every key is covered by an index.
+    - projection: inclusion projection (from parse_fields) or None for the whole document.
+    The `_id` field is stripped from the returned documents (like the existing endpoints do)
+    unless keep_id is set.
+    Returns: (documents, next_cursor or None)
+    """
+    query, projection, sort = _page_spec(query, projection, cursor, sort)
+    docs = list(collection.find(query, projection).sort(sort).limit(limit + 1))
+    return _page_result(docs, sort, limit, keep_id)
+
+
+async def apaginate(collection, query=None, projection=None, cursor=None, limit=DEFAULT_PAGE_SIZE, sort=None, keep_id=False):
+    """paginate() for a motor (asyncio) collection."""
+    query, projection, sort = _page_spec(query, projection, cursor, sort)
+    docs = await collection.find(query, projection).sort(sort).limit(limit + 1).to_list(None)
+    return _page_result(docs, sort, limit, keep_id)
+
+
+def paginate_args(collection, args, query=None, sort=None, default_fields=None, keep_id=False):
+    """
+    Paginate using the standard list-endpoint query parameters: `cursor`, `limit`, `fields` and,
+    for endpoints without a sort of their own, `order` (asc/desc by insertion, i.e. `_id`).
+    Raises ValueError on malformed parameters.
+    """
+    projection = parse_fields(args.get('fields')) or default_fields
+    limit = parse_limit(args.get('limit'))
+    sort = sort or [('_id', parse_order(args.get('order')))]
+    return paginate(collection, query=query, projection=projection, cursor=args.get('cursor'), limit=limit, sort=sort, keep_id=keep_id)
+
+
+async def apaginate_args(collection, args, query=None, sort=None, default_fields=None, keep_id=False):
+    """paginate_args() for a motor (asyncio) collection."""
+    projection = parse_fields(args.get('fields')) or default_fields
+    limit = parse_limit(args.get('limit'))
+    sort = sort or [('_id', parse_order(args.get('order')))]
+    return await apaginate(collection, query=query, projection=projection, cursor=args.get('cursor'), limit=limit, sort=sort, keep_id=keep_id)
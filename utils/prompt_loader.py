@@ -1,10 +1,12 @@
 import os
+import functools
 
 PROMPT_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), 'prompts')
 
+@functools.lru_cache(maxsize=None)
 def load_prompt(prompt_name):
     """
-    Load a prompt file from the prompts directory by filename.
+    Load a prompt file from the prompts directory by filename (read once, then cached).
     Usage: load_prompt('plan_gen_prompt.txt')
     """
     path = os.path.join(PROMPT_DIR, prompt_name)
@@ -0,0 +1,180 @@
+import os
+import secrets
+import threading
+from datetime import datetime
+from flask.sessions import SessionInterface, SessionMixin
+from flask.json.tag import TaggedJSONSerializer
+
+
+class ServerSideSession(SessionMixin):
+    """
+    Session whose data lives on the server; the cookie only carries the session id.
+    The data is loaded from the backend on first access, so requests that never touch
+    the session never hit the store.
+    """
+    def __init__(self, sid, loader=None, new=False):
+        self.sid = sid
+        self.new = new
+        self.modified = False
+        self.accessed = False
+        self._loader = loader
+        self._data = None
+
+    @property
+    def loaded(self):
+        return self._data is not None
+
+    def _load(self):
+        self.accessed = True
+        if self._data is None:
+            data = self._loader() if self._loader else None
+            if data is None and not self.new:
+                # Unknown or expired id: never adopt a client-chosen id, issue a fresh one
+                self.sid = secrets.token_urlsafe(32)
+                self.new = True
+            self._data = data or {}
+        return self._data
+
+    def __getitem__(self, key):
+        return self._load()[key]
+
+    def __setitem__(self, key, value):
+        self._load()[key] = value
+        self.modified = True
+
+    def __delitem__(self, key):
+        del self._load()[key]
+        self.modified = True
+
+    def __iter__(self):
+        return iter(self._load())
+
+    def __len__(self):
+        return len(self._load())
+
+    def clear(self):
+        self._data = {}
+        self.accessed = True
+        self.modified = True
+
+
+class InMemorySessionBackend:
+    """Dev backend: sessions in a dict, lost on restart and not shared between workers."""
+    def __init__(self):
+        self._sessions = {}  # sid: (expires_at, data)
+        self._lock = threading.Lock()
+
+    def load(self, sid):
+        with self._lock:
+            entry = self._sessions.get(sid)
+            if entry and entry[0] > datetime.utcnow():
+                return dict(entry[1])
+            self._sessions.pop(sid, None)
+            return None
+
+    def save(self, sid, data, expires_at):
+        with self._lock:
+            self._sessions[sid] = (expires_at, dict(data))
+
+    def delete(self, sid):
+        with self._lock:
+            self._sessions.pop(sid, None)
+
+
+class FileSessionBackend:
+    """Dev backend: one JSON file per session, survives the reloader restarting the process."""
+    def __init__(self, directory):
+        self.directory = directory
+        self.serializer = TaggedJSONSerializer()
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, sid):
+        return os.path.join(self.directory, f"{sid}.json")
+
+    def load(self, sid):
+        try:
+            with open(self._path(sid), encoding='utf-8') as f:
+                entry = self.serializer.loads(f.read())
+        except (OSError, ValueError):
+            return None
+        if entry['expires_at'] <= datetime.utcnow().timestamp():
+            self.delete(sid)
+            return None
+        return entry['data']
+
+    def save(self, sid, data, expires_at):
+        tmp_path = self._path(sid) + '.tmp'
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(self.serializer.dumps({'expires_at': expires_at.timestamp(), 'data': dict(data)}))
+        os.replace(tmp_path, self._path(sid))
+
+    def delete(self, sid):
+        try:
+            os.remove(self._path(sid))
+        except OSError:
+            pass
+
+
+class MongoSessionBackend:
+    """Production backend: a `sessions` collection whose TTL index purges expired sessions."""
+    def __init__(self, collection):
+        self.collection = collection
+        self._indexes_ready = False
+
+    def ensure_indexes(self):
+        self.collection.create_index('expires_at', expireAfterSeconds=0)
+        self._indexes_ready = True
+
+    def load(self, sid):
+        # The TTL monitor only runs once a minute, so check expiry here too
+        doc = self.collection.find_one({'_id': sid, 'expires_at': {'$gt': datetime.utcnow()}}, {'data': 1})
+        return doc['data'] if doc else None
+
+    def save(self, sid, data, expires_at):
+        if not self._indexes_ready:
+            self.ensure_indexes()
+        self.collection.replace_one({'_id': sid}, {'data': dict(data), 'expires_at': expires_at}, upsert=True)
+
+    def delete(self, sid):
+        self.collection.delete_one({'_id': sid})
+
+
+class ServerSideSessionInterface(SessionInterface):
+    """
+    Flask session interface storing session data in a backend (see the *SessionBackend classes).
+    Sessions are written only when modified and expire `permanent_session_lifetime` after the
+    last write.
+    """
+    def __init__(self, backend):
+        self.backend = backend
+
+    def open_session(self, app, request):
+        sid = request.cookies.get(self.get_cookie_name(app))
+        if sid and len(sid) <= 64:
+            return ServerSideSession(sid, loader=lambda: self.backend.load(sid))
+        return ServerSideSession(secrets.token_urlsafe(32), new=True)
+
+    def save_session(self, app, session, response):
+        name = self.get_cookie_name(app)
+        domain = self.get_cookie_domain(app)
+        path = self.get_cookie_path(app)
+        if session.accessed:
+            response.vary.add('Cookie')
+        if not session.modified:
+            return
+        if not session.loaded or not len(session):
+            self.backend.delete(session.sid)
+            if not session.new:
+                response.delete_cookie(name, domain=domain, path=path)
+            return
+        self.backend.save(session.sid, session, datetime.utcnow() + app.permanent_session_lifetime)
+        response.set_cookie(
+            name,
+            session.sid,
+            expires=self.get_expiration_time(app, session),
+            httponly=self.get_cookie_httponly(app),
+            domain=domain,
+            path=path,
+            secure=self.get_cookie_secure(app),
+            samesite=self.get_cookie_samesite(app)
+        )
@@ -0,0 +1,15 @@
+import datetime
+
+
+def naive_utc(value):
+    """A datetime as naive UTC, the form timestamps are stored and compared in; naive values are taken as UTC."""
+    if value is not None and value.tzinfo:
+        return value.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+    return value
+
+
+def parse_utc(value):
+    """Parse a client-supplied ISO 8601 timestamp to naive UTC. Raises ValueError if it is not one."""
+    if not isinstance(value, str):
+        raise ValueError(f'Timestamp must be an ISO 8601 string, got {value!r}')
+    return naive_utc(datetime.datetime.fromisoformat(value))
@@ -0,0 +1,54 @@
+import time
+import threading
+
+
+class TTLCache:
+    """
+    Small thread-safe in-process cache.
+    Entries expire after `ttl` seconds and can be tagged (e.g. with the collections they were
+    computed from) so write paths can drop them early with invalidate(tag).
+    """
+    def __init__(self, ttl=30, max_entries=256):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries = {}  # key: (expires_at, value, tags)
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return default
+            if entry[0] <= time.monotonic():
+                del self._entries[key]
+                return default
+            return entry[1]
+
+    def set(self, key, value, ttl=None, tags=()):
+        expires_at = time.monotonic() + (self.ttl if ttl is None else ttl)
+        with self._lock:
+            if len(self._entries) >= self.max_entries and key not in self._entries:
+                # Evict the entry closest to expiry
+                oldest = min(self._entries, key=lambda k: self._entries[k][0])
+                del self._entries[oldest]
+            self._entries[key] = (expires_at, value, frozenset(tags))
+
+    def get_or_set(self, key, compute, ttl=None, tags=()):
+        """Return the cached value for key, computing and storing it on a miss."""
+        missing = object()
+        value = self.get(key, missing)
+        if value is missing:
+            value = compute()
+            self.set(key, value, ttl=ttl, tags=tags)
+        return value
+
+    def invalidate(self, *tags):
+        """Drop every entry carrying any of the given tags."""
+        tags = set(tags)
+        with self._lock:
+            for key in [k for k, entry in self._entries.items() if entry[2] & tags]:
+                del self._entries[key]
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()